@@ -8,6 +8,25 @@ import time
 import datetime
 import json
 import os
+import threading
+import collections
+
+from 下单网关 import OrderGateway
+from 排序选取 import top_k_items, top_fraction_items
+from K线合成 import BarResampler, align_frames, bar_end_label, session_minutes, PERIOD_MINUTES
+from 惰性数据 import LazyDataContext
+from 策略流水线 import StagePipeline, FREQUENCY_TICK
+from 交易日缓存 import TradingDayMemo
+from 状态快照 import StateSnapshot, SnapshotError
+from 证券代码表 import SymbolTable
+from 板块热度 import SectorMembership, SectorHeatTracker
+from 做T行情 import HoldingQuoteFeed, ReplayQuoteSource
+from 数据限流 import RateLimitedDataClient, DataRequestError
+from 风险协方差 import EWMACovariance, targeted_reduction_ratios
+from 止盈止损 import StopEngine, EXIT_DRAWDOWN, EXIT_HARD_STOP
+from 调用录制 import CallCassette
+from 绩效统计 import PerformanceTracker, periods_per_year_of
+from 交易日志 import TradeJournal
 
 # 定义主要板块映射 - 全局变量
 sectors = {
@@ -67,6 +86,54 @@ current_date = ""
 # 全局变量存储沪深300指数20日均线状态
 hs300_ma20_condition = False
 
+# 首次请求5分钟线的数量：120分钟线需要20根，约10个交易日，按自然日预留
+INTRADAY_5M_COUNT = 720
+
+# 流水线并发线程数：默认1(各阶段在策略线程中依次运行)，确认平台行情接口支持多线程调用后可调大，行情分析阶段并发请求数据
+PIPELINE_WORKERS = 1
+
+# 行情接口访问层：每秒最多请求数(None表示不限速)、突发请求数、同时请求数、失败重试次数、每次请求的股票数
+DATA_RATE = 50
+DATA_BURST = 10
+DATA_CONCURRENCY = 2
+DATA_RETRIES = 3
+DATA_CHUNK_SIZE = 500
+
+# 日线级别结果（指数均线状态、风险等级、板块热度）的盘中刷新间隔(分钟)，None表示每个交易日只计算一次
+DAILY_REFRESH_MINUTES = None
+
+# 板块热度：滚动汇总的交易日数，以及盘中按最新行情刷新板块热度的间隔(分钟)
+SECTOR_WINDOW_DAYS = 5
+SECTOR_REFRESH_MINUTES = 5
+
+# 组合风险：EWMA衰减系数、参与计算所需的最少收益率观测数、新增持仓时初始化协方差使用的历史K线数
+RISK_DECAY = 0.94
+RISK_MIN_PERIODS = 20
+RISK_SEED_BARS = 60
+
+# 做T模式：'quote'订阅持仓股票实时行情，逐笔执行做T规则（回测时回放本地K线）；'bar'每根K线轮询盘中K线
+T_TRADING_MODE = 'quote'
+# 做T仓位上限：做T仓位最多为初始做T仓位(持仓的50%)的倍数；每根15分钟K线最多做T买入、卖出各一次
+T_POSITION_LIMIT = 2.0
+
+# 调用录制：'record'把平台数据调用及结果录制到CASSETTE_PATH，'replay'从录制文件回放不访问平台，None为关闭
+# 回放要求与录制时的调用顺序一致，只修改交易逻辑后重跑同一区间时可直接回放，缺失的调用在stop时列出
+CASSETTE_MODE = None
+CASSETTE_PATH = os.path.join(os.path.expanduser('~'), 'strategy_cassettes', '20250923策略.cassette')
+CASSETTE_CALLS = ['get_market_data_ex', 'get_stock_list_in_sector', 'get_stock_name', 'get_open_date', 'get_float_caps']
+
+# 状态快照：实盘每根K线结束时保存，重启后在init中恢复（回测不读写快照）
+SNAPSHOT_DIR = os.path.join(os.path.expanduser('~'), 'strategy_snapshots', '20250923策略')
+SNAPSHOT_SCHEMA_VERSION = 1  # 快照中的状态字段变化时递增，旧快照将被忽略
+SNAPSHOT_INTERVAL = 10  # 同一根K线内重复保存的最小间隔(秒)
+
+# 绩效统计：实盘净值曲线逐K线追加写入PERFORMANCE_PATH，重启后由文件恢复；回测只在内存中统计
+PERFORMANCE_PATH = os.path.join(os.path.expanduser('~'), 'strategy_performance', '20250923策略.equity')
+
+# 交易日志：实盘每笔下单意图和平台回报按交易日写入JOURNAL_DIR，用TradeJournalReader按日期、股票、原因查询
+JOURNAL_DIR = os.path.join(os.path.expanduser('~'), 'strategy_journal', '20250923策略')
+JOURNAL_FLUSH_INTERVAL = 1.0  # 后台写盘间隔(秒)
+
 
 def calculate_start_date(end_date_str, count, period='1d'):
     """
@@ -113,6 +180,9 @@ def init(ContextInfo):
     """
     策略初始化函数
     """
+    # 调用录制/回放需在任何数据请求之前安装
+    ContextInfo.cassette = install_cassette(ContextInfo) if CASSETTE_MODE else None
+    
     # 设置策略参数
     ContextInfo.portfolio_size = 5  # 持仓股票数量
     ContextInfo.max_position_ratio = 0.1  # 单只股票最大仓位
@@ -125,11 +195,47 @@ def init(ContextInfo):
     
     # 初始化变量
     ContextInfo.selected_stocks = []  # 选股池
-    ContextInfo.position_info = {}  # 持仓信息
     ContextInfo.t_holdings = {}  # 做T持仓信息
+    ContextInfo.t_lock = threading.RLock()  # 做T信息在行情回调和下单网关回调中都会修改
     ContextInfo.sector_heat = {}  # 板块热度
     ContextInfo.last_trade_time = {}  # 最后交易时间
     ContextInfo.market_risk_level = 0  # 市场风险等级
+    ContextInfo.risk_model = EWMACovariance(decay=RISK_DECAY, min_periods=RISK_MIN_PERIODS)  # 持仓与基准的EWMA协方差
+    ContextInfo.portfolio_risk = None  # 组合风险指标
+    ContextInfo.symbols = SymbolTable()  # 股票代码 <-> 整数编号，持仓对象的代码只拼接一次
+    ContextInfo.stop_engine = StopEngine(ContextInfo.symbols, hold_days_range=(7, 10))  # 持仓信息及止盈止损
+    ContextInfo.bar_resampler = BarResampler(periods=('5m', '15m', '120m', '1d'))  # 多周期K线本地合成
+    ContextInfo.data_client = RateLimitedDataClient(
+        ContextInfo, rate=DATA_RATE, burst=DATA_BURST, max_concurrency=DATA_CONCURRENCY, max_retries=DATA_RETRIES,
+        chunk_size=DATA_CHUNK_SIZE, logger=lambda message: print("[{}] {}".format(current_date, message)))  # 限速重试的批量取数
+    ContextInfo.lazy_data = LazyDataContext(ContextInfo)  # 惰性数据请求及未读取统计
+    ContextInfo.daily_memo = TradingDayMemo(
+        refresh_interval=DAILY_REFRESH_MINUTES * 60 if DAILY_REFRESH_MINUTES else None)  # 日线级别结果按交易日缓存
+    ContextInfo.t_quotes = build_t_quote_feed(ContextInfo) if T_TRADING_MODE == 'quote' else None  # 做T行情订阅
+    ContextInfo.pipeline = build_pipeline(ContextInfo)  # 策略阶段流水线
+    live = not getattr(ContextInfo, 'do_back_test', False)
+    ContextInfo.performance = PerformanceTracker(
+        PERFORMANCE_PATH if live else None, periods_per_year=periods_per_year_of(getattr(ContextInfo, 'period', '1d')),
+        resume=live)  # 绩效统计
+    ContextInfo.journal = TradeJournal(
+        JOURNAL_DIR, clock=lambda: ContextInfo.get_bar_timetag(ContextInfo.barpos),
+        flush_interval=JOURNAL_FLUSH_INTERVAL) if live else None  # 交易日志
+    
+    # 状态快照：恢复上次运行的持仓信息、做T信息、板块热度及指标缓存
+    ContextInfo.snapshot = StateSnapshot(SNAPSHOT_DIR, '20250923策略', SNAPSHOT_SCHEMA_VERSION)
+    ContextInfo.last_snapshot_bar = None
+    ContextInfo.last_snapshot_time = 0
+    if not getattr(ContextInfo, 'do_back_test', False):
+        restore_state(ContextInfo)
+    
+    # 下单网关：订单排队，每根K线在策略线程中批量提交(平台下单接口不在工作线程调用)，回报通过回调写回策略状态
+    ContextInfo.order_gateway = OrderGateway(
+        submit_func=lambda order: order_shares(order.stock_code, order.shares, order.order_type, order.price, ContextInfo, order.strategy_name),
+        on_result=lambda order: handle_order_result(ContextInfo, order),
+        on_reject=lambda order: handle_order_reject(ContextInfo, order),
+        on_submit=lambda order: handle_order_submit(ContextInfo, order),
+        background=False
+    )
     
     # 设置基准
     ContextInfo.benchmark = "000300.SH"  # 沪深300指数
@@ -137,6 +243,18 @@ def init(ContextInfo):
     # 日志记录
     print("策略初始化完成")
 
+def install_cassette(ContextInfo):
+    """
+    安装调用录制：ContextInfo的数据接口和平台全局函数get_trade_detail_data改为经录制文件调用
+    """
+    global get_trade_detail_data
+    cassette = CallCassette(CASSETTE_PATH, CASSETTE_MODE, clock=lambda: getattr(ContextInfo, 'barpos', None),
+                            logger=lambda message: print("[{}] {}".format(current_date, message)))
+    cassette.install(ContextInfo, CASSETTE_CALLS)
+    get_trade_detail_data = cassette.wrap('get_trade_detail_data', globals().get('get_trade_detail_data'))
+    print("调用录制已启用: {}, 文件: {}".format(CASSETTE_MODE, CASSETTE_PATH))
+    return cassette
+
 def handlebar(ContextInfo):
     """
     主要处理函数，每个K线周期执行一次
@@ -151,57 +269,20 @@ def handlebar(ContextInfo):
         # 记录日志
         print("[{}] 开始执行策略，时间: {}, 当前索引: {}".format(current_date, current_date, current_index))
         
-        # 每天检查一次沪深300指数20日均线状态
-        global hs300_ma20_condition
-        hs300_ma20_condition = check_hs300_ma20_condition(ContextInfo)
-        print("[{}] 沪深300指数20日均线状态: {}".format(current_date, hs300_ma20_condition))
+        # 2-8. 按流水线调度各阶段：只运行输入变化或上游重新计算过的阶段
+        ran_stages = ContextInfo.pipeline.run(ContextInfo, bar_key=current_time, day_key=current_date[:10])
+        print("[{}] 本轮运行阶段: {}".format(current_date, ", ".join(ran_stages) if ran_stages else "无"))
         
-        # 2. 风险评估
-        risk_check(ContextInfo)
-        
-        # 3. 板块轮动分析
-        sector_analysis(ContextInfo)
+        # 提交行情回调中排队的做T订单(各阶段自己的订单已在阶段内提交)
+        if ContextInfo.order_gateway.pending_count():
+            flush_orders(ContextInfo)
         
-        # 4. 选股逻辑执行 - 进一步优化执行条件
-        # 为了确保策略能正常进入选股逻辑，我们增加多种触发条件：
-        # 1) 第一次运行时执行选股
-        # 2) 每隔10个周期执行一次选股
-        # 3) 如果当前未持有任何股票，也执行选股
-        should_select_stocks = False
+        # 9. 更新绩效统计
+        update_performance(ContextInfo, current_time)
         
-        # 条件1: 第一次运行
-        if current_index == 0:
-            should_select_stocks = True
-            print("[{}] 首次运行，执行选股逻辑".format(current_date))
-        
-        # 条件2: 每隔10个周期
-        elif current_index % 10 == 0:
-            should_select_stocks = True
-            print("[{}] 按周期执行选股逻辑，当前索引: {}".format(current_date, current_index))
-        
-        # 条件3: 检查当前持仓，如果未持有股票也执行选股
-        else:
-            current_positions = get_holdings(ContextInfo, "STOCK")
-            if not current_positions:  # 没有持仓
-                should_select_stocks = True
-                print("[{}] 当前无持仓，执行选股逻辑".format(current_date))
-        
-        if should_select_stocks:
-            select_stocks(ContextInfo)
-        else:
-            print("[{}] 跳过选股逻辑，当前索引: {}".format(current_date, current_index))
-        
-        # 5. 买卖决策生成
-        trade_decision(ContextInfo)
-        
-        # 6. 做T交易执行
-        t_trading(ContextInfo)
-        
-        # 7. 止盈止损检查
-        check_stop_loss_take_profit(ContextInfo)
-        
-        # 8. 避险判断
-        risk_avoidance(ContextInfo)
+        # 10. 保存状态快照
+        if not getattr(ContextInfo, 'do_back_test', False):
+            save_state(ContextInfo, current_time)
         
         print("[{}] 策略执行完成".format(current_date))
         
@@ -209,6 +290,293 @@ def handlebar(ContextInfo):
         print("[{}] 策略执行异常: {}".format(current_date, str(e)))
 
 
+def build_pipeline(ContextInfo):
+    """
+    构建策略流水线
+    各阶段声明输入数据、上游阶段和重算频率，阶段函数本身不做修改
+    """
+    pipeline = StagePipeline(max_workers=PIPELINE_WORKERS,
+                             logger=lambda message: print("[{}] {}".format(current_date, message)))
+    
+    # 输入数据及其指纹：指纹不变则依赖它的阶段无需重算，指纹只用已有的状态计算，不额外请求数据
+    pipeline.add_input('index_data', daily_fingerprint)                             # 日线级别指数行情按交易日(及盘中刷新间隔)更新
+    pipeline.add_input('sector_constituents', lambda C: current_date[:10])          # 板块成分按交易日更新
+    pipeline.add_input('sector_refresh', lambda C: refresh_fingerprint(C, SECTOR_REFRESH_MINUTES))  # 板块热度盘中刷新区间
+    pipeline.add_input('sector_heat', sector_heat_fingerprint)                      # 板块热度为空时每根K线重试
+    pipeline.add_input('period_bar', lambda C: C.get_bar_timetag(C.barpos))         # 组合风险按策略周期逐根更新EWMA协方差
+    pipeline.add_input('holdings', holdings_fingerprint)                            # 持仓随下单和成交回报变化
+    pipeline.add_input('intraday_bars', intraday_fingerprint)                       # 盘中K线随最新5分钟K线更新
+    pipeline.add_input('quote_time', pipeline_clock)                                # 每次调用都变化，止盈止损逐次检查
+    
+    # 行情分析阶段只读数据、互不依赖，可并发运行
+    # 三者均为日线级别结果，交易日内由交易日缓存直接返回，设置盘中刷新间隔时按间隔重算
+    pipeline.add_stage('hs300_ma20', update_hs300_ma20_condition, inputs=['index_data'], concurrent=True)
+    pipeline.add_stage('risk_check', daily_risk_check, inputs=['index_data'], concurrent=True)
+    pipeline.add_stage('sector_analysis', daily_sector_analysis,
+                       inputs=['sector_constituents', 'index_data', 'sector_refresh', 'sector_heat'], concurrent=True)
+    pipeline.add_stage('portfolio_risk', update_portfolio_risk, inputs=['period_bar', 'holdings'], concurrent=True)
+    
+    # 交易阶段会下单和修改持仓状态，按原顺序依次运行
+    pipeline.add_stage('select_stocks', select_stocks, after=['sector_analysis'], condition=should_select_stocks)
+    pipeline.add_stage('trade_decision', trade_decision, inputs=['intraday_bars', 'holdings'],
+                       after=['select_stocks', 'hs300_ma20', 'risk_check'], frequency=FREQUENCY_TICK)
+    # K线驱动做T需要请求5分钟线，按最新5分钟K线触发；行情驱动做T只同步订阅，与止盈止损一样每次调用都运行，
+    # 以便及时发现策略外的持仓变化
+    if ContextInfo.t_quotes is not None:
+        pipeline.add_stage('t_trading', t_trading_quotes, inputs=['quote_time'], frequency=FREQUENCY_TICK)
+    else:
+        pipeline.add_stage('t_trading', t_trading, inputs=['intraday_bars', 'holdings'], frequency=FREQUENCY_TICK)
+    pipeline.add_stage('stop_loss_take_profit', check_stop_loss_take_profit, inputs=['quote_time'],
+                       frequency=FREQUENCY_TICK)
+    pipeline.add_stage('risk_avoidance', risk_avoidance, inputs=['holdings'], after=['risk_check', 'portfolio_risk'])
+    return pipeline
+
+
+def pipeline_clock(ContextInfo):
+    """
+    流水线指纹使用的当前时间(毫秒)：回测及实盘历史K线为K线时间，实盘当日K线为系统时间
+    """
+    bar_time = ContextInfo.get_bar_timetag(ContextInfo.barpos)
+    if getattr(ContextInfo, 'do_back_test', False):
+        return bar_time
+    now = time.time() * 1000
+    if timetag_to_datetime(now, '%Y%m%d') == timetag_to_datetime(bar_time, '%Y%m%d'):
+        return max(bar_time, now)
+    return bar_time
+
+
+def refresh_fingerprint(ContextInfo, minutes):
+    """
+    按交易日和盘中刷新区间计算的指纹，minutes为空时只按交易日
+    """
+    if not minutes:
+        return current_date[:10]
+    return current_date[:10], int(pipeline_clock(ContextInfo) / 1000 // (minutes * 60))
+
+
+def daily_fingerprint(ContextInfo):
+    """
+    日线级别输入的指纹：交易日，设置盘中刷新间隔时加上所在的刷新区间
+    """
+    return refresh_fingerprint(ContextInfo, DAILY_REFRESH_MINUTES)
+
+
+def sector_heat_fingerprint(ContextInfo):
+    """
+    板块热度输入的指纹：热度为空(分析失败或尚未分析)时为当前K线时间，使板块分析在下一根K线重试
+    """
+    return None if ContextInfo.sector_heat else ContextInfo.get_bar_timetag(ContextInfo.barpos)
+
+
+def intraday_fingerprint(ContextInfo):
+    """
+    盘中K线输入的指纹：当前时间所在5分钟K线的时间标签
+    """
+    return bar_end_label(timetag_to_datetime(pipeline_clock(ContextInfo), '%Y%m%d%H%M%S'), '5m')
+
+
+def holdings_fingerprint(ContextInfo):
+    """
+    持仓输入的指纹：交易日、下单网关受理和拒绝的订单数、已计入的成交回报数
+    持仓只会因本策略的订单成交或换日(可用股数)变化，不必每次查询持仓
+    """
+    gateway = ContextInfo.order_gateway
+    return (current_date[:10], gateway.submitted_count, gateway.rejected_count,
+            len(ContextInfo.performance.deal_keys))
+
+
+def update_hs300_ma20_condition(ContextInfo):
+    """
+    检查沪深300指数20日均线状态并写入全局变量
+    """
+    global hs300_ma20_condition
+    hs300_ma20_condition = memo_daily(ContextInfo, 'hs300_ma20_condition', lambda: check_hs300_ma20_condition(ContextInfo))
+    print("[{}] 沪深300指数20日均线状态: {}".format(current_date, hs300_ma20_condition))
+    return hs300_ma20_condition
+
+
+def memo_daily(ContextInfo, key, compute, cache_if=None, refresh_interval=None):
+    """
+    按交易日缓存日线级别的计算结果，同一交易日内的K线直接返回缓存
+    :param refresh_interval: 本项的盘中刷新间隔(秒)，默认使用DAILY_REFRESH_MINUTES
+    """
+    now = ContextInfo.get_bar_timetag(ContextInfo.barpos) / 1000
+    return ContextInfo.daily_memo.get(key, current_date[:10], compute, now=now, cache_if=cache_if,
+                                      refresh_interval=refresh_interval)
+
+
+def daily_risk_check(ContextInfo):
+    """
+    风险评估，每个交易日计算一次市场风险等级
+    """
+    def compute():
+        risk_check(ContextInfo)
+        return ContextInfo.market_risk_level
+    ContextInfo.market_risk_level = memo_daily(ContextInfo, 'market_risk_level', compute)
+    return ContextInfo.market_risk_level
+
+
+def daily_sector_analysis(ContextInfo):
+    """
+    板块轮动分析，盘中每SECTOR_REFRESH_MINUTES分钟按最新行情刷新一次板块热度
+    分析失败时板块热度为空，不缓存，下一根K线重试
+    """
+    def compute():
+        sector_analysis(ContextInfo)
+        return dict(ContextInfo.sector_heat)
+    ContextInfo.sector_heat = dict(memo_daily(ContextInfo, 'sector_heat', compute, cache_if=bool,
+                                              refresh_interval=SECTOR_REFRESH_MINUTES * 60))
+    return ContextInfo.sector_heat
+
+
+def should_select_stocks(ContextInfo):
+    """
+    判断本轮是否执行选股
+    为了确保策略能正常进入选股逻辑，我们增加多种触发条件：
+    1) 第一次运行时执行选股
+    2) 每隔10个周期执行一次选股
+    3) 如果当前未持有任何股票，也执行选股
+    """
+    current_index = ContextInfo.barpos
+    
+    # 条件1: 第一次运行
+    if current_index == 0:
+        print("[{}] 首次运行，执行选股逻辑".format(current_date))
+        return True
+    
+    # 条件2: 每隔10个周期
+    if current_index % 10 == 0:
+        print("[{}] 按周期执行选股逻辑，当前索引: {}".format(current_date, current_index))
+        return True
+    
+    # 条件3: 检查当前持仓，如果未持有股票也执行选股
+    current_positions = get_holdings(ContextInfo, "STOCK")
+    if not current_positions:  # 没有持仓
+        print("[{}] 当前无持仓，执行选股逻辑".format(current_date))
+        return True
+    
+    print("[{}] 跳过选股逻辑，当前索引: {}".format(current_date, current_index))
+    return False
+
+
+def save_state(ContextInfo, bar_time):
+    """
+    保存状态快照：每根K线结束时保存一次，同一根K线内按SNAPSHOT_INTERVAL限制频率
+    """
+    try:
+        now = time.time()
+        if ContextInfo.last_snapshot_bar == bar_time and now - ContextInfo.last_snapshot_time < SNAPSHOT_INTERVAL:
+            return
+        resampler_meta, resampler_arrays = ContextInfo.bar_resampler.export_state()
+        state = {
+            'bar_time': bar_time,
+            'trade_date': current_date[:10],
+            'selected_stocks': ContextInfo.selected_stocks,
+            'position_info': ContextInfo.stop_engine.export_state(),
+            't_holdings': ContextInfo.t_holdings,
+            'sector_heat': ContextInfo.sector_heat,
+            'market_risk_level': ContextInfo.market_risk_level,
+            'last_trade_time': ContextInfo.last_trade_time,
+            'hs300_ma20_condition': hs300_ma20_condition,
+            'daily_memo': ContextInfo.daily_memo.export_entries(),
+            'bar_resampler': resampler_meta,
+        }
+        ContextInfo.snapshot.save(state, resampler_arrays)
+        ContextInfo.last_snapshot_bar = bar_time
+        ContextInfo.last_snapshot_time = now
+    except Exception as e:
+        print("[{}] 保存状态快照异常: {}".format(current_date, str(e)))
+
+
+def restore_state(ContextInfo):
+    """
+    从状态快照恢复策略状态，快照不存在或版本不兼容时从头开始
+    """
+    global hs300_ma20_condition
+    start = time.time()
+    try:
+        state, arrays, saved_at = ContextInfo.snapshot.load(
+            required_keys=['position_info', 't_holdings', 'sector_heat', 'selected_stocks', 'market_risk_level'])
+    except SnapshotError as e:
+        print("未恢复状态快照: {}".format(str(e)))
+        return False
+    try:
+        ContextInfo.selected_stocks = list(state['selected_stocks'])
+        ContextInfo.stop_engine.load_state(state['position_info'])
+        ContextInfo.t_holdings = state['t_holdings']
+        ContextInfo.sector_heat = state['sector_heat']
+        ContextInfo.market_risk_level = state['market_risk_level']
+        ContextInfo.last_trade_time = state.get('last_trade_time', {})
+        hs300_ma20_condition = state.get('hs300_ma20_condition', False)
+        ContextInfo.daily_memo.load_entries(state.get('daily_memo', {}))
+        if 'bar_resampler' in state:
+            ContextInfo.bar_resampler.load_state(state['bar_resampler'], arrays)
+        print("已恢复状态快照: 保存于{}, 交易日{}, 持仓信息{}只, 做T信息{}只, 耗时{:.3f}秒".format(
+            datetime.datetime.fromtimestamp(saved_at).strftime('%Y-%m-%d %H:%M:%S') if saved_at else "未知",
+            state.get('trade_date', ''), len(ContextInfo.stop_engine), len(ContextInfo.t_holdings), time.time() - start))
+        return True
+    except Exception as e:
+        print("恢复状态快照异常，从头开始: {}".format(str(e)))
+        ContextInfo.selected_stocks = []
+        ContextInfo.stop_engine.active.reset()
+        ContextInfo.t_holdings = {}
+        ContextInfo.sector_heat = {}
+        ContextInfo.market_risk_level = 0
+        ContextInfo.last_trade_time = {}
+        ContextInfo.daily_memo.invalidate()
+        ContextInfo.bar_resampler.reset()
+        return False
+
+
+def stop(ContextInfo):
+    """
+    策略结束时执行，提交下单网关中剩余的订单，输出本次运行的阶段统计、数据请求统计和绩效统计，写入剩余的交易日志
+    """
+    try:
+        if not ContextInfo.order_gateway.stop(timeout=30):
+            print("[{}] 下单网关仍有{}笔订单未回报".format(current_date, ContextInfo.order_gateway.pending_count()))
+        ContextInfo.pipeline.close()
+        print("[{}] {}".format(current_date, ContextInfo.pipeline.report()))
+        ContextInfo.performance.close()
+        print("[{}] {}".format(current_date, ContextInfo.performance.report()))
+        if ContextInfo.journal is not None:
+            ContextInfo.journal.close()
+            print("[{}] {}".format(current_date, ContextInfo.journal.report()))
+        if ContextInfo.cassette is not None:
+            if ContextInfo.cassette.mode == 'record':
+                ContextInfo.cassette.save()
+            print("[{}] {}".format(current_date, ContextInfo.cassette.report()))
+        if ContextInfo.t_quotes is not None:
+            ContextInfo.t_quotes.close()
+            print("[{}] {}".format(current_date, ContextInfo.t_quotes.report()))
+        print("[{}] {}".format(current_date, ContextInfo.daily_memo.report()))
+        print("[{}] {}".format(current_date, ContextInfo.data_client.report()))
+        print("[{}] {}".format(current_date, ContextInfo.lazy_data.tracker.report()))
+        unread = ContextInfo.lazy_data.tracker.unread()
+        if unread:
+            print("[{}] 请求了但从未读取的数据: {}".format(current_date, unread))
+    except Exception as e:
+        print("[{}] 输出数据请求统计异常: {}".format(current_date, str(e)))
+
+
+def update_performance(ContextInfo, bar_time):
+    """
+    以账户总资产和基准最新收盘价更新绩效统计，同一根K线多次调用只保留最后一次
+    平台成交回报中新增的成交计入胜率和换手率
+    """
+    try:
+        deals = get_trade_detail_data(ContextInfo.account_id, "STOCK", "DEAL")
+        ContextInfo.performance.record_deals(deals, ContextInfo.symbols.position_code)
+        accounts = get_trade_detail_data(ContextInfo.account_id, "STOCK", "ACCOUNT")
+        if not accounts:
+            return
+        data = ContextInfo.get_market_data_ex(['close'], [ContextInfo.benchmark], count=1).get(ContextInfo.benchmark)
+        benchmark_price = float(data['close'].iloc[-1]) if data is not None and len(data) > 0 else None
+        ContextInfo.performance.update(bar_time, accounts[0].m_dBalance, benchmark_price)
+    except Exception as e:
+        print("[{}] 更新绩效统计异常: {}".format(current_date, str(e)))
+
+
 def risk_check(ContextInfo):
     """
     风险评估
@@ -267,113 +635,45 @@ def sector_analysis(ContextInfo):
     """
     板块轮动分析 - 增强版
     综合评估各行业板块的市场热度，用于指导选股方向
+    使用板块全部成分股，重叠的成分股只请求一次行情；
+    各板块的滚动汇总随新交易日增量更新，盘中按最新行情临时计算当日热度
     """
     try:
         sector_scores = {}
         
-        sector_stocks_map = {}
-        
-        for sector_name, sector_key in sectors.items():
-            # 获取板块成分股
-            stocks = ContextInfo.get_stock_list_in_sector(sector_key)
-            if not stocks or len(stocks) == 0:
-                print("[{}] 板块 {} 成分子股票为空".format(current_date, sector_name))
+        # 板块成分每个交易日获取一次，滚动汇总只计入新完成的交易日，当日数据按最新行情临时计算
+        membership = get_sector_membership(ContextInfo)
+        tracker = update_sector_tracker(ContextInfo, membership)
+        stats = ContextInfo.sector_today_stats
+        window_stats = tracker.window_stats()
+        
+        for i, sector_name in enumerate(membership.names):
+            valid_count = int(stats['valid_count'][i])
+            # 如果没有有效样本，则跳过该板块
+            if valid_count == 0:
+                print("[{}] 板块 {} 无有效样本数据".format(current_date, sector_name))
                 continue
             
-            # 限制股票数量避免接口压力
-            sample_stocks = stocks[:min(50, len(stocks))]
-            sector_stocks_map[sector_name] = sample_stocks
-        
-        for sector_name, sample_stocks in sector_stocks_map.items():
-            try:
-                # 批量获取行情数据
-                sector_data = ContextInfo.get_market_data_ex(
-                    fields=['close', 'volume', 'amount'],
-                    stock_code=sample_stocks,
-                    period='1d',
-                    start_time=calculate_start_date(current_date, 5),
-                    end_time=current_date.replace('-', '').replace(' ', '')[:8],
-                    count=-1
-                )
-                
-                # 初始化统计变量
-                total_price_change = 0
-                total_volume_change = 0
-                total_amount = 0
-                valid_count = 0
-                
-                # 遍历成分股计算各项指标
-                for stock in sample_stocks:
-                    if stock not in sector_data or sector_data[stock] is None or sector_data[stock].empty:
-                        continue
-                        
-                    df = sector_data[stock]
-                    # 确保有足够的数据
-                    if len(df) < 2:
-                        continue
-                        
-                    close_prices = df['close']
-                    volumes = df['volume'] if 'volume' in df.columns else pd.Series([np.nan]*len(df))
-                    amounts = df['amount'] if 'amount' in df.columns else pd.Series([np.nan]*len(df))
-                    
-                    # 检查昨日和今日的收盘价是否为有效数值
-                    prev_close = close_prices.iloc[-2]
-                    curr_close = close_prices.iloc[-1]
-                    if np.isnan(prev_close) or np.isnan(curr_close) or prev_close == 0:
-                        continue
-                    price_change = (curr_close / prev_close) - 1
-                    total_price_change += price_change
-                    
-                    # 检查昨日和今日的成交量是否为有效数值
-                    prev_vol = volumes.iloc[-2]
-                    curr_vol = volumes.iloc[-1]
-                    if not np.isnan(prev_vol) and not np.isnan(curr_vol) and prev_vol != 0:
-                        volume_change = (curr_vol / prev_vol) - 1
-                        total_volume_change += volume_change
-                    
-                    # 检查今日成交金额是否为有效数值
-                    curr_amount = amounts.iloc[-1]
-                    if not np.isnan(curr_amount):
-                        total_amount += float(curr_amount)
-                    
-                    valid_count += 1
-                
-                # 如果没有有效样本，则跳过该板块
-                if valid_count == 0:
-                    print("[{}] 板块 {} 无有效样本数据".format(current_date, sector_name))
-                    continue
-                
-                # 计算平均值
-                avg_price_change = total_price_change / valid_count
-                avg_volume_change = total_volume_change / valid_count if valid_count > 0 else 0
-                
-                # 计算板块热度得分
-                # 使用更简单的线性加权模型，并直接使用总成交额（已按样本数平均）
-                heat_score = (0.4 * avg_price_change +
-                              0.3 * avg_volume_change +
-                              0.3 * (total_amount / 1e8))  # 将成交额单位转换为亿元
-                
-                # 最终验证：确保得分是有效数字
-                if not np.isnan(heat_score) and not np.isinf(heat_score):
-                    sector_scores[sector_name] = heat_score
-                    print("[{}] {}板块分析: 样本{}只, "
-                          "均价涨{:.2%}, "
-                          "均量变{:.2%}, "
-                          "总额{:.2f}亿, "
-                          "热度分{:.4f}".format(current_date, sector_name, valid_count, avg_price_change, avg_volume_change, total_amount/1e8, heat_score))
-                else:
-                    print("[{}] {}板块计算得分无效: {}".format(current_date, sector_name, heat_score))
-                    
-            except Exception as e:
-                print("[{}] 板块 {} 分析过程出现异常: {}".format(current_date, sector_name, str(e)))
-                continue
+            heat_score = stats['heat'][i]
+            
+            # 最终验证：确保得分是有效数字
+            if not np.isnan(heat_score) and not np.isinf(heat_score):
+                sector_scores[sector_name] = float(heat_score)
+                print("[{}] {}板块分析: 样本{}只, "
+                      "均价涨{:.2%}, "
+                      "均量变{:.2%}, "
+                      "总额{:.2f}亿, "
+                      "热度分{:.4f}, "
+                      "{}日累计均涨{:.2%}".format(current_date, sector_name, valid_count, stats['avg_price_change'][i],
+                                             stats['avg_volume_change'][i], stats['total_amount'][i]/1e8, heat_score,
+                                             len(tracker.days), window_stats['avg_price_change'][i] * len(tracker.days)))
+            else:
+                print("[{}] {}板块计算得分无效: {}".format(current_date, sector_name, heat_score))
         
         # 排序并保存结果
         if sector_scores:
-            # 按得分从高到低排序，处理可能的NaN值
-            sorted_sectors = sorted(sector_scores.items(), key=lambda x: x[1], reverse=True)
-            # 保留前5个热门板块
-            top_sectors = [item for item in sorted_sectors if not np.isnan(item[1])][:5]
+            # 部分选取得分最高的前5个热门板块（NaN得分自动剔除）
+            top_sectors = top_k_items(sector_scores, 5)
             ContextInfo.sector_heat = dict(top_sectors)
             
             # 输出可读性更好的日志
@@ -388,6 +688,73 @@ def sector_analysis(ContextInfo):
         ContextInfo.sector_heat = {}
 
 
+def get_sector_membership(ContextInfo):
+    """
+    获取全部板块的成分矩阵，每个交易日只查询一次板块成分
+    """
+    trade_date = current_date[:10]
+    cached = getattr(ContextInfo, 'sector_membership', None)
+    if cached is not None and cached[0] == trade_date:
+        return cached[1]
+    
+    sector_stocks_map = {}
+    for sector_name, sector_key in sectors.items():
+        # 获取板块成分股
+        stocks = ContextInfo.get_stock_list_in_sector(sector_key)
+        if not stocks or len(stocks) == 0:
+            print("[{}] 板块 {} 成分子股票为空".format(current_date, sector_name))
+            continue
+        sector_stocks_map[sector_name] = stocks
+    
+    # 全部板块的成分股去重后一次请求行情，板块汇总由成分矩阵一次计算
+    membership = SectorMembership(sector_stocks_map)
+    print("[{}] 板块成分股合计{}只，去重后{}只".format(current_date, membership.total_members, len(membership.codes)))
+    if len(membership):
+        ContextInfo.sector_membership = (trade_date, membership)
+    return membership
+
+
+def update_sector_tracker(ContextInfo, membership):
+    """
+    更新板块滚动汇总并计算当日板块统计(写入ContextInfo.sector_today_stats)
+    首次运行或板块成分变化时请求窗口期的历史行情重建，之后只请求上次计入日期以来的行情
+    """
+    today = current_date[:10].replace('-', '')
+    tracker = getattr(ContextInfo, 'sector_tracker', None)
+    if tracker is None or not tracker.membership.same_as(membership):
+        tracker = SectorHeatTracker(membership, window=SECTOR_WINDOW_DAYS)
+        ContextInfo.sector_tracker = tracker
+        start_time = calculate_start_date(current_date, SECTOR_WINDOW_DAYS + 2)
+    else:
+        start_time = tracker.last_date
+    
+    sector_data = ContextInfo.data_client.get_market_data_ex(
+        fields=['close', 'volume', 'amount'],
+        stock_code=membership.codes,
+        period='1d',
+        start_time=start_time,
+        end_time=today,
+        count=-1
+    )
+    codes, dates, matrices = align_frames(sector_data, ('close', 'volume', 'amount'))
+    close, volume, amount = [membership.expand(codes, matrices[field]) if field in matrices
+                             else np.full((len(membership.codes), len(dates)), np.nan)
+                             for field in ('close', 'volume', 'amount')]
+    
+    # 当日之前的交易日计入滚动窗口，当日K线未收盘，按已交易时间折算成交量后临时计算
+    added = tracker.update_history(dates, close, volume, amount, before=today)
+    if dates and dates[-1] == today:
+        period = getattr(ContextInfo, 'period', '1d')
+        session_fraction = 1.0 if period in ('1d', '1w') else session_minutes(current_date[11:16].replace(':', '')) / 240.0
+        stats = tracker.provisional(close[:, -1], volume[:, -1], amount[:, -1], session_fraction)
+    else:
+        stats = tracker.heat()
+    ContextInfo.sector_today_stats = stats
+    if added:
+        print("[{}] 板块滚动汇总计入{}个交易日，最新: {}".format(current_date, added, tracker.last_date))
+    return tracker
+
+
 def select_stocks(ContextInfo):
     """
     选股逻辑
@@ -398,6 +765,7 @@ def select_stocks(ContextInfo):
         # 获取热门板块股票
         sector_list = ContextInfo.sector_heat
         all_stocks_for_download = []  # 收集所有需要下载历史数据的股票代码
+        skipped = collections.Counter()  # 各阶段因接口异常或数据请求重试后仍失败而跳过的股票数
         
         for key in sector_list:
             all_stocks = ContextInfo.get_stock_list_in_sector(sectors[key])
@@ -422,7 +790,8 @@ def select_stocks(ContextInfo):
                             continue
                     
                     filtered_stocks.append(stock)
-                except:
+                except Exception:
+                    skipped['基础信息'] += 1
                     continue
             
             print("[{}] 初步筛选后股票数量: {}".format(current_date, len(filtered_stocks)))
@@ -450,33 +819,33 @@ def select_stocks(ContextInfo):
                             continue
                     
                     filtered_stocks.append(stock)
-                except:
+                except Exception:
+                    skipped['基础信息'] += 1
                     continue
             
             # 2. 选择市值排名前80%的股票（避免流动性风险）
+            # 全部候选股票的收盘价分批一次请求，失败的批次由data_client重试并记录
+            close_data = ContextInfo.data_client.get_market_data_ex(
+                fields=['close'],
+                stock_code=filtered_stocks,
+                period='1d',
+                start_time=calculate_start_date(current_date, 1),
+                end_time=current_date.replace('-', '').replace(' ', '')[:8],
+                count=-1
+            )
             market_values = {}
             for stock in filtered_stocks:
+                if stock not in close_data or close_data[stock].empty:
+                    continue
                 try:
                     float_caps = ContextInfo.get_float_caps(stock)
-                    close_data = ContextInfo.get_market_data_ex(
-                        fields=['close'],
-                        stock_code=[stock],
-                        period='1d',
-                        start_time=calculate_start_date(current_date, 1),
-                        end_time=current_date.replace('-', '').replace(' ', '')[:8],
-                        count=-1
-                    )
-                    if stock in close_data and not close_data[stock].empty:
-                        close_price = close_data[stock]['close'].iloc[-1]
-                        market_value = float_caps * close_price
-                        market_values[stock] = market_value
-                except:
+                except Exception as e:
+                    print("[{}] {}流通股本获取失败: {}".format(current_date, stock, str(e)))
                     continue
+                market_values[stock] = float_caps * close_data[stock]['close'].iloc[-1]
             
-            # 按市值排序，取前80%
-            sorted_by_market_value = sorted(market_values.items(), key=lambda x: x[1], reverse=True)
-            top_80_percent_count = int(len(sorted_by_market_value) * 0.8)
-            selected_by_market_value = [item[0] for item in sorted_by_market_value[:top_80_percent_count]]
+            # 按市值部分选取前80%
+            selected_by_market_value = [item[0] for item in top_fraction_items(market_values, 0.8)]
             
             print("[{}] 筛选后市值前80%股票数量: {}".format(current_date, len(selected_by_market_value)))
             # 3. 计算综合评分
@@ -486,14 +855,13 @@ def select_stocks(ContextInfo):
                     score = calculate_stock_score(ContextInfo, stock)
                     if score > 0:
                         stock_scores[stock] = score
-                except:
+                except DataRequestError:
+                    skipped['评分'] += 1
                     continue
             
             print("[{}] 筛选后评分前20%股票数量: {}".format(current_date, len(stock_scores)))
             # 4. 选择评分排名前20%的股票
-            sorted_by_score = sorted(stock_scores.items(), key=lambda x: x[1], reverse=True)
-            top_20_percent_count = max(int(len(sorted_by_score) * 0.2), 20)  # 至少20只
-            selected_by_score = [item[0] for item in sorted_by_score[:top_20_percent_count]]
+            selected_by_score = [item[0] for item in top_fraction_items(stock_scores, 0.2, min_count=20)]  # 至少20只
             
             # 5. 从中筛选主力连续3日净流入且K线形态健康的股票
             final_selected = []
@@ -506,7 +874,8 @@ def select_stocks(ContextInfo):
                     print("[{}] {}资金流入: {}, 均线多头排列: {}".format(current_date, stock, money_flow, ma_aligned))
                     if money_flow and ma_aligned:
                         final_selected.append(stock)
-                except:
+                except DataRequestError:
+                    skipped['资金流入/均线'] += 1
                     continue
             
             # 如果严格条件筛选后没有股票，则使用宽松条件
@@ -518,7 +887,8 @@ def select_stocks(ContextInfo):
                         tech_score = calculate_technical_score(ContextInfo, stock)
                         if tech_score > 0.5:  # 技术面得分超过0.5认为可以接受
                             final_selected.append(stock)
-                    except:
+                    except DataRequestError:
+                        skipped['技术面评分'] += 1
                         continue
                         
             # # 如果仍然没有股票，则使用基础条件选股
@@ -532,11 +902,15 @@ def select_stocks(ContextInfo):
                         
                         if money_flow or ma_aligned:  # 只需要满足其中一个条件
                             final_selected.append(stock)
-                    except:
+                    except DataRequestError:
+                        skipped['资金流入/均线'] += 1
                         continue
             
             ContextInfo.selected_stocks = final_selected[:ContextInfo.portfolio_size]  # 最终选股数量不超过持仓限制
             print("[{}] {} 选股完成，共选出{}只股票: {}".format(current_date, key, len(ContextInfo.selected_stocks), ContextInfo.selected_stocks))
+        
+        if skipped:
+            print("[{}] 选股跳过的股票数: {}".format(current_date, dict(skipped)))
             
     except Exception as e:
         print("[{}] 选股异常: {}".format(current_date, str(e)))
@@ -597,13 +971,14 @@ def calculate_stock_score(ContextInfo, stock):
         tech_score = 0
         try:
             # 获取价格数据
-            price_data = ContextInfo.get_market_data_ex(
+            price_data = ContextInfo.data_client.get_market_data_ex(
                 fields=['close'],
                 stock_code=[stock],
                 period='1d',
                 start_time=calculate_start_date(current_date, 60),
                 end_time=current_date.replace('-', '').replace(' ', '')[:8],
-                count=-1
+                count=-1,
+                strict=True
             )
             
             if stock in price_data and not price_data[stock].empty and len(price_data[stock]) >= 30:
@@ -619,15 +994,18 @@ def calculate_stock_score(ContextInfo, stock):
                     tech_score += rsi_score
                     
                 tech_score = tech_score / 2
+        except DataRequestError:
+            raise
         except Exception as e:
             print("[{}] 获取股票数据异常: {}".format(current_date, str(e)))
-            pass
         
         
         # 综合评分
         # total_score = 0.3 * value_score + 0.2 * quality_score + 0.2 * growth_score + 0.3 * tech_score
         return tech_score
         
+    except DataRequestError:
+        raise
     except Exception as e:
         print("[{}] 获取股票数据异常: {}".format(current_date, str(e)))
         return 0
@@ -641,13 +1019,14 @@ def check_money_flow(ContextInfo, stock):
         
         # 这里简化处理，实际应使用资金流数据接口
         # 由于平台接口限制，我们用价格和成交量变化来近似判断
-        data = ContextInfo.get_market_data_ex(
+        data = ContextInfo.data_client.get_market_data_ex(
             fields=['close', 'volume'],
             stock_code=[stock],
             period='1d',
             start_time=calculate_start_date(current_date, 3),
             end_time=current_date.replace('-', '').replace(' ', '')[:8],
-            count=-1
+            count=-1,
+            strict=True
         )
         
         if stock in data and not data[stock].empty and len(data[stock]) >= 3:
@@ -664,7 +1043,10 @@ def check_money_flow(ContextInfo, stock):
                     
             return price_up and volume_up
         return False
-    except:
+    except DataRequestError:
+        raise
+    except Exception as e:
+        print("[{}] 检查资金流入异常 {}: {}".format(current_date, stock, str(e)))
         return False
 
 
@@ -674,13 +1056,14 @@ def check_ma_alignment(ContextInfo, stock):
     """
     try:
         
-        data = ContextInfo.get_market_data_ex(
+        data = ContextInfo.data_client.get_market_data_ex(
             fields=['close'],
             stock_code=[stock],
             period='1d',
             start_time=calculate_start_date(current_date, 60),
             end_time=current_date.replace('-', '').replace(' ', '')[:8],
-            count=-1
+            count=-1,
+            strict=True
         )
         
         if stock in data and not data[stock].empty and len(data[stock]) >= 60:
@@ -692,7 +1075,10 @@ def check_ma_alignment(ContextInfo, stock):
             # 检查是否多头排列
             return ma5 > ma20 > ma60
         return False
-    except:
+    except DataRequestError:
+        raise
+    except Exception as e:
+        print("[{}] 检查均线排列异常 {}: {}".format(current_date, stock, str(e)))
         return False
 
 
@@ -720,7 +1106,7 @@ def calculate_rsi(prices, period=14):
         rs = avg_gain / avg_loss
         rsi = 100 - (100 / (1 + rs))
         return rsi
-    except:
+    except (ValueError, IndexError, TypeError):
         return None
 
 
@@ -798,6 +1184,8 @@ def trade_decision(ContextInfo):
                         if quantity > 0:
                             order_shares_local(stock, quantity, "FIX", current_price, ContextInfo, "strategy")
                             print("[{}] 买入股票: {}, 数量: {}, 价格: {}".format(current_date, stock, quantity, current_price))
+        
+        flush_orders(ContextInfo)
                             
     except Exception as e:
         print("[{}] 交易决策异常: {}".format(current_date, str(e)))
@@ -809,39 +1197,18 @@ def check_buy_condition(ContextInfo, stock):
     """
     try:
         
-        # 获取多周期数据
-        # 5分钟线
-        data_5m = ContextInfo.get_market_data_ex(
-            fields=['close', 'volume'],
-            stock_code=[stock],
-            period='5m',
-            start_time=calculate_start_date(current_date, 20, '5m'),
-            end_time=current_date.replace('-', '').replace(' ', '')[:8],
-            count=-1
-        )
+        # 多周期数据和指数数据均为惰性句柄，只有条件真正读取时才请求接口
+        lazy_data = ContextInfo.lazy_data
         
-        # 15分钟线
-        data_15m = ContextInfo.get_market_data_ex(
-            fields=['close', 'volume'],
-            stock_code=[stock],
-            period='15m',
-            start_time=calculate_start_date(current_date, 20, '15m'),
-            end_time=current_date.replace('-', '').replace(' ', '')[:8],
-            count=-1
-        )
-        
-        # 120分钟线
-        data_120m = ContextInfo.get_market_data_ex(
-            fields=['close', 'volume'],
-            stock_code=[stock],
-            period='120m',
-            start_time=calculate_start_date(current_date, 20, '120m'),
-            end_time=current_date.replace('-', '').replace(' ', '')[:8],
-            count=-1
-        )
+        # 获取多周期数据：只请求5分钟线，15分钟和120分钟线本地合成
+        intraday_bars = lazy_data.lazy('check_buy_condition 5分钟线请求', lambda: get_intraday_bars(ContextInfo, stock))
+        data_5m = lazy_data.lazy('check_buy_condition 5m', lambda: {stock: intraday_bars['5m']})
+        data_15m = lazy_data.lazy('check_buy_condition 15m', lambda: {stock: intraday_bars['15m']})
+        data_120m = lazy_data.lazy('check_buy_condition 120m', lambda: {stock: intraday_bars['120m']})
         
         # 沪深300指数
-        hs300_data = ContextInfo.get_market_data_ex(
+        hs300_data = lazy_data.get_market_data_ex(
+            label='check_buy_condition 沪深300日线',
             fields=['close'],
             stock_code=['000300.SH'],
             period='1d',
@@ -890,210 +1257,341 @@ def check_buy_condition(ContextInfo, stock):
         return False
 
 
+def get_intraday_bars(ContextInfo, stock):
+    """
+    获取单只股票的5m/15m/120m/1d K线
+    只向平台请求5分钟线（已处理过的股票只请求新增部分），其余周期按交易时段本地增量合成
+    :return: {周期: DataFrame}
+    """
+    resampler = ContextInfo.bar_resampler
+    last_time = resampler.last_time(stock)
+    data_5m = ContextInfo.get_market_data_ex(
+        fields=['open', 'high', 'low', 'close', 'volume', 'amount'],
+        stock_code=[stock],
+        period='5m',
+        start_time=last_time if last_time else calculate_start_date(current_date, INTRADAY_5M_COUNT, '5m'),
+        end_time=current_date.replace('-', '').replace(' ', '')[:8],
+        count=-1
+    )
+    if stock in data_5m and data_5m[stock] is not None:
+        resampler.update_frame(stock, data_5m[stock])
+    return {period: resampler.bars(stock, period) for period in resampler.periods}
+
+
+def init_t_holding(ContextInfo, stock, volume):
+    """
+    新持仓股票登记做T信息：50%底仓，50%用于做T
+    """
+    with ContextInfo.t_lock:
+        if stock not in ContextInfo.t_holdings:
+            ContextInfo.t_holdings[stock] = {
+                'base_position': volume * 0.5,  # 保留50%底仓
+                't_position': volume * 0.5,     # 50%用于做T
+                'last_price': 0
+            }
+        return ContextInfo.t_holdings[stock]
+
+
+def apply_t_rules(ContextInfo, stock, current_price, rsi, bar_label=None):
+    """
+    做T规则：15分钟RSI(14)超买卖出、超卖买入100股，价格偏离上次做T价格超过t_stop_loss时止损/止盈
+    同一根15分钟K线内做T买入、卖出各至多一次，做T仓位不超过初始做T仓位的T_POSITION_LIMIT倍
+    :param rsi: 15分钟RSI，K线不足时为None
+    :param bar_label: 当前15分钟K线的时间标签
+    """
+    with ContextInfo.t_lock:
+        t_info = ContextInfo.t_holdings.get(stock)
+        if t_info is not None:
+            _apply_t_rules(ContextInfo, stock, t_info, current_price, rsi, bar_label)
+
+
+def _apply_t_rules(ContextInfo, stock, t_info, current_price, rsi, bar_label):
+    """
+    做T规则主体，调用方需持有ContextInfo.t_lock
+    """
+    # 更新上次价格
+    if t_info['last_price'] == 0:
+        t_info['last_price'] = current_price
+    
+    # 超买超卖：RSI(14)>70时卖出，<30时买入
+    if rsi and rsi > 70:
+        # 超买，卖出做T仓位
+        if t_info['t_position'] > 0 and (bar_label is None or t_info.get('last_sell_bar') != bar_label):
+            order_shares_local(stock, -100, "FIX", current_price, ContextInfo, "t_trade")  # 卖出100股
+            t_info['t_position'] -= 100
+            t_info['last_sell_bar'] = bar_label
+            t_info['last_price'] = current_price
+            print("[{}] 做T卖出: {}, 价格: {}".format(current_date, stock, current_price))
+    elif rsi and rsi < 30:
+        # 超卖，买入做T仓位
+        limit = t_info['base_position'] * T_POSITION_LIMIT
+        if t_info['t_position'] + 100 <= limit and (bar_label is None or t_info.get('last_buy_bar') != bar_label):
+            order_shares_local(stock, 100, "FIX", current_price, ContextInfo, "t_trade")  # 买入100股
+            t_info['t_position'] += 100
+            t_info['last_buy_bar'] = bar_label
+            t_info['last_price'] = current_price
+            print("[{}] 做T买入: {}, 价格: {}".format(current_date, stock, current_price))
+    
+    # 检查做T止损
+    price_change = (current_price / t_info['last_price']) - 1
+    if abs(price_change) > ContextInfo.t_stop_loss:
+        # 触发止损
+        if price_change < 0:
+            # 亏损超过1.5%，止损卖出
+            if t_info['t_position'] > 0:
+                order_shares_local(stock, -t_info['t_position'], "CLOSE_ALL", 0, ContextInfo, "t_stop_loss")
+                print("[{}] 做T止损卖出: {}, 亏损幅度: {:.2f}%".format(current_date, stock, price_change*100))
+                t_info['t_position'] = 0
+        else:
+            # 盈利超过1.5%，止盈
+            if t_info['t_position'] > 0:
+                order_shares_local(stock, -t_info['t_position'], "CLOSE_ALL", 0, ContextInfo, "t_take_profit")
+                print("[{}] 做T止盈卖出: {}, 盈利幅度: {:.2f}%".format(current_date, stock, price_change*100))
+                t_info['t_position'] = 0
+
+
 def t_trading(ContextInfo):
     """
-    自动做T交易
+    自动做T交易（K线轮询模式）：每根K线请求持仓股票的盘中K线后执行做T规则
     """
     try:
         current_positions = get_holdings(ContextInfo, "STOCK")
         
         for stock in current_positions:
-            if stock not in ContextInfo.t_holdings:
-                ContextInfo.t_holdings[stock] = {
-                    'base_position': current_positions[stock] * 0.5,  # 保留50%底仓
-                    't_position': current_positions[stock] * 0.5,     # 50%用于做T
-                    'last_price': 0
-                }
-            
-            # 获取实时数据
-            data_5m = ContextInfo.get_market_data_ex(
-                fields=['close', 'volume'],
-                stock_code=[stock],
-                period='5m',
-                start_time=calculate_start_date(current_date, 20, '5m'),
-                end_time=current_date.replace('-', '').replace(' ', '')[:8],
-                count=-1
-            )
-            
-            data_15m = ContextInfo.get_market_data_ex(
-                fields=['close'],
-                stock_code=[stock],
-                period='15m',
-                start_time=calculate_start_date(current_date, 20, '15m'),
-                end_time=current_date.replace('-', '').replace(' ', '')[:8],
-                count=-1
-            )
+            init_t_holding(ContextInfo, stock, current_positions[stock])
             
-            data_120m = ContextInfo.get_market_data_ex(
-                fields=['close'],
-                stock_code=[stock],
-                period='120m',
-                start_time=calculate_start_date(current_date, 20, '120m'),
-                end_time=current_date.replace('-', '').replace(' ', '')[:8],
-                count=-1
-            )
+            # 获取实时数据：只请求5分钟线，15分钟和120分钟线本地合成
+            intraday_bars = get_intraday_bars(ContextInfo, stock)
+            data_5m = intraday_bars['5m']
+            data_15m = intraday_bars['15m']
             
-            if stock in data_5m and not data_5m[stock].empty:
-                current_price = data_5m[stock]['close'].iloc[-1]
-                t_info = ContextInfo.t_holdings[stock]
-                
-                # 更新上次价格
-                if t_info['last_price'] == 0:
-                    t_info['last_price'] = current_price
-                
-                # 5分钟超买超卖：RSI(14)>70时准备卖出，<30时准备买入
-                if stock in data_15m and not data_15m[stock].empty and len(data_15m[stock]) >= 14:
-                    rsi = calculate_rsi(data_15m[stock]['close'].values, 14)
-                    if rsi and rsi > 70:
-                        # 超买，卖出做T仓位
-                        if t_info['t_position'] > 0:
-                            order_shares_local(stock, -100, "FIX", current_price, ContextInfo, "t_trade")  # 卖出100股
-                            t_info['t_position'] -= 100
-                            t_info['last_price'] = current_price
-                            print("[{}] 做T卖出: {}, 价格: {}".format(current_date, stock, current_price))
-                    elif rsi and rsi < 30:
-                        # 超卖，买入做T仓位
-                        order_shares_local(stock, 100, "FIX", current_price, ContextInfo, "t_trade")  # 买入100股
-                        t_info['t_position'] += 100
-                        t_info['last_price'] = current_price
-                        print("[{}] 做T买入: {}, 价格: {}".format(current_date, stock, current_price))
-                
-                # 检查做T止损
-                price_change = (current_price / t_info['last_price']) - 1
-                if abs(price_change) > ContextInfo.t_stop_loss:
-                    # 触发止损
-                    if price_change < 0:
-                        # 亏损超过1.5%，止损卖出
-                        if t_info['t_position'] > 0:
-                            order_shares_local(stock, -t_info['t_position'], "CLOSE_ALL", 0, ContextInfo, "t_stop_loss")
-                            print("[{}] 做T止损卖出: {}, 亏损幅度: {:.2f}%".format(current_date, stock, price_change*100))
-                            t_info['t_position'] = 0
-                    else:
-                        # 盈利超过1.5%，止盈
-                        if t_info['t_position'] > 0:
-                            order_shares_local(stock, -t_info['t_position'], "CLOSE_ALL", 0, ContextInfo, "t_take_profit")
-                            print("[{}] 做T止盈卖出: {}, 盈利幅度: {:.2f}%".format(current_date, stock, price_change*100))
-                            t_info['t_position'] = 0
+            if not data_5m.empty:
+                current_price = data_5m['close'].iloc[-1]
+                rsi = None
+                if len(data_15m) >= 14:
+                    rsi = calculate_rsi(data_15m['close'].values, 14)
+                bar_label = str(data_15m.index[-1]) if len(data_15m) else None
+                apply_t_rules(ContextInfo, stock, current_price, rsi, bar_label)
+        
+        flush_orders(ContextInfo)
                 
     except Exception as e:
         print("[{}] 做T交易异常: {}".format(current_date, str(e)))
 
 
+def build_t_quote_feed(ContextInfo):
+    """
+    创建做T行情订阅：实盘订阅平台逐笔行情，回测时用本地K线回放代替
+    """
+    replay = getattr(ContextInfo, 'do_back_test', False) or not hasattr(ContextInfo, 'subscribe_quote')
+    source = ReplayQuoteSource(ContextInfo, period='5m') if replay else ContextInfo
+    return HoldingQuoteFeed(source, lambda stock, price, rsi, bar_label: on_t_quote(ContextInfo, stock, price, rsi, bar_label),
+                            period='15m', rsi_period=14, seed=lambda stock: seed_t_quote(ContextInfo, stock),
+                            logger=lambda message: print("[{}] {}".format(current_date, message)))
+
+
+def seed_t_quote(ContextInfo, stock):
+    """
+    新订阅股票的15分钟K线初始化：订阅时请求一次5分钟线，之后只靠实时行情更新
+    :return: (已完成15分钟K线收盘价, 最后一根已完成K线时间标签)
+    """
+    get_intraday_bars(ContextInfo, stock)
+    bars = ContextInfo.bar_resampler.bars(stock, '15m', include_partial=False)
+    return bars['close'].values, (str(bars.index[-1]) if len(bars) else None)
+
+
+def on_t_quote(ContextInfo, stock, price, rsi, bar_label):
+    """
+    做T行情回调：每笔行情执行一次做T规则(同一根15分钟K线内买卖各至多一次)
+    只把订单放入下单网关队列，由策略线程在handlebar中提交，平台下单接口不在行情回调线程中调用
+    """
+    apply_t_rules(ContextInfo, stock, price, rsi, bar_label)
+
+
+def t_trading_quotes(ContextInfo):
+    """
+    自动做T交易（行情驱动模式）：按持仓增减订阅/退订行情，做T规则在行情回调中逐笔执行
+    回测时在此回放截至当前K线的本地行情
+    """
+    try:
+        current_positions = get_holdings(ContextInfo, "STOCK")
+        for stock in current_positions:
+            init_t_holding(ContextInfo, stock, current_positions[stock])
+        ContextInfo.t_quotes.sync(current_positions)
+        
+        source = ContextInfo.t_quotes.source
+        if isinstance(source, ReplayQuoteSource):
+            bar_time = current_date.replace('-', '').replace(' ', '').replace(':', '')
+            source.replay(start_time=bar_time[:8], end_time=bar_time)
+        flush_orders(ContextInfo)
+    except Exception as e:
+        print("[{}] 做T行情订阅异常: {}".format(current_date, str(e)))
+
+
+def get_position_costs(ContextInfo):
+    """
+    一次查询全部持仓的持仓均价和建仓日期
+    :return: {股票: (买入价, 建仓日期)}
+    """
+    costs = {}
+    try:
+        for detail in get_trade_detail_data(ContextInfo.account_id, "STOCK", "POSITION"):
+            buy_date = datetime.datetime.fromtimestamp(detail.m_nOpenDate // 1000) if detail.m_nOpenDate else datetime.datetime.now()
+            costs[ContextInfo.symbols.position_code(detail)] = (detail.m_dOpenPrice, buy_date)
+    except Exception as e:
+        print("[{}] 获取持仓信息异常: {}".format(current_date, str(e)))
+    return costs
+
+
 def check_stop_loss_take_profit(ContextInfo):
     """
     止盈止损检查
+    全部持仓的最新价和当日最高价一次请求，由止盈止损引擎一次判断回撤止盈、硬止损和超期无盈利清仓
     """
     try:
         current_positions = get_holdings(ContextInfo, "STOCK")
+        engine = ContextInfo.stop_engine
+        
+        # 新持仓从持仓明细登记买入价和建仓日期，已清仓的移除
+        costs = {}
+        if any(stock not in engine for stock in current_positions):
+            costs = get_position_costs(ContextInfo)
+        engine.sync(current_positions, lambda stock: costs.get(stock, (0, datetime.datetime.now())))
+        stocks = list(current_positions)
+        if not stocks:
+            return
+        
+        price_data = ContextInfo.data_client.get_market_data_ex(
+            fields=['close', 'high'],
+            stock_code=stocks,
+            period='1d',
+            start_time=calculate_start_date(current_date, 1),
+            end_time=current_date.replace('-', '').replace(' ', '')[:8],
+            count=-1
+        )
+        price = np.full(len(stocks), np.nan)
+        high = np.full(len(stocks), np.nan)
+        for i, stock in enumerate(stocks):
+            df = price_data.get(stock)
+            if df is not None and not df.empty:
+                price[i] = df['close'].iloc[-1]
+                high[i] = df['high'].iloc[-1]
+        
+        exits = engine.evaluate(stocks, price, high, current_date[:10], ContextInfo.take_profit,
+                                ContextInfo.drawdown_threshold, ContextInfo.stop_loss)
+        for signal in exits:
+            order_shares_local(signal.stock, -current_positions[signal.stock], "CLOSE_ALL", 0, ContextInfo, signal.name)
+            if signal.reason == EXIT_DRAWDOWN:
+                print("[{}] 回撤止盈: {}, 收益率: {:.2f}%, 回撤: {:.2f}%".format(
+                    current_date, signal.stock, signal.return_rate*100, signal.drawdown*100))
+            elif signal.reason == EXIT_HARD_STOP:
+                print("[{}] 硬止损: {}, 亏损幅度: {:.2f}%".format(current_date, signal.stock, signal.return_rate*100))
+            else:
+                print("[{}] 无盈利清仓: {}, 持仓天数: {}天, 随机天数上限: {}天".format(
+                    current_date, signal.stock, signal.hold_days, signal.hold_limit))
         
-        for stock in current_positions:
-            # 获取持仓信息
-            if stock not in ContextInfo.position_info:
-                # 获取股票的持仓成本和持仓日期
-                holdings = get_holdings(ContextInfo, "STOCK")
-                buy_price = 0
-                buy_date = datetime.datetime.now()
-                
-                # 尝试从交易记录中获取买入价格和日期
-                try:
-                    trade_details = get_trade_detail_data(ContextInfo.account_id, "STOCK", "POSITION")
-                    for detail in trade_details:
-                        if detail.m_strInstrumentID + "." + detail.m_strExchangeID == stock:
-                            buy_price = detail.m_dOpenPrice  # 获取持仓均价
-                            buy_date = datetime.datetime.fromtimestamp(detail.m_nOpenDate // 1000) if detail.m_nOpenDate else datetime.datetime.now()
-                            break
-                except Exception as e:
-                    print("[{}] 获取持仓信息异常: {}".format(current_date, str(e)))
-                
-                ContextInfo.position_info[stock] = {
-                    'buy_price': buy_price,
-                    'buy_date': buy_date,
-                    'highest_price': buy_price  # 初始最高价设为买入价
-                }
-            
-            pos_info = ContextInfo.position_info[stock]
-            
-            # 获取当前价格
-            price_data = ContextInfo.get_market_data_ex(
-                fields=['close', 'high'],
-                stock_code=[stock],
-                period='1d',
-                start_time=calculate_start_date(current_date, 1),
-                end_time=current_date.replace('-', '').replace(' ', '')[:8],
-                count=-1
-            )
-            
-            if stock in price_data and not price_data[stock].empty:
-                current_price = price_data[stock]['close'].iloc[-1]
-                high_price = price_data[stock]['high'].iloc[-1]
-                
-                # 更新最高价
-                if current_price > pos_info['highest_price']:
-                    pos_info['highest_price'] = current_price
-                
-                # 计算收益率
-                if pos_info['buy_price'] > 0:
-                    return_rate = (current_price / pos_info['buy_price']) - 1
-                    
-                    # 1. 浮动止盈：收益率达到5%以上时，设置回撤2%止盈
-                    if return_rate >= ContextInfo.take_profit:
-                        drawdown = (pos_info['highest_price'] - current_price) / pos_info['highest_price']
-                        if drawdown >= ContextInfo.drawdown_threshold:
-                            # 触发回撤止盈
-                            order_shares_local(stock, -current_positions[stock], "CLOSE_ALL", 0, ContextInfo, "drawdown_stop")
-                            print("[{}] 回撤止盈: {}, 收益率: {:.2f}%, 回撤: {:.2f}%".format(
-                                current_date, stock, return_rate*100, drawdown*100))
-                            continue
-                    
-                    # 2. 硬止损：单笔交易最大亏损不超过3%
-                    if return_rate <= -ContextInfo.stop_loss:
-                        order_shares_local(stock, -current_positions[stock], "CLOSE_ALL", 0, ContextInfo, "hard_stop_loss")
-                        print("[{}] 硬止损: {}, 亏损幅度: {:.2f}%".format(current_date, stock, return_rate*100))
-                        continue
-                
-                # 3. 时间止盈：持仓超过5个交易日未盈利考虑平仓
-                # hold_days = (datetime.datetime.now() - pos_info['buy_date']).days
-                # if hold_days > ContextInfo.max_hold_days and pos_info['buy_price'] > 0:
-                #     if current_price <= pos_info['buy_price']:
-                #         order_shares_local(stock, -current_positions[stock], "CLOSE_ALL", 0, ContextInfo, "time_stop")
-                #         print("[{}] 时间止盈: {}, 持仓天数: {}天".format(current_date, stock, hold_days))
-                        
-                # 4. 新增功能：持仓超过7-10天且没有盈利时清仓
-                import random
-                max_hold_days_random = random.randint(7, 10)  # 7-10天的随机天数
-                if hold_days > max_hold_days_random and pos_info['buy_price'] > 0:
-                    if current_price <= pos_info['buy_price']:  # 没有盈利
-                        order_shares_local(stock, -current_positions[stock], "CLOSE_ALL", 0, ContextInfo, "no_profit_clear")
-                        print("[{}] 无盈利清仓: {}, 持仓天数: {}天, 随机天数上限: {}天".format(current_date, stock, hold_days, max_hold_days_random))
+        # 全部持仓检查完毕后，止盈止损订单一次性提交
+        flush_orders(ContextInfo)
                         
     except Exception as e:
         print("[{}] 止盈止损检查异常: {}".format(current_date, str(e)))
 
 
+def update_portfolio_risk(ContextInfo):
+    """
+    更新持仓和基准的EWMA协方差，计算组合风险指标写入ContextInfo.portfolio_risk
+    每根K线只请求一次最新收盘价，持仓新增股票时请求一次历史K线初始化其协方差
+    """
+    try:
+        model = ContextInfo.risk_model
+        benchmark = ContextInfo.benchmark
+        holdings = get_holdings(ContextInfo, "STOCK")
+        codes = [benchmark] + sorted(stock for stock in holdings if stock != benchmark)
+        added = model.set_codes(codes)
+        period = getattr(ContextInfo, 'period', '1d')
+        data = ContextInfo.data_client.get_market_data_ex(
+            fields=['close'],
+            stock_code=codes,
+            period=period,
+            end_time=current_date.replace('-', '').replace(' ', '')[:8],
+            count=RISK_SEED_BARS + 1 if added else 1
+        )
+        
+        if added:
+            # 历史K线初始化新增股票的协方差，最后一根K线作为本期价格计入
+            aligned_codes, _, matrices = align_frames(data, ('close',))
+            if 'close' in matrices:
+                model.seed(aligned_codes, matrices['close'][:, :-1])
+                prices = dict(zip(aligned_codes, matrices['close'][:, -1]))
+            else:
+                prices = {}
+        else:
+            prices = dict((stock, df['close'].iloc[-1]) for stock, df in data.items() if not df.empty)
+        model.update(prices, key=ContextInfo.get_bar_timetag(ContextInfo.barpos))
+        
+        # 按持仓市值计算权重
+        values = dict((stock, holdings[stock] * model.last_price[model.index[stock]]) for stock in codes[1:])
+        total = sum(value for value in values.values() if np.isfinite(value))
+        if total <= 0:
+            ContextInfo.portfolio_risk = None
+            return None
+        weights = dict((stock, value / total) for stock, value in values.items() if np.isfinite(value))
+        periods_per_year = 252.0 * PERIOD_MINUTES['1d'] / PERIOD_MINUTES.get(period, PERIOD_MINUTES['1d'])
+        metrics = model.metrics(weights, benchmark, periods_per_year)
+        ContextInfo.portfolio_risk = metrics
+        if metrics is None:
+            print("[{}] 组合风险: 收益率观测不足{}期，暂不计算".format(current_date, RISK_MIN_PERIODS))
+            return None
+        
+        top = int(np.argmax(metrics['contribution_pct']))
+        print("[{}] 组合风险: 年化波动率{:.2f}%, 与沪深300相关系数{:.2f}, 贝塔{:.2f}, 风险贡献最大: {}({:.1f}%)".format(
+            current_date, metrics['volatility'] * 100, metrics['portfolio_correlation'], metrics['portfolio_beta'],
+            metrics['codes'][top], metrics['contribution_pct'][top] * 100))
+        return metrics
+    except Exception as e:
+        print("[{}] 组合风险计算异常: {}".format(current_date, str(e)))
+        ContextInfo.portfolio_risk = None
+        return None
+
+
+def risk_reduction_ratios(ContextInfo, stocks, base_ratio):
+    """
+    各持仓的减仓比例：有组合风险指标时按风险贡献分配(减仓总市值与统一比例相同)，否则统一按base_ratio
+    """
+    ratios = dict((stock, base_ratio) for stock in stocks)
+    if ContextInfo.portfolio_risk is not None:
+        ratios.update(targeted_reduction_ratios(ContextInfo.portfolio_risk, base_ratio))
+    return ratios
+
+
 def risk_avoidance(ContextInfo):
     """
     自动避险机制
+    高风险减仓50%、中等风险减仓30%，按各持仓的风险贡献分配减仓数量
     """
     try:
         # 根据市场风险等级调整仓位
         if ContextInfo.market_risk_level == 2:
             # 高风险：减仓至50%以下
             current_positions = get_holdings(ContextInfo, "STOCK")
-            reduce_ratio = 0.5
+            ratios = risk_reduction_ratios(ContextInfo, current_positions, 0.5)
             for stock in current_positions:
-                reduce_amount = int(current_positions[stock] * reduce_ratio)
+                reduce_amount = int(current_positions[stock] * ratios[stock])
                 if reduce_amount > 0:
                     order_shares_local(stock, -reduce_amount, "FIX", 0, ContextInfo, "risk_avoidance")
                     print("[{}] 高风险避险减仓: {}, 减仓数量: {}".format(current_date, stock, reduce_amount))
         elif ContextInfo.market_risk_level == 1:
             # 中等风险：减仓至70%
             current_positions = get_holdings(ContextInfo, "STOCK")
-            reduce_ratio = 0.3
+            ratios = risk_reduction_ratios(ContextInfo, current_positions, 0.3)
             for stock in current_positions:
-                reduce_amount = int(current_positions[stock] * reduce_ratio)
+                reduce_amount = int(current_positions[stock] * ratios[stock])
                 if reduce_amount > 0:
                     order_shares_local(stock, -reduce_amount, "FIX", 0, ContextInfo, "risk_avoidance")
                     print("[{}] 中等风险减仓: {}, 减仓数量: {}".format(current_date, stock, reduce_amount))
+        
+        # 全部持仓的减仓订单一次性提交
+        flush_orders(ContextInfo)
                     
     except Exception as e:
         print("[{}] 避险机制异常: {}".format(current_date, str(e)))
@@ -1109,7 +1607,7 @@ def get_holdings(ContextInfo, datatype):
         resultlist = get_trade_detail_data(ContextInfo.account_id, datatype, "POSITION")
         for obj in resultlist:
             # 将持仓数据转换为字典格式，键为股票代码，值为持仓数量
-            holdings[obj.m_strInstrumentID + "." + obj.m_strExchangeID] = obj.m_nVolume
+            holdings[ContextInfo.symbols.position_code(obj)] = obj.m_nVolume
         return holdings
     except:
         return {}
@@ -1132,19 +1630,66 @@ def timetag_to_datetime(timetag, format):
 def order_shares_local(stock_code, shares, order_type, price, ContextInfo, strategy_name):
     """
     下单函数（支持回测和实盘）
+    订单进入下单网关队列，由flush_orders在策略线程中批量提交，结果通过回调返回
     """
     try:
-        # 区分回测和实盘环境
-        action = "买入" if shares > 0 else "卖出"
-        
-        result = order_shares(stock_code, shares, order_type, price, ContextInfo,strategy_name)
-        print("[{}] 策略: {} 下单: {} {} {}股, 价格: {}, 结果: {}".format(current_date, strategy_name, action, stock_code, abs(shares), price, result))
-        return result
+        return ContextInfo.order_gateway.submit(stock_code, shares, order_type, price, strategy_name)
     except Exception as e:
         print("[{}] 下单异常: {}".format(current_date, str(e)))
         return {"success": False, "error": str(e)}
 
 
+def flush_orders(ContextInfo):
+    """
+    将下单网关中排队的订单一次性提交并等待回报
+    """
+    try:
+        if not ContextInfo.order_gateway.flush(wait=True, timeout=30):
+            print("[{}] 下单网关仍有{}笔订单未回报".format(current_date, ContextInfo.order_gateway.pending_count()))
+    except Exception as e:
+        print("[{}] 提交订单异常: {}".format(current_date, str(e)))
+
+
+def handle_order_submit(ContextInfo, order):
+    """
+    订单进入下单网关队列前的回调（在下单线程中执行），先于该订单的回报记录下单意图
+    """
+    if ContextInfo.journal is not None:
+        ContextInfo.journal.record_intent(order)
+
+
+def handle_order_result(ContextInfo, order):
+    """
+    下单成功回调（在提交订单的线程中执行）
+    """
+    action = "买入" if order.shares > 0 else "卖出"
+    ContextInfo.last_trade_time[order.stock_code] = order.ack_time
+    if isinstance(order.result, dict):
+        # 本地回测下单即成交；平台只返回委托结果，成交由update_performance按成交回报记录
+        ContextInfo.performance.record_fill(order.stock_code, order.result.get('volume', order.shares),
+                                            order.result.get('price', order.price))
+    if ContextInfo.journal is not None:
+        ContextInfo.journal.record_result(order)
+    print("[{}] 策略: {} 下单: {} {} {}股, 价格: {}, 结果: {}, 耗时: {:.1f}ms".format(
+        current_date, order.strategy_name, action, order.stock_code, abs(order.shares), order.price,
+        order.result, (order.latency() or 0) * 1000))
+
+
+def handle_order_reject(ContextInfo, order):
+    """
+    下单失败回调：做T订单被拒时回滚做T仓位
+    """
+    print("[{}] 策略: {} 下单被拒: {} {}股, 原因: {}".format(
+        current_date, order.strategy_name, order.stock_code, order.shares, order.error))
+    if ContextInfo.journal is not None:
+        ContextInfo.journal.record_result(order)
+    if order.strategy_name in ('t_trade', 't_stop_loss', 't_take_profit'):
+        # 行情驱动做T时做T规则在行情回调线程中执行，回滚与其共用锁
+        with ContextInfo.t_lock:
+            if order.stock_code in ContextInfo.t_holdings:
+                ContextInfo.t_holdings[order.stock_code]['t_position'] -= order.shares
+
+
 def calculate_technical_score(ContextInfo, stock):
     """
     计算技术面综合评分，使用多种技术指标
@@ -1155,13 +1700,14 @@ def calculate_technical_score(ContextInfo, stock):
         indicators_count = 0
         
         # 获取价格数据
-        data = ContextInfo.get_market_data_ex(
+        data = ContextInfo.data_client.get_market_data_ex(
             fields=['close', 'high', 'low', 'open', 'volume'],
             stock_code=[stock],
             period='1d',
             start_time=calculate_start_date(current_date, 20),
             end_time=current_date.replace('-', '').replace(' ', '')[:8],
-            count=-1
+            count=-1,
+            strict=True
         )
         
         if stock not in data or data[stock].empty or len(data[stock]) < 14:
@@ -1215,6 +1761,8 @@ def calculate_technical_score(ContextInfo, stock):
         else:
             return 0
             
+    except DataRequestError:
+        raise
     except Exception as e:
         print("[{}] 计算技术面评分异常 {}: {}".format(current_date, stock, str(e)))
         return 0
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+K线合成模块
+由5分钟K线按A股交易时段(9:30-11:30, 13:00-15:00)在本地增量合成15m/30m/60m/120m/1d K线，
+以及由内存中的日线矩阵批量合成周线
+K线时间按平台惯例标记为该K线的结束时间，如15分钟线的第一根为093000-094500，标记为094500
+"""
+
+import collections
+
+import numpy as np
+import pandas as pd
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'amount')
+
+# 各周期的分钟数，1d按交易日合成
+PERIOD_MINUTES = {'5m': 5, '15m': 15, '30m': 30, '60m': 60, '120m': 120, '1d': 240}
+
+MORNING_OPEN = 9 * 60 + 30      # 上午开盘 09:30
+AFTERNOON_OPEN = 13 * 60        # 下午开盘 13:00
+SESSION_MINUTES = 120           # 上午/下午各120分钟
+
+
+def session_minutes(hhmm):
+    """
+    将时间(HHMM)转换为当日已交易分钟数，上午1-120，下午121-240
+    午休时段归入上午最后一根K线
+    """
+    minute = int(hhmm[:2]) * 60 + int(hhmm[2:4])
+    if minute >= AFTERNOON_OPEN:
+        return min(SESSION_MINUTES + minute - AFTERNOON_OPEN, 2 * SESSION_MINUTES)
+    return min(max(minute - MORNING_OPEN, 1), SESSION_MINUTES)
+
+
+def bar_end_label(time_str, period):
+    """
+    计算5分钟K线所属目标周期K线的结束时间标签
+    :param time_str: 5分钟K线时间，格式YYYYMMDDHHMMSS
+    :param period: 目标周期，如'15m'、'120m'、'1d'
+    :return: 目标K线时间标签，日线为YYYYMMDD
+    """
+    time_str = str(time_str)
+    if period == '1d':
+        return time_str[:8]
+    size = PERIOD_MINUTES[period]
+    elapsed = session_minutes(time_str[8:12])
+    end = -(-elapsed // size) * size
+    if end <= SESSION_MINUTES:
+        minute = MORNING_OPEN + end
+    else:
+        minute = AFTERNOON_OPEN + end - SESSION_MINUTES
+    return '{}{:02d}{:02d}00'.format(time_str[:8], minute // 60, minute % 60)
+
+
+class BarResampler(object):
+    """
+    多周期K线增量合成器
+    每只股票每个周期保留有限长度的已完成K线和一根正在形成的K线，
+    输入一根5分钟K线只需O(周期数)更新
+    实盘中最后一根5分钟线仍在形成，再次输入同一时间的5分钟线时撤销其上次的贡献后按新数据重新计入
+    """
+
+    def __init__(self, periods=('5m', '15m', '120m', '1d'), max_bars=800):
+        self.periods = tuple(periods)
+        self.max_bars = max_bars
+        self._completed = {}    # {(股票, 周期): deque([time, open, high, low, close, volume, amount])}
+        self._partial = {}      # {(股票, 周期): [time, open, high, low, close, volume, amount]}
+        self._last_time = {}    # {股票: 最后一根已处理5分钟K线时间}
+        self._undo = {}         # {股票: [(周期, 计入最后一根5分钟线之前的未完成K线副本或None, 因此完成的K线数)]}
+
+    def last_time(self, stock):
+        """
+        已处理的最后一根5分钟K线时间，未处理过返回None
+        """
+        return self._last_time.get(stock)
+
+    def update(self, stock, time_str, open_price, high, low, close, volume=0.0, amount=0.0):
+        """
+        输入一根5分钟K线，更新各周期K线
+        与最后一根已处理5分钟线时间相同时视为该K线的更新，替换其上次的数据；更早的K线忽略
+        :return: 本次完成的K线列表[(周期, K线)]
+        """
+        time_str = str(time_str)
+        last = self._last_time.get(stock)
+        if last is not None and time_str <= last:
+            if time_str < last or stock not in self._undo:
+                return []
+            self._rollback(stock)
+        self._last_time[stock] = time_str
+
+        finished = []
+        undo = []
+        for period in self.periods:
+            key = (stock, period)
+            label = bar_end_label(time_str, period)
+            bar = self._partial.get(key)
+            undo.append((period, list(bar) if bar is not None else None, len(finished)))
+            if bar is not None and bar[0] != label:
+                # 新K线开始时上一根K线即完成（如遇停牌缺少最后一根5分钟线）
+                self._complete(key, bar)
+                finished.append((period, bar))
+                bar = None
+            if bar is None:
+                bar = [label, open_price, high, low, close, volume, amount]
+                self._partial[key] = bar
+            else:
+                bar[2] = max(bar[2], high)
+                bar[3] = min(bar[3], low)
+                bar[4] = close
+                bar[5] += volume
+                bar[6] += amount
+            if period != '1d' and label == time_str:
+                # 收到该周期最后一根5分钟线，K线完成
+                self._complete(key, bar)
+                finished.append((period, bar))
+                del self._partial[key]
+        self._undo[stock] = [(period, previous, sum(1 for item in finished[start:] if item[0] == period))
+                             for period, previous, start in undo]
+        return finished
+
+    def _rollback(self, stock):
+        """
+        撤销最后一根5分钟线对各周期K线的贡献
+        """
+        for period, previous, completed in self._undo.pop(stock):
+            key = (stock, period)
+            bars = self._completed.get(key)
+            for _ in range(completed):
+                bars.pop()
+            if previous is None:
+                self._partial.pop(key, None)
+            else:
+                self._partial[key] = previous
+
+    def update_frame(self, stock, df):
+        """
+        批量输入5分钟K线DataFrame(索引为时间)，只处理最后一根已处理K线(可能已更新)及之后的部分
+        :return: 处理的K线数量
+        """
+        if df is None or df.empty:
+            return 0
+        last = self._last_time.get(stock)
+        if last is not None:
+            df = df[df.index.astype(str) >= last]
+        columns = [df[field].values if field in df.columns else [0.0] * len(df) for field in BAR_FIELDS]
+        for row in zip(df.index, *columns):
+            self.update(stock, *row)
+        return len(df)
+
+    def _complete(self, key, bar):
+        bars = self._completed.get(key)
+        if bars is None:
+            bars = collections.deque(maxlen=self.max_bars)
+            self._completed[key] = bars
+        bars.append(bar)
+
+    def bars(self, stock, period, include_partial=True):
+        """
+        获取某只股票某周期的K线DataFrame，索引为时间标签
+        :param include_partial: 是否包含正在形成的最后一根K线（与平台实时数据一致）
+        """
+        rows = list(self._completed.get((stock, period), ()))
+        if include_partial and (stock, period) in self._partial:
+            rows.append(self._partial[(stock, period)])
+        df = pd.DataFrame(rows, columns=('time',) + BAR_FIELDS)
+        return df.set_index('time')
+
+    def export_state(self):
+        """
+        导出合成状态，用于写入快照
+        :return: (元数据字典, {'bar_times': 时间数组, 'bar_values': 形状为(K线数, 6)的数组})
+        元数据中keys按[股票, 周期, 已完成K线数, 是否有未完成K线]记录各段K线在数组中的位置
+        """
+        keys = []
+        times = []
+        values = []
+        for key in sorted(set(self._completed) | set(self._partial)):
+            rows = list(self._completed.get(key, ()))
+            partial = key in self._partial
+            if partial:
+                rows.append(self._partial[key])
+            keys.append([key[0], key[1], len(rows) - int(partial), partial])
+            times.extend(row[0] for row in rows)
+            values.extend(row[1:] for row in rows)
+        meta = {'periods': list(self.periods), 'keys': keys, 'last_time': dict(self._last_time)}
+        arrays = {
+            'bar_times': np.array(times, dtype='U14'),
+            'bar_values': np.array(values, dtype=np.float64).reshape(len(values), len(BAR_FIELDS)),
+        }
+        return meta, arrays
+
+    def load_state(self, meta, arrays):
+        """
+        从快照恢复合成状态，周期设置不一致时不恢复
+        :return: 是否恢复成功
+        """
+        if list(meta.get('periods', ())) != list(self.periods):
+            return False
+        self.reset()
+        times = arrays['bar_times']
+        values = np.asarray(arrays['bar_values']).tolist()
+        position = 0
+        for stock, period, completed, partial in meta.get('keys', ()):
+            key = (stock, period)
+            rows = [[str(times[i])] + values[i] for i in range(position, position + completed + int(partial))]
+            position += len(rows)
+            if partial:
+                self._partial[key] = rows.pop()
+            if rows:
+                self._completed[key] = collections.deque(rows, maxlen=self.max_bars)
+        self._last_time = dict(meta.get('last_time', {}))
+        return True
+
+    def reset(self, stock=None):
+        """
+        清除某只股票或全部股票的合成状态
+        """
+        if stock is None:
+            self._completed.clear()
+            self._partial.clear()
+            self._last_time.clear()
+            self._undo.clear()
+            return
+        for period in self.periods:
+            self._completed.pop((stock, period), None)
+            self._partial.pop((stock, period), None)
+        self._last_time.pop(stock, None)
+        self._undo.pop(stock, None)
+
+
+def align_frames(frames, fields=BAR_FIELDS):
+    """
+    将{股票代码: DataFrame(索引为时间)}对齐到统一时间轴，缺失数据记为nan
+    :return: (股票代码列表, 时间列表, {字段: 形状为(股票数, 时间数)的矩阵})
+    """
+    frames = dict((code, df) for code, df in frames.items() if df is not None and not df.empty)
+    codes = list(frames.keys())
+    times = sorted(set().union(*(df.index.astype(str) for df in frames.values()))) if frames else []
+    fields = [field for field in fields if any(field in df.columns for df in frames.values())]
+    time_index = pd.Index(times)
+    matrices = dict((field, np.full((len(codes), len(times)), np.nan)) for field in fields)
+    for i, code in enumerate(codes):
+        df = frames[code]
+        positions = time_index.get_indexer(df.index.astype(str))
+        for field in fields:
+            if field in df.columns:
+                matrices[field][i, positions] = df[field].values
+    return codes, times, matrices
+
+
+def merge_aligned(base, update, max_times=None, until=None):
+    """
+    合并两份align_frames的结果，update中的非nan数据覆盖base，股票和时间取并集
+    :param base/update: (股票代码列表, 时间列表, {字段: 矩阵})
+    :param max_times: 只保留最近的时间数量
+    :param until: 只保留不晚于该时间的数据(按时间字符串前缀比较，如YYYYMMDD)，回测时用于剔除当前K线之后的数据
+    :return: (股票代码列表, 时间列表, {字段: 矩阵})
+    """
+    base_codes, base_times, base_matrices = base
+    new_codes, new_times, new_matrices = update
+    codes = list(base_codes) + [code for code in new_codes if code not in set(base_codes)]
+    times = sorted(set(base_times) | set(new_times))
+    if until:
+        times = [t for t in times if str(t)[:len(until)] <= until]
+    if max_times:
+        times = times[-max_times:]
+    code_index = dict((code, i) for i, code in enumerate(codes))
+    time_index = pd.Index(times)
+    fields = list(base_matrices.keys()) + [field for field in new_matrices if field not in base_matrices]
+
+    matrices = {}
+    for field in fields:
+        matrix = np.full((len(codes), len(times)), np.nan)
+        for part_codes, part_times, part_matrices in ((base_codes, base_times, base_matrices),
+                                                      (new_codes, new_times, new_matrices)):
+            if field not in part_matrices or not len(part_codes):
+                continue
+            columns = time_index.get_indexer(pd.Index(part_times))
+            keep = columns >= 0
+            rows = np.array([code_index[code] for code in part_codes])
+            values = part_matrices[field][:, keep]
+            target = matrix[rows[:, None], columns[keep][None, :]]
+            matrix[rows[:, None], columns[keep][None, :]] = np.where(np.isnan(values), target, values)
+        matrices[field] = matrix
+    return codes, times, matrices
+
+
+def week_keys(dates):
+    """
+    交易日所属自然周的编号（以周一为一周开始），dates格式为YYYYMMDD
+    """
+    days = pd.to_datetime(pd.Index([str(d)[:8] for d in dates]), format='%Y%m%d').values.astype('datetime64[D]').astype(np.int64)
+    # 1970-01-01为周四，偏移3天使周一成为每周第一天
+    return (days + 3) // 7
+
+
+def build_weekly_bars(dates, high, low, close, open_price=None, volume=None):
+    """
+    由日线矩阵一次性合成周线，包含尚未走完的当周
+    节假日缩短的周按实际交易日合成；停牌日(价格为nan或成交量为0)不参与合成，整周停牌的周线为nan
+
+    :param dates: 交易日列表(YYYYMMDD)，升序，与矩阵列对应
+    :param high/low/close/open_price/volume: 形状为(股票数, 交易日数)或(交易日数,)的数组
+    :return: (周线时间标签列表(每周最后一个交易日), {字段: 周线矩阵})
+    """
+    high, low, close = [np.atleast_2d(np.asarray(x, dtype=float)) for x in (high, low, close)]
+    n_days = close.shape[1]
+    if n_days == 0:
+        empty = np.empty((close.shape[0], 0))
+        return [], dict((field, empty) for field in ('open', 'high', 'low', 'close', 'volume'))
+
+    keys = week_keys(dates)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], n_days] - 1
+
+    valid = ~np.isnan(close)
+    if volume is not None:
+        volume = np.atleast_2d(np.asarray(volume, dtype=float))
+        valid &= np.nan_to_num(volume) > 0
+
+    positions = np.broadcast_to(np.arange(n_days), close.shape)
+    first = np.minimum.reduceat(np.where(valid, positions, n_days), starts, axis=1)
+    last = np.maximum.reduceat(np.where(valid, positions, -1), starts, axis=1)
+    has_data = last >= 0
+    rows = np.arange(close.shape[0])[:, None]
+
+    weekly = {}
+    weekly['high'] = np.where(has_data, np.fmax.reduceat(np.where(valid, high, np.nan), starts, axis=1), np.nan)
+    weekly['low'] = np.where(has_data, np.fmin.reduceat(np.where(valid, low, np.nan), starts, axis=1), np.nan)
+    weekly['close'] = np.where(has_data, close[rows, np.clip(last, 0, n_days - 1)], np.nan)
+    if open_price is not None:
+        open_price = np.atleast_2d(np.asarray(open_price, dtype=float))
+        weekly['open'] = np.where(has_data, open_price[rows, np.clip(first, 0, n_days - 1)], np.nan)
+    if volume is not None:
+        weekly['volume'] = np.add.reduceat(np.where(valid, volume, 0.0), starts, axis=1)
+
+    labels = [str(dates[i])[:8] for i in ends]
+    return labels, weekly
@@ -1,10 +1,17 @@
 #coding:gbk
 #!/usr/bin/python
-import time, datetime
+import os, time, datetime
 import numpy as np
 
+from µ import OrderGateway
+from ֤ȯ import SymbolTable, SymbolArray
+from Чͳ import PerformanceTracker, periods_per_year_of
+
 #֤50ָ鱾ģָ֤
 
+#ʵֵ̾ļļָЧͳƣزֻڴͳ
+PERFORMANCE_PATH = os.path.join(os.path.expanduser('~'), 'strategy_performance', '֤50߲.equity')
+
 def init(ContextInfo):
 	#ȡɷݹ
 	s=ContextInfo.get_stock_list_in_sector('֤50')
@@ -16,7 +23,22 @@ def init(ContextInfo):
 	#û׼(ǰͼ׼)
 	ContextInfo.benchmark=ContextInfo.stockcode+"."+ContextInfo.market
 	
-	ContextInfo.tmp = {i:0 for i in s}
+	#ƱӳΪţƱ״̬ڰ
+	ContextInfo.symbols = SymbolTable(s)
+	ContextInfo.tmp = SymbolArray(ContextInfo.symbols, np.int8, 0)
+	ContextInfo.holdings = SymbolArray(ContextInfo.symbols, np.float64, 0)
+	
+	#ЧͳƣÿK߸¾ֵسյָ
+	live = not getattr(ContextInfo, 'do_back_test', False)
+	ContextInfo.performance = PerformanceTracker(PERFORMANCE_PATH if live else None, periods_per_year=periods_per_year_of(getattr(ContextInfo, 'period', '1d')), resume=live)
+	
+	#µأŶӣÿKڲ߳ͳһύ
+	ContextInfo.order_gateway = OrderGateway(
+		submit_func=lambda order: order_shares(order.stock_code, order.shares, order.order_type, order.price, ContextInfo, "testS"),
+		on_result=lambda order: record_fill(ContextInfo, order),
+		on_reject=lambda order: print('µʧ%s %s'%(order.stock_code, order.error)),
+		background=False
+	)
 	
 def handlebar(ContextInfo):
 	d = ContextInfo.barpos
@@ -24,51 +46,79 @@ def handlebar(ContextInfo):
 	nowdate = timetag_to_datetime(realtime,'%Y-%m-%d')
 	#ǰе
 	print(nowdate)
-	ContextInfo.holdings=get_holdings('testS','STOCK')
+	symbols = ContextInfo.symbols
+	holdings = ContextInfo.holdings
+	holdings.reset()
+	for sid, volume in get_holdings(symbols,'testS','STOCK'):
+		holdings[sid] = volume
 	last20s=ContextInfo.get_history_data(21,'1d','close')
 	count=0
 	buyNumber = 0
 	buyAmount = 0
 	sellNumber = 0
 	sellAmount = 0
-	for k ,closes in list(last20s.items()):
-		if len(closes)<21:
-			continue
-		pre=closes[-1]
-		m20=np.mean(closes[:20])
-		m5=np.mean(closes[-6:-1])
-		
-		if ContextInfo.tmp[k] == 0:
-			if m5 >= m20:
-				ContextInfo.tmp[k] = 0
-			else:
-				ContextInfo.tmp[k] = 1
+	#㹻ĹƱ(Ʊ, 21)̼۾
+	codes = [k for k, closes in list(last20s.items()) if len(closes) >= 21]
+	ids = symbols.intern_many(codes)
+	closes = np.array([last20s[k][-21:] for k in codes], dtype=float).reshape(len(codes), 21)
+	pre = closes[:, -1]
+	m20 = closes[:, :20].mean(axis=1)
+	m5 = closes[:, -6:-1].mean(axis=1)
+	
+	state = ContextInfo.tmp[ids]
+	watching = state == 0
+	#۲״̬ĹƱ5վߵ20վߺ뽻״̬
+	ContextInfo.tmp[ids[watching & (m5 < m20)]] = 1
+	#ԹƱĹƱ
+	held = holdings[ids] != 0
+	sell = ~watching & (m5 <= m20) & held
+	buy = ~watching & (m5 > m20) & ~held
+	for i in np.flatnonzero(sell | buy):
+		k = codes[i]
+		sid = ids[i]
+		if sell[i]:
+			sellNumber += 1
+			sellAmount += float(holdings[sid]) * pre[i]
+			ContextInfo.order_gateway.submit(k,-float(holdings[sid]),"FIX",pre[i],"testS")
+			holdings[sid] = 0
+			print('%s'%k)
 		else:
-			#ԹƱĹƱ
-			if m5 <= m20:
-				if k in ContextInfo.holdings:
-					sellNumber += 1
-					sellAmount += float(ContextInfo.holdings[k]) * pre
-					order_shares(k,-float(ContextInfo.holdings[k]),"FIX",pre,ContextInfo,"testS")
-					del ContextInfo.holdings[k]
-					print('%s'%k)
-
-				
-			else:
-				if  k not in ContextInfo.holdings:
-					ContextInfo.holdings[k] = 500
-					buyNumber += 1
-					buyAmount += float(ContextInfo.holdings[k]) * pre
-					order_shares(k,float(ContextInfo.holdings[k]),"FIX",pre,ContextInfo,"testS")
-					print('%s'%k)
+			holdings[sid] = 500
+			buyNumber += 1
+			buyAmount += float(holdings[sid]) * pre[i]
+			ContextInfo.order_gateway.submit(k,float(holdings[sid]),"FIX",pre[i],"testS")
+			print('%s'%k)
+	#Kߵһύ
+	if not ContextInfo.order_gateway.flush(timeout=30):
+		print('µ%dʶδر'%ContextInfo.order_gateway.pending_count())
 	ContextInfo.paint("buy_num", buyNumber, -1, 0)
 	ContextInfo.paint("sell_num", sellNumber, -1, 0)
+	update_performance(ContextInfo, realtime)
+
+def stop(ContextInfo):
+	if not ContextInfo.order_gateway.stop(timeout=30):
+		print('µ%dʶδر'%ContextInfo.order_gateway.pending_count())
+	ContextInfo.performance.close()
+	print(ContextInfo.performance.report())
+
+def record_fill(ContextInfo, order):
+	#ػزµسɽͼ۸ƽֻ̨ίнɽupdate_performanceɽر¼
+	if isinstance(order.result, dict):
+		ContextInfo.performance.record_fill(order.stock_code, order.result.get('volume', order.shares), order.result.get('price', order.price))
+
+def update_performance(ContextInfo, realtime):
+	#ʲȡ˻ʽ𣬻׼۸ȡ׼̼ۣɽȡԳɽر
+	ContextInfo.performance.record_deals(get_trade_detail_data('testS', 'STOCK', 'DEAL'), ContextInfo.symbols.position_code)
+	accounts = get_trade_detail_data('testS', 'STOCK', 'ACCOUNT')
+	if not accounts:
+		return
+	benchmark = ContextInfo.get_market_data_ex(['close'], [ContextInfo.benchmark], count=1).get(ContextInfo.benchmark)
+	price = float(benchmark['close'].iloc[-1]) if benchmark is not None and len(benchmark) else None
+	ContextInfo.performance.update(realtime, accounts[0].m_dBalance, price)
 					
-def get_holdings(accountid,datatype):
-	holdinglist={}
+def get_holdings(symbols,accountid,datatype):
+	#[(Ʊ, ֲ)]
 	resultlist=get_trade_detail_data(accountid,datatype,"POSITION")
-	for obj in resultlist:
-		holdinglist[obj.m_strInstrumentID+"."+obj.m_strExchangeID]=obj.m_nVolume
-	return holdinglist
+	return [(symbols.position_id(obj), obj.m_nVolume) for obj in resultlist]
 
 
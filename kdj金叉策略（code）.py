@@ -8,11 +8,40 @@ import numpy as np
 import pandas as pd
 import datetime
 import json
+import os
+
+from 下单网关 import OrderGateway
+from 涨跌停价格 import LimitPriceTable
+from K线合成 import align_frames, merge_aligned, build_weekly_bars
+from 预热加载 import BackgroundWarmup
+from 证券代码表 import SymbolTable, SymbolArray
+from 候选表 import CandidateTable
+from 数据限流 import RateLimitedDataClient
+from 多账户持仓 import MultiAccountPositions
+from 绩效统计 import PerformanceTracker, periods_per_year_of
 
 # 策略参数
 MAX_POSITION = 0.2      # 单股最大仓位占比
 MAX_HOLDINGS = 5        # 最大持仓数量
-STOCK_POOL_SIZE = 1000    # 股票池大小
+STOCK_POOL_SIZE = None    # 股票池大小，None表示使用完整股票池
+KDJ_N = 9               # KDJ RSV周期
+KDJ_M1 = 3              # K值平滑周期
+KDJ_M2 = 3              # D值平滑周期
+WEEKLY_BARS = 20        # 计算KDJ使用的周线数量
+DAILY_BARS = WEEKLY_BARS * 5 + 10   # 保留的日线数量
+DAILY_INCREMENT_BARS = 3            # 已有日线矩阵时每根K线补充请求的日线数量
+DAILY_FETCH_BATCH = 200             # 完整加载日线时每次请求的股票数量
+DAILY_FIELDS = ('high', 'low', 'close', 'volume')
+DATA_RATE = 50          # 行情接口每秒最多请求数，None表示不限速
+DATA_BURST = 10         # 允许的突发请求数
+DATA_CONCURRENCY = 2    # 同时进行的行情请求数
+DATA_RETRIES = 3        # 请求失败的最大重试次数
+BACKGROUND_WARMUP = True  # 实盘在后台线程预热日线历史和股票名称；平台不允许在init/handlebar之外调用数据接口时设为False
+ACCOUNT_IDS = ['testS']  # 运行本策略的全部子账户，第一个为下单账户
+ACCOUNT_WORKERS = 8     # 并发查询持仓和资金的线程数上限
+MAX_STOCK_RATIO = 0.8   # 持仓金额占总资产的比例低于该值时允许买入
+# 实盘净值曲线文件，重启后由文件恢复绩效统计；回测只在内存中统计
+PERFORMANCE_PATH = os.path.join(os.path.expanduser('~'), 'strategy_performance', 'kdj金叉策略.equity')
 
 # 全局变量
 formatted_time = ""     # 格式化时间
@@ -45,11 +74,33 @@ def init(ContextInfo):
     ContextInfo.max_position = MAX_POSITION
     ContextInfo.max_holdings = MAX_HOLDINGS
     ContextInfo.stock_pool_size = STOCK_POOL_SIZE
-    ContextInfo.accID = 'testS'
+    ContextInfo.account_ids = list(ACCOUNT_IDS)
+    ContextInfo.accID = ContextInfo.account_ids[0]
+    
+    # 行情接口访问层：限速、限并发、失败重试，分批请求完整股票池
+    ContextInfo.data_client = RateLimitedDataClient(
+        ContextInfo, rate=DATA_RATE, burst=DATA_BURST, max_concurrency=DATA_CONCURRENCY,
+        max_retries=DATA_RETRIES, chunk_size=DAILY_FETCH_BATCH, logger=log_message)
 
     # 初始化变量
     init_position_manager(ContextInfo)  # 持仓信息
     
+    # 绩效统计：每根K线更新净值、回撤、夏普等指标
+    live = not getattr(ContextInfo, 'do_back_test', False)
+    ContextInfo.performance = PerformanceTracker(
+        PERFORMANCE_PATH if live else None, periods_per_year=periods_per_year_of(getattr(ContextInfo, 'period', '1d')),
+        resume=live, logger=log_message)
+    
+    # 下单网关：订单排队，每根K线在策略线程中批量提交(平台下单接口不在工作线程调用)，回报通过回调写回策略状态
+    ContextInfo.last_orders = {}       # 每只股票最近一笔订单
+    ContextInfo.rejected_orders = []   # 被拒绝的订单
+    ContextInfo.order_gateway = OrderGateway(
+        submit_func=lambda order: order_shares(order.stock_code, order.shares, ContextInfo, ContextInfo.accID),
+        on_result=lambda order: handle_order_result(ContextInfo, order),
+        on_reject=lambda order: handle_order_reject(ContextInfo, order),
+        background=False
+    )
+    
     # 设置回测参数，使用中证2000股票池
     # 修改股票池设置，使用中证2000
     s = ContextInfo.get_stock_list_in_sector('中证2000')
@@ -63,11 +114,26 @@ def init(ContextInfo):
     if not s:
         # 如果无法获取股票池，则使用默认标的
         s = [ContextInfo.stockcode + '.' + ContextInfo.market]
-    else:
+    elif ContextInfo.stock_pool_size:
         # 取前STOCK_POOL_SIZE只股票
         s = s[:ContextInfo.stock_pool_size]
     
     ContextInfo.set_universe(s)
+    ContextInfo.symbols = SymbolTable(s)  # 股票代码 <-> 整数编号
+    
+    # 多账户持仓服务：并发刷新全部子账户的持仓和资金
+    ContextInfo.positions = MultiAccountPositions(
+        lambda *args: get_trade_detail_data(*args), ContextInfo.account_ids, ContextInfo.symbols,
+        max_workers=ACCOUNT_WORKERS, max_stock_ratio=MAX_STOCK_RATIO, logger=log_message)
+    
+    # 后台预热：实盘开盘前加载股票池的最新日线历史和股票名称，handlebar就绪后直接使用
+    # 回测不预热：最新日线包含当前K线之后的数据，由首根K线按当前日期加载
+    ContextInfo.warmup = None
+    if BACKGROUND_WARMUP and not getattr(ContextInfo, 'do_back_test', False):
+        ContextInfo.warmup = BackgroundWarmup(logger=log_message)
+        ContextInfo.warmup.add('日线历史', lambda progress: fetch_daily_history(ContextInfo, s, '', progress))
+        ContextInfo.warmup.add('股票名称', lambda progress: load_stock_names(ContextInfo, s, progress))
+        ContextInfo.warmup.start()
     
     log_message("策略初始化完成，标的股票数量: ", len(s))
     
@@ -83,9 +149,9 @@ def handlebar(ContextInfo):
     
     log_message("执行策略，原始时间标签: ", current_time, "K线位置: ", ContextInfo.barpos)
     
-    update_positions(ContextInfo, ContextInfo.accID)
+    update_positions(ContextInfo)
 
-    buy_candidates = [];
+    buy_candidates = CandidateTable(ContextInfo.symbols)
 
     # 如果持仓未满，需要计算kdj指标
     if len(ContextInfo.holdings) < ContextInfo.max_holdings and ContextInfo.enable_flag:
@@ -96,8 +162,24 @@ def handlebar(ContextInfo):
     # 根据选股结果进行交易
     execute_trades(ContextInfo, buy_candidates, current_time)
     
+    update_performance(ContextInfo, current_time)
+    
     log_message("策略执行完成\n")
 
+def stop(ContextInfo):
+    """
+    策略结束时执行，提交下单网关中剩余的订单，输出预热、数据请求、持仓刷新和绩效统计
+    """
+    if not ContextInfo.order_gateway.stop(timeout=30):
+        log_message("下单网关仍有未回报订单: ", ContextInfo.order_gateway.pending_count())
+    if ContextInfo.warmup is not None:
+        log_message(ContextInfo.warmup.status())
+    log_message(ContextInfo.data_client.report())
+    log_message(ContextInfo.positions.report())
+    ContextInfo.positions.close()
+    ContextInfo.performance.close()
+    log_message(ContextInfo.performance.report())
+
 def calculate_kdj(high_prices, low_prices, close_prices, N=9, M1=3, M2=3):
     """
     计算KDJ指标
@@ -144,75 +226,52 @@ def calculate_kdj(high_prices, low_prices, close_prices, N=9, M1=3, M2=3):
 def select_kdj_golden_cross_stocks(ContextInfo):
     """
     选择KDJ金叉的股票（周线线级别）
+    扫描整个股票池，全部金叉股票记入列式候选表，按金叉强度(K-D)保留最强的max_holdings只
+    
+    返回:
+    CandidateTable候选表
     """
-    candidates = []
+    crosses = CandidateTable(symbols=ContextInfo.symbols)
     
-    # 获取所有股票
+    # 获取所有股票（数据请求由data_client限速和分批，不再截断股票池）
     stocks = ContextInfo.get_universe()
     
-    # 限制处理股票数量，避免处理时间过长
-    stocks = stocks[:1000] 
+    # 每个交易日构建一次涨跌停价格表，整个股票池通过一次数组比较剔除涨跌停股票
+    symbols = ContextInfo.symbols
+    excluded = SymbolArray(symbols, bool, False)
+    try:
+        limit_table, current_prices = update_limit_price_table(ContextInfo, stocks)
+        limit_mask = limit_table.limit_mask(current_prices)
+        excluded[symbols.intern_many(limit_table.codes)] = limit_mask
+        log_message("涨跌停剔除股票数量: ", int(limit_mask.sum()))
+    except Exception as e:
+        log_message("检查股票涨跌停时出错: ", str(e))
+    stock_ids = symbols.intern_many(stocks)
+    excluded = excluded[stock_ids]
     
-    for stock in stocks:
+    for stock, sid, is_excluded in zip(stocks, stock_ids, excluded):
         try:
-            # 检查股票是否已经涨停，如果涨停则跳过
-            try:
-                # 获取当前价格和昨日收盘价来判断是否涨停
-                current_prices = ContextInfo.get_history_data(1, '1d', 'close')
-                yesterday_prices = ContextInfo.get_history_data(2, '1d', 'close')
-                
-                if (not current_prices) or (not yesterday_prices):
-                    continue
-                    
-                if stock not in current_prices or stock not in yesterday_prices:
-                    continue
-                    
-                if len(current_prices[stock]) < 1 or len(yesterday_prices[stock]) < 2:
-                    continue
-                
-                current_price = current_prices[stock][-1]
-                yesterday_close = yesterday_prices[stock][-2]
-                
-                # 计算涨跌幅
-                if yesterday_close > 0:
-                    price_change_ratio = (current_price - yesterday_close) / yesterday_close
-                    
-                    # 判断是否接近涨停（考虑浮点数精度问题，设置一个略微宽松的阈值）
-                    # A股主板涨停幅度为10%，ST股为5%
-                    # 通过股票名称判断是否为ST股
-                    stock_name = ContextInfo.get_stock_name(stock)
-                    is_st = 'ST' in stock_name if stock_name else False
-                    limit_up_threshold = 0.049 if is_st else 0.099  # 略微宽松的涨停判定阈值
-                    
-                    if price_change_ratio >= limit_up_threshold:
-                        continue
-            except Exception as e:
-                log_message("检查股票是否涨停时出错: ", stock, str(e))
-                # 出错时继续处理，不跳过该股票
-                pass
-            
-            # 获取周线线数据
-            high_prices = ContextInfo.get_history_data(20, '1w', 'high')  # 20天的最高价
-            low_prices = ContextInfo.get_history_data(20, '1w', 'low')    # 20天的最低价
-            close_prices = ContextInfo.get_history_data(20, '1w', 'close') # 20天的收盘价
-            
-            if not all([high_prices, low_prices, close_prices]):
-                log_message("无法获取周线数据")
+            # 涨停或跌停的股票跳过
+            if is_excluded:
                 continue
-                
-            if stock not in high_prices or stock not in low_prices or stock not in close_prices:
+            
+            # 获取周线数据（由内存中的日线合成）
+            weekly = get_weekly_hlc(ContextInfo, stock)
+            if weekly is None:
                 log_message("股票数据缺失")
                 continue
+            high_prices, low_prices, close_prices = weekly
                 
-            if len(high_prices[stock]) < 3 or len(low_prices[stock]) < 3 or len(close_prices[stock]) < 3:
-                log_message("历史日线数据不足")
+            if len(close_prices) < 3:
+                log_message("历史周线数据不足")
                 continue
             
             # 计算KDJ指标
             k_values, d_values, j_values = calculate_kdj(
-                high_prices[stock], 
-                low_prices[stock], 
-                close_prices[stock]
+                high_prices, 
+                low_prices, 
+                close_prices,
+                KDJ_N, KDJ_M1, KDJ_M2
             )
             
             if k_values is None or len(k_values) < 3:
@@ -227,29 +286,215 @@ def select_kdj_golden_cross_stocks(ContextInfo):
             is_golden_cross = (prev_k <= prev_d) and (curr_k > curr_d) and (curr_d < 20)
             
             if is_golden_cross:
-                current_price = close_prices[stock][-1]
-                candidates.append({
-                    'stock': stock,
-                    'price': current_price,
-                    'k': curr_k,
-                    'd': curr_d,
-                    'j': j_values[-1]
-                })
-                log_message("加入候选买入股票: ", stock, "K:", curr_k, "D:", curr_d, "J:", j_values[-1])
-                
-                # 当选出来的股票数量已经达到最大持仓数量时，提前结束选股
-                if len(candidates) >= ContextInfo.max_holdings:
-                    log_message("已选出足够数量的股票，提前结束选股")
-                    break
+                crosses.append(sid, close_prices[-1], curr_k, curr_d, j_values[-1], curr_k - curr_d)
         except Exception as e:
             log_message("处理股票时发生错误: ", stock, str(e))
             import traceback
             traceback.print_exc()
             continue  # 忽略异常股票
     
-    log_message("最终候选买入股票: "+json.dumps(candidates))
+    candidates = crosses.top(ContextInfo.max_holdings)
+    log_message("金叉股票数量: ", len(crosses))
+    log_message("最终候选买入股票: ", candidates.describe())
     return candidates
 
+def update_limit_price_table(ContextInfo, stocks):
+    """
+    获取当日涨跌停价格表及对应的最新价格
+    涨跌停价格表按交易日缓存，股票名称(ST标志)优先使用预热加载的结果
+    
+    返回:
+    (LimitPriceTable, 与价格表股票顺序一致的最新价格数组)
+    """
+    trade_date = formatted_time[:10]
+    daily = load_daily_bars(ContextInfo)
+    if len(daily['dates']) < 2:
+        raise ValueError("日线数据不足")
+    rows = daily['rows'][ContextInfo.symbols.intern_many(stocks)]
+    rows = rows[rows >= 0]
+    codes = [daily['codes'][i] for i in rows]
+    closes = daily['close'][rows]
+    
+    limit_table = getattr(ContextInfo, 'limit_table', None)
+    if limit_table is None or limit_table.trade_date != trade_date or limit_table.codes != codes:
+        names = get_stock_names(ContextInfo, codes)
+        limit_table = LimitPriceTable.build(codes, closes[:, -2], names=names, trade_date=trade_date)
+        ContextInfo.limit_table = limit_table
+        log_message("涨跌停价格表已更新，股票数量: ", len(limit_table), "ST股票数量: ", int(limit_table.st_flags.sum()))
+    
+    return limit_table, closes[:, -1]
+
+def load_daily_bars(ContextInfo):
+    """
+    获取股票池和持仓股票的日线最高/最低/收盘价矩阵，并合成周线
+    每根K线只请求一次，涨跌停判断、选股和卖出判断共用；
+    已有日线矩阵(上一根K线或后台预热的结果)时只补充请求最近DAILY_INCREMENT_BARS根日线
+    
+    返回:
+    {'codes': 股票列表, 'rows': 按股票编号索引的行号数组(无数据为-1), 'dates': 交易日列表,
+     'high'/'low'/'close'/'volume': 日线矩阵, 'weekly': {字段: 周线矩阵}}
+    """
+    daily = getattr(ContextInfo, 'daily_bars', None)
+    if daily is not None and daily['time'] == formatted_time:
+        return daily
+    if daily is None:
+        daily = get_warmup_daily_bars(ContextInfo)
+    
+    stocks = list(ContextInfo.get_universe())
+    stocks += [stock for stock in ContextInfo.holdings if stock not in set(stocks)]
+    end_time = formatted_time[:10].replace('-', '')
+    
+    aligned = None
+    if daily is not None:
+        aligned = update_daily_history(ContextInfo, daily, stocks, end_time)
+    if aligned is None:
+        aligned = fetch_daily_history(ContextInfo, stocks, end_time)
+    codes, dates, matrices = aligned
+    for field in DAILY_FIELDS:
+        matrices.setdefault(field, np.full((len(codes), len(dates)), np.nan))
+    week_labels, weekly = build_weekly_bars(dates, matrices['high'], matrices['low'], matrices['close'],
+                                            volume=matrices['volume'])
+    
+    daily = dict(matrices)
+    daily.update({
+        'time': formatted_time,
+        'codes': codes,
+        'rows': symbol_rows(ContextInfo, codes),
+        'dates': dates,
+        'weekly': weekly,
+    })
+    ContextInfo.daily_bars = daily
+    log_message("日线数据已加载，股票数量: ", len(codes), "交易日数: ", len(dates), "周数: ", len(week_labels))
+    return daily
+
+def fetch_daily_history(ContextInfo, stocks, end_time, progress=None):
+    """
+    分批请求完整的日线历史并对齐为矩阵
+    
+    参数:
+    stocks: 股票列表
+    end_time: 结束日期YYYYMMDD，为空表示最新
+    progress: 进度回调progress(已完成股票数, 总股票数)
+    
+    返回:
+    (股票列表, 交易日列表, {字段: 矩阵})
+    """
+    frames = ContextInfo.data_client.get_market_data_ex(
+        fields=list(DAILY_FIELDS),
+        stock_code=stocks,
+        period='1d',
+        end_time=end_time,
+        count=DAILY_BARS,
+        chunk_size=DAILY_FETCH_BATCH,
+        progress=progress
+    )
+    return align_frames(frames, DAILY_FIELDS)
+
+def update_daily_history(ContextInfo, daily, stocks, end_time):
+    """
+    在已有日线矩阵上补充最近的日线，新增股票单独请求完整历史
+    补充的数据与已有数据衔接不上(中间缺K线)时返回None，由调用方重新完整加载
+    
+    返回:
+    (股票列表, 交易日列表, {字段: 矩阵})或None
+    """
+    if not daily['dates']:
+        return None
+    has_rows = daily['rows'][ContextInfo.symbols.intern_many(stocks)] >= 0
+    known = [stock for stock, known in zip(stocks, has_rows) if known]
+    recent = align_frames(ContextInfo.data_client.get_market_data_ex(
+        fields=list(DAILY_FIELDS),
+        stock_code=known,
+        period='1d',
+        end_time=end_time,
+        count=DAILY_INCREMENT_BARS
+    ), DAILY_FIELDS)
+    if recent[1] and recent[1][0] > daily['dates'][-1]:
+        log_message("补充的日线与已有数据不衔接，重新完整加载")
+        return None
+    
+    base = (daily['codes'], daily['dates'], dict((field, daily[field]) for field in DAILY_FIELDS))
+    # 剔除晚于当前日期的日线，已有矩阵中不会残留当前K线之后的数据
+    merged = merge_aligned(base, recent, max_times=DAILY_BARS, until=end_time)
+    missing = [stock for stock, known in zip(stocks, has_rows) if not known]
+    if missing:
+        merged = merge_aligned(merged, fetch_daily_history(ContextInfo, missing, end_time), max_times=DAILY_BARS,
+                               until=end_time)
+    return merged
+
+def get_warmup_daily_bars(ContextInfo):
+    """
+    获取后台预热加载的日线矩阵，预热未完成时返回None
+    """
+    warmup = getattr(ContextInfo, 'warmup', None)
+    if warmup is None:
+        return None
+    if not warmup.ready:
+        log_message("后台预热未完成，直接加载日线数据，", warmup.status())
+        return None
+    aligned = warmup.result('日线历史')
+    if aligned is None:
+        return None
+    codes, dates, matrices = aligned
+    daily = dict(matrices)
+    daily.update({'time': '', 'codes': codes, 'rows': symbol_rows(ContextInfo, codes), 'dates': dates})
+    log_message("使用后台预热的日线数据，股票数量: ", len(codes), "交易日数: ", len(dates))
+    return daily
+
+def symbol_rows(ContextInfo, codes):
+    """
+    建立股票编号到矩阵行号的索引数组，不在矩阵中的股票为-1
+    """
+    rows = SymbolArray(ContextInfo.symbols, np.int64, -1)
+    rows[ContextInfo.symbols.intern_many(codes)] = np.arange(len(codes))
+    return rows
+
+def get_stock_names(ContextInfo, stocks):
+    """
+    获取股票名称(用于判断ST)，优先使用预热加载的名称，缺失的逐只查询并缓存
+    预热在首次调用之后才完成时，完成后再并入预热结果
+    """
+    names = getattr(ContextInfo, 'stock_names', None)
+    if names is None:
+        names = ContextInfo.stock_names = {}
+    warmup = getattr(ContextInfo, 'warmup', None)
+    if warmup is not None and warmup.ready and not getattr(ContextInfo, 'stock_names_warmed', False):
+        names.update(warmup.result('股票名称') or {})
+        ContextInfo.stock_names_warmed = True
+    for stock in stocks:
+        if stock not in names:
+            names[stock] = ContextInfo.data_client.call(ContextInfo.get_stock_name, stock)
+    return [names[stock] for stock in stocks]
+
+def load_stock_names(ContextInfo, stocks, progress=None):
+    """
+    批量查询股票名称，返回{股票: 名称}
+    """
+    names = {}
+    for i, stock in enumerate(stocks, 1):
+        names[stock] = ContextInfo.data_client.call(ContextInfo.get_stock_name, stock)
+        if progress is not None and (i % DAILY_FETCH_BATCH == 0 or i == len(stocks)):
+            progress(i, len(stocks))
+    return names
+
+def get_weekly_hlc(ContextInfo, stock):
+    """
+    获取单只股票最近WEEKLY_BARS周的周线最高/最低/收盘价，跳过整周停牌的周
+    
+    返回:
+    (high, low, close) 数组元组，无数据时返回None
+    """
+    daily = load_daily_bars(ContextInfo)
+    sid = ContextInfo.symbols.id_of(stock)
+    i = daily['rows'][sid] if sid >= 0 else -1
+    if i < 0:
+        return None
+    weekly = daily['weekly']
+    valid = ~np.isnan(weekly['close'][i])
+    if not valid.any():
+        return None
+    return tuple(weekly[field][i][valid][-WEEKLY_BARS:] for field in ('high', 'low', 'close'))
+
 def execute_trades(ContextInfo, buy_candidates, current_time):
     """
     执行交易操作
@@ -270,25 +515,21 @@ def handle_sell_orders(ContextInfo, current_time):
     log_message("处理卖出订单，当前持仓数量: ", len(ContextInfo.holdings))
     for stock in list(ContextInfo.holdings.keys()):
         try:
-            # 获取日线数据
-            high_prices = ContextInfo.get_history_data(20, '1w', 'high')
-            low_prices = ContextInfo.get_history_data(20, '1w', 'low')
-            close_prices = ContextInfo.get_history_data(20, '1w', 'close')
-            
-            if not all([high_prices, low_prices, close_prices]):
-                continue
-                
-            if stock not in high_prices or stock not in low_prices or stock not in close_prices:
+            # 获取周线数据（由内存中的日线合成）
+            weekly = get_weekly_hlc(ContextInfo, stock)
+            if weekly is None:
                 continue
+            high_prices, low_prices, close_prices = weekly
                 
-            if len(high_prices[stock]) < 3 or len(low_prices[stock]) < 3 or len(close_prices[stock]) < 3:
+            if len(close_prices) < 3:
                 continue
             
             # 计算KDJ指标
             k_values, d_values, j_values = calculate_kdj(
-                high_prices[stock], 
-                low_prices[stock], 
-                close_prices[stock]
+                high_prices, 
+                low_prices, 
+                close_prices,
+                KDJ_N, KDJ_M1, KDJ_M2
             )
             
             if k_values is None or len(k_values) < 3:
@@ -307,11 +548,11 @@ def handle_sell_orders(ContextInfo, current_time):
             
             # 如果满足卖出条件，则卖出
             if is_dead_cross or is_high_j:
-                order_volume = ContextInfo.holdings[stock].available_volume
+                order_volume = ContextInfo.holdings[stock]['available_volume']
                 if order_volume > 0:
-                    # 卖出所有持仓，使用回测标准函数
+                    # 卖出所有持仓，订单进入下单网关队列
                     log_message("卖出原因: 死叉=", is_dead_cross, "J值过高=", is_high_j, "J值=", curr_j)
-                    order_shares(stock, -order_volume, ContextInfo, ContextInfo.accID)
+                    ContextInfo.order_gateway.submit(stock, -order_volume, None, None, 'kdj_sell')
                     del ContextInfo.holdings[stock]
                     log_message("卖出: ", stock)
         except Exception as e:
@@ -319,6 +560,9 @@ def handle_sell_orders(ContextInfo, current_time):
             import traceback
             traceback.print_exc()
             pass
+    
+    # 全部持仓检查完毕后，卖出订单一次性提交
+    flush_orders(ContextInfo)
 
 def handle_buy_orders(ContextInfo, candidates, current_time):
     """
@@ -337,46 +581,59 @@ def handle_buy_orders(ContextInfo, candidates, current_time):
     # 计算可买入的股票数量
     available_slots = ContextInfo.max_holdings - current_holdings
     
-    # 在候选股票中选择符合买入条件的股票
-    for i, candidate in enumerate(candidates):
-        stock = candidate['stock']
-        
-        # 如果该股票已在持仓中，跳过
-        if stock in ContextInfo.holdings:
-            continue
-        
-        # 如果已达到最大持仓数量，停止买入
-        if available_slots <= 0:
-            break
-            
+    # 剔除已持仓的股票，按仓位控制计算每只股票的买入数量（手），取前available_slots只
+    candidates = candidates.exclude(ContextInfo.symbols.intern_many(ContextInfo.holdings.keys()))
+    available_capital = ContextInfo.available_amount * ContextInfo.max_position
+    volumes = candidates.size_positions(available_capital)
+    chosen = np.flatnonzero(volumes > 0)[:available_slots]
+    log_message("计算买入量，可用资金:", available_capital, "可买入股票数量:", len(chosen))
+    
+    prices = candidates.column('price')
+    for stock, i in zip(candidates.take(chosen).codes(), chosen):
         try:
-            # 获取当前价格
-            current_price = candidate['price']
-            
-            # 确保价格有效
-            if current_price <= 0:
-                continue
-                
-            # 计算买入金额（根据仓位控制）
-            available_capital = ContextInfo.available_amount * ContextInfo.max_position
-            
-            # 计算买入数量（手）
-            volume = int(available_capital / (current_price * 100)) * 100
-            
-            log_message("计算买入量，可用资金:", available_capital, "当前价格:", current_price, "计算量:", volume)
-            
-            if volume > 0:
-                # 使用收盘价买入
-                log_message("准备下单买入: ", stock, "数量: ", volume, "价格: ", current_price)
-                order_shares(stock, volume, ContextInfo, ContextInfo.accID)
-                
-                available_slots -= 1
-                log_message("成功买入: ", stock, "数量: ", volume, "价格: ", current_price)
+            # 使用收盘价买入
+            current_price = float(prices[i])
+            volume = int(volumes[i])
+            log_message("准备下单买入: ", stock, "数量: ", volume, "价格: ", current_price)
+            ContextInfo.order_gateway.submit(stock, volume, None, current_price, 'kdj_buy')
+            log_message("买入订单已排队: ", stock, "数量: ", volume, "价格: ", current_price)
         except Exception as e:
             log_message("买入订单处理错误: ", stock, str(e))
             import traceback
             traceback.print_exc()
             pass
+    
+    flush_orders(ContextInfo)
+
+def flush_orders(ContextInfo):
+    """
+    将下单网关中排队的订单一次性提交并等待回报
+    """
+    try:
+        if not ContextInfo.order_gateway.flush(wait=True, timeout=30):
+            log_message("下单网关仍有未回报订单: ", ContextInfo.order_gateway.pending_count())
+    except Exception as e:
+        log_message("提交订单时出错: ", str(e))
+
+def handle_order_result(ContextInfo, order):
+    """
+    下单成功回调（在提交订单的策略线程中执行）
+    """
+    ContextInfo.last_orders[order.stock_code] = order
+    if isinstance(order.result, dict):
+        # 本地回测下单即成交；平台只返回委托结果，成交由update_performance按成交回报记录
+        ContextInfo.performance.record_fill(order.stock_code, order.result.get('volume', order.shares),
+                                            order.result.get('price', order.price))
+    log_message("订单回报: ", order.stock_code, "数量: ", order.shares, "结果: ", order.result,
+                "耗时(ms): ", round((order.latency() or 0) * 1000, 1))
+
+def handle_order_reject(ContextInfo, order):
+    """
+    下单失败回调
+    """
+    ContextInfo.last_orders[order.stock_code] = order
+    ContextInfo.rejected_orders.append(order)
+    log_message("订单被拒: ", order.stock_code, "数量: ", order.shares, "原因: ", order.error)
 
 def init_position_manager(ContextInfo):
     """
@@ -393,67 +650,53 @@ def init_position_manager(ContextInfo):
     
     # 买入标志：判断当日是否可以买入
     ContextInfo.enable_flag = True     # 默认可以买入
+    ContextInfo.enable_flags = {}      # 各账户的买入标志
 
-def update_positions(ContextInfo, account_id):
+def update_positions(ContextInfo, account_id=None):
     """
     更新持仓数据
-    从交易系统获取最新的持仓和资金信息
+    并发刷新全部账户的持仓和资金信息，ContextInfo上的持仓、资金和买入标志取自下单账户
     
     参数:
     ContextInfo: 上下文信息对象
-    account_id: 账户ID
+    account_id: 下单账户ID，默认为ContextInfo.accID
     """
     try:
-        # 获取持仓数据
-        positions = get_trade_detail_data(account_id, 'stock', 'position')
-        # 更新持仓信息
-        ContextInfo.holdings = {}
+        ContextInfo.positions.refresh()
+        state = ContextInfo.positions.account(account_id or ContextInfo.accID)
         
-        for position in positions:
-            stock_code = position.m_strInstrumentID + '.' + position.m_strExchangeID
-            volume = position.m_nVolume
-            price = position.m_dOpenPrice
-            total_amount = position.m_dInstrumentValue
-            available_volume = position.m_nCanUseVolume
-            
-            ContextInfo.holdings[stock_code] = {
-                'volume': volume,
-                'price': price,
-                'available_volume': available_volume,
-                'total_amount': total_amount
-            }
-            
-        # 获取账户资金数据
-        accounts = get_trade_detail_data(account_id, 'stock', 'account')
-        if accounts:
-            account = accounts[0]  # 取第一个账户
-            ContextInfo.total_amount = account.m_dBalance          # 总资产
-            ContextInfo.available_amount = account.m_dAvailable    # 可用资金
-            ContextInfo.stock_amount = account.m_dInstrumentValue  # 持仓总金额
-            
-        # 更新买入标志
-        update_buy_flag(ContextInfo)
+        ContextInfo.holdings = state.holdings
+        ContextInfo.total_amount = state.total_amount          # 总资产
+        ContextInfo.available_amount = state.available_amount  # 可用资金
+        ContextInfo.stock_amount = state.stock_amount          # 持仓总金额
+        
+        # 买入标志：持仓金额低于总金额的80%
+        ContextInfo.enable_flag = state.enable_flag
+        ContextInfo.enable_flags = ContextInfo.positions.enable_flags()
         
         print_position_info(ContextInfo)
     except Exception as e:
         log_message(f"更新持仓数据时出错: {e}")
 
-def update_buy_flag(ContextInfo):
+def update_performance(ContextInfo, bar_time):
     """
-    更新是否可以买入的标志
-    判断逻辑：持仓金额低于总金额的80%
+    以下单账户总资产和基准最新收盘价更新绩效统计，平台成交回报中新增的成交计入胜率和换手率
     """
     try:
-        if ContextInfo.total_amount <= 0:
-            ContextInfo.enable_flag = False
-        else:
-            # 计算持仓金额占总金额的比例
-            ratio = ContextInfo.stock_amount / ContextInfo.total_amount
-            # 如果比例低于80%，则可以继续买入
-            ContextInfo.enable_flag = (ratio < 0.8)
+        deals = get_trade_detail_data(ContextInfo.accID, 'stock', 'deal')
+        ContextInfo.performance.record_deals(deals, ContextInfo.symbols.position_code)
+        accounts = get_trade_detail_data(ContextInfo.accID, 'stock', 'account')
+        if not accounts:
+            return
+        benchmark = getattr(ContextInfo, 'benchmark', None)
+        benchmark_price = None
+        if benchmark:
+            data = ContextInfo.get_market_data_ex(['close'], [benchmark], count=1).get(benchmark)
+            if data is not None and len(data) > 0:
+                benchmark_price = float(data['close'].iloc[-1])
+        ContextInfo.performance.update(bar_time, accounts[0].m_dBalance, benchmark_price)
     except Exception as e:
-        log_message("更新买入标志时出错: ", str(e))
-        ContextInfo.enable_flag = False
+        log_message("更新绩效统计时出错: ", str(e))
 
 def print_position_info(ContextInfo):
     """
@@ -478,6 +721,11 @@ def print_position_info(ContextInfo):
     message_lines.append("可用资金: {:.2f}".format(ContextInfo.available_amount))
     message_lines.append("持仓总金额: {:.2f}".format(ContextInfo.stock_amount))
     message_lines.append("是否可以买入: {}".format(ContextInfo.enable_flag))
+    if len(ContextInfo.account_ids) > 1:
+        message_lines.append("\n各账户:")
+        for account_id in ContextInfo.account_ids:
+            message_lines.append(ContextInfo.positions.account(account_id).describe())
+        message_lines.append(ContextInfo.positions.aggregate().describe())
     message_lines.append("=" * 50)
     
     # 使用统一的打印方法打印完整消息
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+下单网关模块
+将下单请求放入队列，由独立工作线程按批次提交，并通过回调返回成交/拒单结果；
+平台下单接口只能在策略线程调用时不启动工作线程，由flush()在调用线程中提交
+"""
+
+import itertools
+import queue
+import threading
+import time
+
+
+class OrderRequest(object):
+    """
+    单笔订单请求
+    记录下单参数、提交/回报时间戳以及平台返回结果
+    """
+
+    __slots__ = ('order_id', 'stock_code', 'shares', 'order_type', 'price',
+                 'strategy_name', 'reason', 'create_time', 'submit_time',
+                 'ack_time', 'status', 'result', 'error')
+
+    def __init__(self, order_id, stock_code, shares, order_type, price, strategy_name, reason=None):
+        self.order_id = order_id
+        self.stock_code = stock_code
+        self.shares = shares
+        self.order_type = order_type
+        self.price = price
+        self.strategy_name = strategy_name
+        self.reason = reason if reason is not None else strategy_name
+        self.create_time = time.time()  # 进入队列时间
+        self.submit_time = 0.0          # 提交给平台时间
+        self.ack_time = 0.0             # 平台返回时间
+        self.status = 'queued'          # queued / submitted / accepted / rejected
+        self.result = None
+        self.error = None
+
+    def latency(self):
+        """
+        从提交到平台返回的耗时(秒)
+        """
+        if self.ack_time and self.submit_time:
+            return self.ack_time - self.submit_time
+        return None
+
+    def __repr__(self):
+        return "OrderRequest(id={}, {}, {}股, 价格: {}, 状态: {})".format(
+            self.order_id, self.stock_code, self.shares, self.price, self.status)
+
+
+class OrderGateway(object):
+    """
+    批量下单网关，background为True时非阻塞
+
+    参数:
+    submit_func: 实际下单函数，接收OrderRequest并返回平台结果（通常封装order_shares）
+    on_submit: 订单进入队列前在调用submit()的线程中执行的回调，参数为OrderRequest，
+               先于该订单的on_result/on_reject执行（如记录下单意图）
+    on_result: 订单被平台接受后的回调，参数为OrderRequest
+    on_reject: 订单被拒绝或下单异常时的回调，参数为OrderRequest
+    batch_size: 单批次最多提交的订单数
+    flush_interval: 自动提交间隔(秒)，为None时只在flush()或队列满一批时提交
+    background: 为True时由工作线程提交订单并执行回调；为False时不启动工作线程，
+                订单只在flush()/stop()时由调用线程提交，回调也在调用线程中执行
+    """
+
+    def __init__(self, submit_func, on_result=None, on_reject=None, batch_size=50, flush_interval=None,
+                 on_submit=None, background=True):
+        self.submit_func = submit_func
+        self.background = background
+        self.on_submit = on_submit
+        self.on_result = on_result
+        self.on_reject = on_reject
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._wakeup = threading.Event()
+        self._idle = threading.Condition()
+        self._unfinished = 0
+        self._running = False
+        self._worker = None
+
+        # 统计信息
+        self.submitted_count = 0
+        self.rejected_count = 0
+        self.batch_count = 0
+
+    def start(self):
+        """
+        启动下单工作线程
+        """
+        if self._running:
+            return
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name='OrderGatewayWorker')
+        self._worker.daemon = True
+        self._worker.start()
+
+    def stop(self, timeout=None):
+        """
+        提交队列中剩余订单后停止工作线程
+        :return: 停止时全部订单是否已得到回报
+        """
+        if not self._running:
+            self._submit_pending()
+            return self._unfinished == 0
+        self.flush(wait=True, timeout=timeout)
+        self._running = False
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        self._worker = None
+        return self._unfinished == 0
+
+    def submit(self, stock_code, shares, order_type, price, strategy_name, reason=None):
+        """
+        将订单放入队列，立即返回OrderRequest，不等待平台结果
+        """
+        if self.background and not self._running:
+            self.start()
+        order = OrderRequest(next(self._ids), stock_code, shares, order_type, price, strategy_name, reason)
+        self._callback(self.on_submit, order)
+        with self._idle:
+            self._unfinished += 1
+        self._queue.put(order)
+        if self.background and self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+        return order
+
+    def flush(self, wait=True, timeout=None):
+        """
+        通知工作线程立即提交队列中的全部订单，没有工作线程时在调用线程中提交
+
+        参数:
+        wait: 是否等待全部订单得到平台回报
+        timeout: 最长等待时间(秒)
+        :return: 等待结束时队列是否已清空
+        """
+        if not self._running:
+            self._submit_pending()
+            return self._unfinished == 0
+        self._wakeup.set()
+        if not wait:
+            return False
+        deadline = None if timeout is None else time.time() + timeout
+        with self._idle:
+            while self._unfinished > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+            return self._unfinished == 0
+
+    def pending_count(self):
+        """
+        尚未得到回报的订单数量
+        """
+        return self._unfinished
+
+    def _run(self):
+        while self._running or not self._queue.empty():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._submit_pending()
+
+    def _submit_pending(self):
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._submit_batch(batch)
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _submit_batch(self, batch):
+        self.batch_count += 1
+        for order in batch:
+            order.submit_time = time.time()
+            order.status = 'submitted'
+            try:
+                order.result = self.submit_func(order)
+                order.ack_time = time.time()
+                if isinstance(order.result, dict) and order.result.get('success') is False:
+                    order.error = order.result.get('error')
+                    self._reject(order)
+                else:
+                    order.status = 'accepted'
+                    self.submitted_count += 1
+                    self._callback(self.on_result, order)
+            except Exception as e:
+                order.ack_time = time.time()
+                order.error = str(e)
+                self._reject(order)
+            finally:
+                with self._idle:
+                    self._unfinished -= 1
+                    if self._unfinished == 0:
+                        self._idle.notify_all()
+
+    def _reject(self, order):
+        order.status = 'rejected'
+        self.rejected_count += 1
+        self._callback(self.on_reject, order)
+
+    def _callback(self, func, order):
+        if func is None:
+            return
+        try:
+            func(order)
+        except Exception as e:
+            print("下单回调异常: {}, 订单: {}".format(str(e), order))
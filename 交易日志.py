@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+交易日志模块
+每笔订单的下单意图(股票、数量、价格、下单类型、原因)和平台回报(受理数量/价格、耗时、拒单原因)
+以固定结构的二进制记录追加写入按交易日分区的日志文件；记录先进入内存缓冲，由后台线程定期批量写盘，
+下单路径上只有一次加锁追加；读取时按日期选择文件，按股票、原因、事件类型向量化筛选
+
+日志文件: {目录}/{YYYYMMDD}.journal，16字节文件头(魔数、版本、记录长度) + 若干条JOURNAL_DTYPE记录
+"""
+
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+JOURNAL_MAGIC = b'TRADEJNL'
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = struct.Struct('<8sII')
+
+EVENT_INTENT = 0        # 下单意图(进入下单网关)
+EVENT_ACCEPTED = 1      # 平台接受
+EVENT_REJECTED = 2      # 平台拒绝或下单异常
+EVENT_NAMES = {EVENT_INTENT: 'intent', EVENT_ACCEPTED: 'accepted', EVENT_REJECTED: 'rejected'}
+
+JOURNAL_DTYPE = np.dtype([
+    ('session', '<i8'),         # 写入进程的启动时间(毫秒)，与order_id一起唯一标识订单
+    ('order_id', '<i8'),
+    ('event', 'u1'),
+    ('bar_time', '<i8'),        # 下单时的K线毫秒时间戳，日志按其交易日分区
+    ('wall_time', '<f8'),       # 事件发生的系统时间(秒)
+    ('stock', 'S16'),
+    ('reason', 'S24'),          # 下单原因，如drawdown_stop、hard_stop_loss、t_trade、risk_avoidance
+    ('order_type', 'S12'),
+    ('shares', '<i8'),
+    ('price', '<f8'),
+    ('accepted_volume', '<i8'),  # 受理时的数量和价格：本地回测为成交值，平台为委托值(市价单价格为0)，
+    ('accepted_price', '<f8'),   # 实际成交以平台成交回报(DEAL)为准
+    ('latency_ms', '<f4'),
+    ('error', 'S64'),           # utf-8编码，超长截断
+])
+
+TEXT_FIELDS = ('stock', 'reason', 'order_type', 'error')
+
+
+def encode_text(text, size):
+    """
+    文本编码为定长字段的utf-8字节串
+    """
+    return ('' if text is None else str(text)).encode('utf-8')[:size]
+
+
+def trade_date_of(timetag):
+    """
+    毫秒时间戳对应的交易日(YYYYMMDD)
+    """
+    return time.strftime('%Y%m%d', time.localtime(timetag / 1000))
+
+
+class TradeJournal(object):
+    """
+    交易日志写入
+    :param directory: 日志目录
+    :param clock: 返回当前K线毫秒时间戳的函数
+    :param flush_interval: 后台线程写盘间隔(秒)
+    :param buffer_size: 缓冲记录数达到该值时立即写盘
+    """
+
+    def __init__(self, directory, clock, flush_interval=1.0, buffer_size=1000, logger=print):
+        self.directory = directory
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.logger = logger
+        self.session = int(time.time() * 1000)
+        self._buffer = []
+        self._bar_times = {}        # {order_id: 下单时的K线时间}，回报记录沿用下单意图的分区
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._worker = None
+        self.written_count = 0
+        self.error_count = 0
+
+    def start(self):
+        if self._running:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name='TradeJournalWriter')
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _append(self, row):
+        with self._lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.buffer_size
+        if not self._running:
+            self.start()
+        if full:
+            self._wakeup.set()
+
+    def record_intent(self, order):
+        """
+        记录下单意图(OrderRequest进入下单网关时)
+        """
+        bar_time = int(self.clock())
+        with self._lock:
+            self._bar_times[order.order_id] = bar_time
+        self._append((self.session, order.order_id, EVENT_INTENT, bar_time, order.create_time,
+                      encode_text(order.stock_code, 16), encode_text(order.reason, 24),
+                      encode_text(order.order_type, 12), int(order.shares), float(order.price or 0.0),
+                      0, 0.0, 0.0, b''))
+
+    def record_result(self, order):
+        """
+        记录平台回报(在下单网关回调中调用)
+        受理数量和价格：本地回测返回成交数量和价格，平台下单接口只返回委托结果，按委托数量和价格记录
+        """
+        with self._lock:
+            bar_time = self._bar_times.pop(order.order_id, None)
+        if bar_time is None:
+            bar_time = int(self.clock())
+        accepted = order.status == 'accepted'
+        result = order.result if isinstance(order.result, dict) else {}
+        accepted_volume = int(result.get('volume', order.shares)) if accepted else 0
+        accepted_price = float(result.get('price', order.price) or 0.0) if accepted else 0.0
+        self._append((self.session, order.order_id, EVENT_ACCEPTED if accepted else EVENT_REJECTED, bar_time,
+                      order.ack_time or time.time(), encode_text(order.stock_code, 16),
+                      encode_text(order.reason, 24), encode_text(order.order_type, 12), int(order.shares),
+                      float(order.price or 0.0), accepted_volume, accepted_price, (order.latency() or 0.0) * 1000,
+                      encode_text(order.error, 64)))
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        缓冲记录按交易日写入日志文件
+        :return: 本次写入的记录数
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        with self._write_lock:
+            records = np.array(rows, dtype=JOURNAL_DTYPE)
+            dates = np.array([trade_date_of(bar_time) for bar_time in records['bar_time']])
+            for date in np.unique(dates):
+                try:
+                    self._write(date, records[dates == date])
+                except Exception as e:
+                    self.error_count += 1
+                    self.logger("交易日志写入失败: {}".format(str(e)))
+            self.written_count += len(records)
+        return len(records)
+
+    def _write(self, date, records):
+        path = os.path.join(self.directory, date + '.journal')
+        with open(path, 'ab') as f:
+            size = f.tell()
+            if size < JOURNAL_HEADER.size:
+                f.truncate(0)
+                f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, JOURNAL_DTYPE.itemsize))
+            elif (size - JOURNAL_HEADER.size) % JOURNAL_DTYPE.itemsize:
+                # 截掉异常退出时写了一半的记录
+                f.truncate(size - (size - JOURNAL_HEADER.size) % JOURNAL_DTYPE.itemsize)
+            f.write(records.tobytes())
+
+    def close(self):
+        """
+        停止后台线程并写入剩余记录
+        """
+        if self._running:
+            self._running = False
+            self._wakeup.set()
+            if self._worker is not None:
+                self._worker.join()
+            self._worker = None
+        self.flush()
+
+    def report(self):
+        return "交易日志: 写入{}条记录, 写入失败{}次, 目录: {}".format(
+            self.written_count, self.error_count, self.directory)
+
+
+class TradeJournalReader(object):
+    """
+    交易日志读取
+    :param directory: 日志目录
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def dates(self):
+        """
+        有日志的交易日列表
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-8] for name in os.listdir(self.directory) if name.endswith('.journal'))
+
+    def _load(self, date):
+        path = os.path.join(self.directory, date + '.journal')
+        with open(path, 'rb') as f:
+            header = f.read(JOURNAL_HEADER.size)
+        if len(header) < JOURNAL_HEADER.size:
+            return np.zeros(0, dtype=JOURNAL_DTYPE)
+        magic, version, itemsize = JOURNAL_HEADER.unpack(header)
+        if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION or itemsize != JOURNAL_DTYPE.itemsize:
+            raise ValueError("交易日志格式不兼容: {}".format(path))
+        count = (os.path.getsize(path) - JOURNAL_HEADER.size) // itemsize
+        if count == 0:
+            return np.zeros(0, dtype=JOURNAL_DTYPE)
+        return np.memmap(path, dtype=JOURNAL_DTYPE, mode='r', offset=JOURNAL_HEADER.size, shape=(count,))
+
+    def read(self, start_date=None, end_date=None, stock=None, reason=None, event=None):
+        """
+        读取日期区间内的记录
+        :param start_date/end_date: YYYYMMDD，包含两端，None表示不限
+        :param stock: 股票代码或代码列表
+        :param reason: 下单原因或原因列表
+        :param event: EVENT_INTENT/EVENT_ACCEPTED/EVENT_REJECTED
+        :return: JOURNAL_DTYPE结构化数组
+        """
+        stocks = None if stock is None else [encode_text(code, 16) for code in np.atleast_1d(stock)]
+        reasons = None if reason is None else [encode_text(name, 24) for name in np.atleast_1d(reason)]
+        parts = []
+        for date in self.dates():
+            if (start_date and date < str(start_date)) or (end_date and date > str(end_date)):
+                continue
+            records = self._load(date)
+            mask = np.ones(len(records), dtype=bool)
+            if stocks is not None:
+                mask &= np.isin(records['stock'], stocks)
+            if reasons is not None:
+                mask &= np.isin(records['reason'], reasons)
+            if event is not None:
+                mask &= records['event'] == event
+            parts.append(np.array(records[mask]))
+        if not parts:
+            return np.zeros(0, dtype=JOURNAL_DTYPE)
+        return np.concatenate(parts)
+
+    def read_frame(self, *args, **kwargs):
+        """
+        与read参数一致，返回DataFrame，文本字段解码为str，事件类型转换为名称
+        """
+        records = self.read(*args, **kwargs)
+        frame = pd.DataFrame(dict((name, records[name]) for name in JOURNAL_DTYPE.names))
+        for name in TEXT_FIELDS:
+            frame[name] = [value.decode('utf-8', 'ignore') for value in records[name]]
+        frame['event'] = frame['event'].map(EVENT_NAMES)
+        return frame
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+交易日缓存模块
+日线级别的计算结果按交易日缓存，同一交易日内的分钟K线直接复用；
+支持显式失效，以及可选的盘中刷新间隔（按K线时间计算，回测与实盘一致）
+"""
+
+import threading
+
+
+class TradingDayMemo(object):
+    """
+    按交易日缓存计算结果
+    每个键只保留最近一个交易日的结果，交易日变化或超过刷新间隔时重新计算
+    """
+
+    def __init__(self, refresh_interval=None):
+        """
+        :param refresh_interval: 默认盘中刷新间隔(秒)，None表示当日只计算一次
+        """
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._entries = {}      # {键: (交易日, 计算时间, 结果)}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, trade_date, compute, now=None, refresh_interval=None, cache_if=None):
+        """
+        获取缓存结果，缓存不可用时调用compute()计算并缓存
+        :param key: 缓存键
+        :param trade_date: 交易日，如'2024-06-03'
+        :param compute: 计算函数，无参数
+        :param now: 当前K线时间(秒)，用于盘中刷新判断
+        :param refresh_interval: 本键的盘中刷新间隔(秒)，默认使用构造时的设置
+        :param cache_if: cache_if(结果)返回False时不缓存（如计算失败返回的空结果）
+        :return: 计算结果
+        """
+        if refresh_interval is None:
+            refresh_interval = self.refresh_interval
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == trade_date:
+                stale = (refresh_interval is not None and now is not None and entry[1] is not None
+                         and now - entry[1] >= refresh_interval)
+                if not stale:
+                    self.hits += 1
+                    return entry[2]
+            self.misses += 1
+
+        # 计算在锁外进行，不同的键可以并发计算
+        value = compute()
+        if cache_if is None or cache_if(value):
+            with self._lock:
+                self._entries[key] = (trade_date, now, value)
+        return value
+
+    def peek(self, key, trade_date=None):
+        """
+        读取缓存结果而不触发计算，不存在(或不是该交易日)时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or (trade_date is not None and entry[0] != trade_date):
+            return None
+        return entry[2]
+
+    def export_entries(self):
+        """
+        导出缓存内容{键: [交易日, 计算时间, 结果]}，用于写入快照
+        """
+        with self._lock:
+            return dict((key, list(entry)) for key, entry in self._entries.items())
+
+    def load_entries(self, entries):
+        """
+        从快照恢复缓存内容，过期的交易日在下次访问时自然失效
+        """
+        with self._lock:
+            for key, entry in entries.items():
+                self._entries[key] = tuple(entry)
+
+    def invalidate(self, key=None):
+        """
+        使某个键或全部缓存失效，下次访问时重新计算
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def report(self):
+        """
+        缓存命中统计文本
+        """
+        total = self.hits + self.misses
+        return "交易日缓存: 命中{}次, 计算{}次, 命中率{:.1%}".format(
+            self.hits, self.misses, self.hits / total if total else 0.0)
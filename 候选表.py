@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+候选表模块
+选股候选以numpy结构化数组按列存放(股票编号、价格、指标值、得分)，
+过滤、排序、选取和仓位计算均为整列运算，只在需要输出时才转换为代码字符串或文本
+"""
+
+import json
+
+import numpy as np
+
+from 排序选取 import top_k_indices
+
+CANDIDATE_DTYPE = np.dtype([
+    ('sid', np.int64),      # 股票编号(证券代码表)
+    ('price', np.float64),  # 参考价格
+    ('k', np.float64),
+    ('d', np.float64),
+    ('j', np.float64),
+    ('score', np.float64),  # 排序得分
+])
+
+
+class CandidateTable(object):
+    """
+    列式候选表
+    :param symbols: 证券代码表(SymbolTable)
+    :param records: CANDIDATE_DTYPE结构化数组，为None时创建空表
+    """
+
+    def __init__(self, symbols, records=None, capacity=64):
+        self.symbols = symbols
+        if records is None:
+            self._buffer = np.zeros(capacity, dtype=CANDIDATE_DTYPE)
+            self._size = 0
+        else:
+            self._buffer = np.asarray(records, dtype=CANDIDATE_DTYPE)
+            self._size = len(self._buffer)
+
+    @classmethod
+    def from_columns(cls, symbols, sid, price, k, d, j, score):
+        """
+        由各列数组构建候选表
+        """
+        records = np.zeros(len(sid), dtype=CANDIDATE_DTYPE)
+        records['sid'] = sid
+        records['price'] = price
+        records['k'] = k
+        records['d'] = d
+        records['j'] = j
+        records['score'] = score
+        return cls(symbols, records)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def records(self):
+        """
+        已填充部分的结构化数组视图
+        """
+        return self._buffer[:self._size]
+
+    def append(self, sid, price, k, d, j, score):
+        """
+        追加一条候选，容量不足时按倍数扩容
+        """
+        if self._size == len(self._buffer):
+            grown = np.zeros(max(2 * len(self._buffer), 16), dtype=CANDIDATE_DTYPE)
+            grown[:self._size] = self._buffer[:self._size]
+            self._buffer = grown
+        self._buffer[self._size] = (sid, price, k, d, j, score)
+        self._size += 1
+
+    def column(self, name):
+        return self.records[name]
+
+    def codes(self):
+        """
+        候选股票代码列表
+        """
+        return self.symbols.codes(self.records['sid'])
+
+    def take(self, indices):
+        """
+        按下标或布尔掩码选取，返回新表
+        """
+        return CandidateTable(self.symbols, self.records[indices])
+
+    def filter(self, mask):
+        return self.take(np.asarray(mask, dtype=bool))
+
+    def exclude(self, sids):
+        """
+        剔除指定股票编号
+        """
+        return self.filter(~np.isin(self.records['sid'], np.asarray(list(sids), dtype=np.int64)))
+
+    def sort(self, by='score', descending=True):
+        """
+        按某列排序，值相同时保持原顺序
+        """
+        values = self.records[by]
+        order = np.lexsort((np.arange(len(values)), -values if descending else values))
+        return self.take(order)
+
+    def top(self, k, by='score'):
+        """
+        选出某列最高的k条，按该列降序，值相同时原顺序靠前者优先
+        """
+        return self.take(top_k_indices(self.records[by], k))
+
+    def size_positions(self, capital, lot=100):
+        """
+        按每只股票可用资金计算买入数量(整手)，价格无效的为0
+        """
+        price = self.records['price']
+        volume = np.zeros(len(price), dtype=np.int64)
+        valid = price > 0
+        volume[valid] = (capital / (price[valid] * lot)).astype(np.int64) * lot
+        return volume
+
+    def to_records(self):
+        """
+        转换为字典列表（仅用于输出）
+        """
+        fields = [name for name in CANDIDATE_DTYPE.names if name != 'sid']
+        return [dict([('stock', code)] + [(name, float(row[name])) for name in fields])
+                for code, row in zip(self.codes(), self.records)]
+
+    def to_json(self):
+        return json.dumps(self.to_records(), ensure_ascii=False)
+
+    def describe(self, limit=10):
+        """
+        简要文本，最多列出limit条
+        """
+        rows = ["{} 价格:{:.2f} K:{:.2f} D:{:.2f} J:{:.2f}".format(
+            code, row['price'], row['k'], row['d'], row['j'])
+            for code, row in zip(self.symbols.codes(self.records['sid'][:limit]), self.records[:limit])]
+        if len(self) > limit:
+            rows.append("...共{}只".format(len(self)))
+        return "; ".join(rows) if rows else "无"
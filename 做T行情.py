@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+做T行情模块
+只订阅当前持仓股票的实时行情，每收到一笔行情即更新该股票的盘中状态(最新价、当前K线、RSI)并回调做T规则，
+单笔行情的处理为O(1)，不再每根K线轮询盘中K线；
+本地回测没有实时行情，由ReplayQuoteSource把历史K线回放为逐笔行情作为替代
+"""
+
+import datetime
+import time
+
+import numpy as np
+
+from K线合成 import bar_end_label
+
+
+def quote_time_str(value):
+    """
+    行情时间统一转换为YYYYMMDDHHMMSS
+    :param value: 毫秒时间戳或时间字符串
+    """
+    if isinstance(value, (int, float, np.integer, np.floating)) and value > 1e11:
+        return datetime.datetime.fromtimestamp(value / 1000).strftime('%Y%m%d%H%M%S')
+    text = ''.join(ch for ch in str(value) if ch.isdigit())
+    return (text + '000000')[:14]
+
+
+class IncrementalRSI(object):
+    """
+    增量RSI(Wilder平滑)
+    update输入已完成K线的收盘价，peek以最新价作为正在形成的K线收盘价计算RSI，均为O(1)；
+    结果与对同一收盘价序列调用calculate_rsi一致
+    """
+
+    def __init__(self, period=14):
+        self.period = period
+        self._closes = []       # 平滑均值初始化之前的收盘价
+        self._last = None
+        self._avg_gain = None
+        self._avg_loss = None
+
+    @staticmethod
+    def _seed(closes):
+        delta = np.diff(closes)
+        return np.mean(np.maximum(delta, 0)), np.mean(np.maximum(-delta, 0))
+
+    def update(self, close):
+        """
+        计入一根已完成K线的收盘价
+        """
+        if self._avg_gain is None:
+            self._closes.append(close)
+            if len(self._closes) > self.period:
+                self._avg_gain, self._avg_loss = self._seed(self._closes)
+                self._closes = []
+        else:
+            delta = close - self._last
+            self._avg_gain = (self._avg_gain * (self.period - 1) + max(delta, 0)) / self.period
+            self._avg_loss = (self._avg_loss * (self.period - 1) + max(-delta, 0)) / self.period
+        self._last = close
+
+    def peek(self, price):
+        """
+        以price作为当前K线收盘价的RSI，K线数不足period时返回None
+        """
+        if self._avg_gain is None:
+            closes = self._closes + [price]
+            if len(closes) < self.period:
+                return None
+            avg_gain, avg_loss = self._seed(closes)
+        else:
+            delta = price - self._last
+            avg_gain = (self._avg_gain * (self.period - 1) + max(delta, 0)) / self.period
+            avg_loss = (self._avg_loss * (self.period - 1) + max(-delta, 0)) / self.period
+        if avg_loss == 0:
+            return 100
+        return 100 - (100 / (1 + avg_gain / avg_loss))
+
+
+class QuoteState(object):
+    """
+    单只股票的盘中行情状态
+    """
+
+    def __init__(self, stock, rsi_period=14):
+        self.stock = stock
+        self.rsi = IncrementalRSI(rsi_period)
+        self.bar_label = None       # 当前K线的结束时间标签
+        self.seeded_label = None    # 初始化时已计入的最后一根K线标签
+        self.last_time = None
+        self.last_price = None
+        self.quotes = 0
+
+    def seed(self, closes, last_label=None):
+        """
+        用已完成K线的收盘价初始化RSI
+        :param last_label: 最后一根已完成K线的时间标签，早于或等于它的行情视为已计入
+        """
+        for close in closes:
+            self.rsi.update(float(close))
+        self.seeded_label = last_label
+
+    def update(self, time_str, price, period):
+        """
+        输入一笔行情，新K线开始时把上一根K线的收盘价计入RSI
+        :return: 是否为有效的新行情
+        """
+        if self.last_time is not None and time_str < self.last_time:
+            return False
+        label = bar_end_label(time_str, period)
+        if self.seeded_label is not None and label <= self.seeded_label:
+            return False
+        if self.bar_label is not None and label != self.bar_label and self.last_price is not None:
+            self.rsi.update(self.last_price)
+        self.bar_label = label
+        self.last_time = time_str
+        self.last_price = price
+        self.quotes += 1
+        return True
+
+
+class HoldingQuoteFeed(object):
+    """
+    持仓行情订阅
+    sync按当前持仓增减订阅，收到行情后更新QuoteState并调用on_quote(stock, price, rsi, bar_label)
+    :param source: 行情源，需提供subscribe_quote(stock, period, callback)和unsubscribe_quote(订阅号)，
+                   平台ContextInfo或ReplayQuoteSource
+    :param on_quote: 做T规则回调，bar_label为行情所在K线的结束时间标签，用于限制每根K线的交易次数
+    :param period: RSI使用的K线周期
+    :param seed: seed(stock)返回(已完成K线收盘价列表, 最后一根K线时间标签)，新订阅时调用一次
+    """
+
+    def __init__(self, source, on_quote, period='15m', rsi_period=14, seed=None, logger=print):
+        self.source = source
+        self.on_quote = on_quote
+        self.period = period
+        self.rsi_period = rsi_period
+        self.seed = seed
+        self.logger = logger
+        self.states = {}
+        self._subscriptions = {}    # {股票: 订阅号}
+        self.quote_count = 0
+        self.ignored_count = 0
+        self.error_count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.max_delay = 0.0        # 行情时间到处理完成的最大延迟(秒)，仅实时行情有意义
+
+    @property
+    def stocks(self):
+        return sorted(self._subscriptions)
+
+    def sync(self, stocks):
+        """
+        订阅新增持仓、退订已清仓股票
+        :return: (新增列表, 移除列表)
+        """
+        stocks = set(stocks)
+        added = sorted(stocks - set(self._subscriptions))
+        removed = sorted(set(self._subscriptions) - stocks)
+        for stock in removed:
+            self.unsubscribe(stock)
+        for stock in added:
+            state = QuoteState(stock, self.rsi_period)
+            if self.seed is not None:
+                try:
+                    closes, last_label = self.seed(stock)
+                    state.seed(closes, last_label)
+                except Exception as e:
+                    self.logger("做T行情{}初始化K线失败: {}".format(stock, str(e)))
+            self.states[stock] = state
+            self._subscriptions[stock] = self.source.subscribe_quote(
+                stock, period='tick', callback=self.on_data)
+        if added or removed:
+            self.logger("做T行情订阅: 新增{}, 退订{}, 当前{}只".format(added, removed, len(self._subscriptions)))
+        return added, removed
+
+    def unsubscribe(self, stock):
+        sub_id = self._subscriptions.pop(stock, None)
+        self.states.pop(stock, None)
+        if sub_id is not None:
+            try:
+                self.source.unsubscribe_quote(sub_id)
+            except Exception as e:
+                self.logger("退订{}行情失败: {}".format(stock, str(e)))
+
+    def close(self):
+        """
+        退订全部行情
+        """
+        for stock in list(self._subscriptions):
+            self.unsubscribe(stock)
+
+    def on_data(self, data):
+        """
+        行情回调：data为{股票: {'lastPrice': 最新价, 'time': 行情时间, ...}}
+        """
+        for stock, tick in data.items():
+            if stock not in self.states or not tick:
+                continue
+            price = tick.get('lastPrice')
+            if price is None or not price > 0:
+                continue
+            self.handle(stock, tick.get('time', tick.get('timetag', '')), float(price))
+
+    def handle(self, stock, quote_time, price):
+        """
+        处理一笔行情
+        """
+        start = time.time()
+        state = self.states.get(stock)
+        time_str = quote_time_str(quote_time)
+        if state is None or not state.update(time_str, price, self.period):
+            self.ignored_count += 1
+            return
+        try:
+            self.on_quote(stock, price, state.rsi.peek(price), state.bar_label)
+        except Exception as e:
+            self.error_count += 1
+            self.logger("做T行情{}处理异常: {}".format(stock, str(e)))
+        end = time.time()
+        self.quote_count += 1
+        self.total_seconds += end - start
+        self.max_seconds = max(self.max_seconds, end - start)
+        if isinstance(quote_time, (int, float)) and quote_time > 1e11:
+            self.max_delay = max(self.max_delay, end - quote_time / 1000.0)
+
+    def report(self):
+        """
+        行情处理统计文本
+        """
+        average = self.total_seconds / self.quote_count * 1000 if self.quote_count else 0.0
+        text = "做T行情: 订阅{}只, 处理{}笔, 忽略{}笔, 异常{}笔, 平均耗时{:.3f}ms, 最大耗时{:.3f}ms".format(
+            len(self._subscriptions), self.quote_count, self.ignored_count, self.error_count,
+            average, self.max_seconds * 1000)
+        if self.max_delay:
+            text += ", 最大延迟{:.1f}ms".format(self.max_delay * 1000)
+        return text
+
+
+class ReplayQuoteSource(object):
+    """
+    本地回放行情源：接口与平台subscribe_quote/unsubscribe_quote一致，
+    replay把订阅股票截至某时间的新K线按开盘、最高/最低、收盘顺序拆成逐笔行情推送给回调
+    :param context: 提供get_market_data_ex的上下文
+    :param period: 回放使用的K线周期
+    """
+
+    def __init__(self, context, period='5m'):
+        self.context = context
+        self.period = period
+        self._next_id = 1
+        self._callbacks = {}        # {订阅号: (股票, 回调)}
+        self._last_time = {}        # {股票: 已回放的最后一根K线时间}
+
+    def subscribe_quote(self, stock_code, period='tick', dividend_type='none', result_type='', callback=None):
+        sub_id = self._next_id
+        self._next_id += 1
+        self._callbacks[sub_id] = (stock_code, callback)
+        return sub_id
+
+    def unsubscribe_quote(self, sub_id):
+        self._callbacks.pop(sub_id, None)
+
+    def replay(self, start_time, end_time):
+        """
+        推送各订阅股票在(已回放时间, end_time]内的K线
+        :param start_time: 首次回放的起始时间(YYYYMMDD)
+        :return: 推送的行情笔数
+        """
+        stocks = sorted(set(stock for stock, _ in self._callbacks.values()))
+        if not stocks:
+            return 0
+        data = self.context.get_market_data_ex(
+            fields=['open', 'high', 'low', 'close'], stock_code=stocks, period=self.period,
+            start_time=min(self._last_time.get(stock, start_time) for stock in stocks)[:8],
+            end_time=end_time, count=-1)
+        count = 0
+        for stock in stocks:
+            df = data.get(stock) if data else None
+            if df is None or df.empty:
+                continue
+            last = self._last_time.get(stock)
+            for bar_time, row in zip(df.index.astype(str), df[['open', 'high', 'low', 'close']].values):
+                bar_time = quote_time_str(bar_time)
+                if last is not None and bar_time <= last:
+                    continue
+                open_price, high, low, close = row
+                path = (open_price, low, high, close) if close >= open_price else (open_price, high, low, close)
+                for price in path:
+                    self._dispatch(stock, {'lastPrice': price, 'time': bar_time})
+                    count += 1
+                last = bar_time
+            self._last_time[stock] = last
+        return count
+
+    def _dispatch(self, stock, tick):
+        for sub_stock, callback in list(self._callbacks.values()):
+            if sub_stock == stock and callback is not None:
+                callback({stock: tick})
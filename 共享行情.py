@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+共享内存行情模块
+由一个加载进程把对齐后的价格/成交量矩阵和股票索引发布到共享内存，
+各策略进程以只读方式零拷贝挂载，进程增加时内存占用不变
+
+用法:
+    python 共享行情.py 数据目录 发布名称 [--periods 1d 1w]    # 加载进程，常驻直到Ctrl-C
+    python 共享行情.py 数据目录 发布名称 --check 策略文件.py [--start 20240101] [--end 20241231]
+        # 核对共享行情与本地文件的回测汇总指标是否一致
+"""
+
+import argparse
+import json
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from K线合成 import align_frames
+from 本地回测 import LocalDataStore, run_backtest
+
+DEFAULT_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'amount')
+HEADER_SIZE = struct.calcsize('<Q')
+
+
+def segment_names(name, period):
+    """
+    共享内存段名称：(元数据段, 数据段)
+    """
+    return '{}_{}_meta'.format(name, period), '{}_{}_data'.format(name, period)
+
+
+def attach_segment(segment_name):
+    """
+    挂载已存在的共享内存段，挂载方不负责释放
+    """
+    try:
+        return shared_memory.SharedMemory(name=segment_name, track=False)
+    except TypeError:
+        # Python 3.13之前挂载也会登记到resource_tracker，进程退出时会误删共享内存，挂载期间跳过登记
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=segment_name)
+        finally:
+            resource_tracker.register = register
+
+
+class MarketDataPublisher(object):
+    """
+    共享内存行情发布方
+    每个周期一组共享内存：元数据段(JSON：股票列表、时间轴、字段、形状)与数据段(字段×股票×时间的float64矩阵)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._segments = []
+
+    def publish(self, period, codes, times, fields):
+        """
+        发布一个周期的行情矩阵
+        :param codes: 股票代码列表
+        :param times: 时间字符串列表，升序
+        :param fields: {字段名: 形状为(股票数, 时间数)的二维数组}
+        """
+        field_names = list(fields.keys())
+        shape = (len(field_names), len(codes), len(times))
+        meta_name, data_name = segment_names(self.name, period)
+
+        data_segment = shared_memory.SharedMemory(name=data_name, create=True, size=max(1, int(np.prod(shape)) * 8))
+        self._segments.append(data_segment)
+        matrix = np.ndarray(shape, dtype=np.float64, buffer=data_segment.buf)
+        for i, field in enumerate(field_names):
+            matrix[i] = fields[field]
+
+        meta = json.dumps({
+            'period': period,
+            'codes': list(codes),
+            'times': [str(t) for t in times],
+            'fields': field_names,
+            'shape': shape,
+            'publish_time': time.time(),
+        }, ensure_ascii=False).encode('utf-8')
+        meta_segment = shared_memory.SharedMemory(name=meta_name, create=True, size=HEADER_SIZE + len(meta))
+        self._segments.append(meta_segment)
+        meta_segment.buf[HEADER_SIZE:HEADER_SIZE + len(meta)] = meta
+        # 长度最后写入，挂载方看到非零长度即表示数据已完整
+        meta_segment.buf[:HEADER_SIZE] = struct.pack('<Q', len(meta))
+        return shape
+
+    def publish_frames(self, period, frames, fields=DEFAULT_FIELDS):
+        """
+        将{股票代码: DataFrame(索引为时间)}对齐到统一时间轴后发布，缺失数据记为nan
+        """
+        codes, times, matrices = align_frames(dict((code, frames[code]) for code in sorted(frames)), fields)
+        return self.publish(period, codes, times, matrices)
+
+    def publish_store(self, store, periods=('1d',), codes=None):
+        """
+        从本地数据仓库加载并发布指定周期的全部行情
+        """
+        shapes = {}
+        for period in periods:
+            period_codes = codes or store.list_codes(period)
+            frames = dict((code, store.get_frame(code, period)) for code in period_codes)
+            shapes[period] = self.publish_frames(period, frames)
+        return shapes
+
+    def close(self):
+        """
+        释放并删除全部共享内存段
+        """
+        for segment in self._segments:
+            segment.close()
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        self._segments = []
+
+
+class SharedMarketView(object):
+    """
+    共享内存行情的只读视图
+    matrix/history返回的都是共享内存上的numpy视图，不复制数据
+    """
+
+    def __init__(self, name, period='1d'):
+        meta_name, data_name = segment_names(name, period)
+        self._meta_segment = attach_segment(meta_name)
+        length = struct.unpack('<Q', bytes(self._meta_segment.buf[:HEADER_SIZE]))[0]
+        meta = json.loads(bytes(self._meta_segment.buf[HEADER_SIZE:HEADER_SIZE + length]).decode('utf-8'))
+        self._data_segment = attach_segment(data_name)
+
+        self.period = meta['period']
+        self.codes = meta['codes']
+        self.times = np.array(meta['times'])
+        self.fields = meta['fields']
+        self.code_index = dict((code, i) for i, code in enumerate(self.codes))
+        self.field_index = dict((field, i) for i, field in enumerate(self.fields))
+
+        self.data = np.ndarray(tuple(meta['shape']), dtype=np.float64, buffer=self._data_segment.buf)
+        self.data.flags.writeable = False
+
+    def matrix(self, field):
+        """
+        某字段的(股票数, 时间数)矩阵视图
+        """
+        return self.data[self.field_index[field]]
+
+    def end_position(self, end_time):
+        """
+        end_time(含)之前的K线数量
+        """
+        return int(np.searchsorted(self.times, str(end_time), side='right'))
+
+    def history(self, code, field, end_time=None, count=None):
+        """
+        单只股票某字段截至end_time的最近count根K线视图
+        """
+        i = self.code_index.get(code)
+        if i is None or field not in self.field_index:
+            return None
+        end = len(self.times) if end_time is None else self.end_position(end_time)
+        start = 0 if not count or count < 0 else max(0, end - count)
+        return self.data[self.field_index[field], i, start:end]
+
+    def frame(self, code):
+        """
+        单只股票的DataFrame(时间×字段)，去掉全部字段为空的行(上市前、停牌及该股票文件中没有的时间)，
+        与本地文件读取的数据一致；有效行连续时底层数据仍为共享内存视图，否则为副本
+        """
+        i = self.code_index.get(code)
+        if i is None:
+            return None
+        block = self.data[:, i, :].T
+        valid = np.flatnonzero(~np.isnan(block).all(axis=1))
+        if len(valid) == 0:
+            return None
+        if valid[-1] - valid[0] + 1 == len(valid):
+            rows = slice(valid[0], valid[-1] + 1)
+        else:
+            rows = valid
+        return pd.DataFrame(block[rows], index=pd.Index(self.times[rows], name='time'), columns=self.fields,
+                            copy=False)
+
+    def close(self):
+        """
+        断开挂载（不删除共享内存）
+        """
+        self.data = None
+        self._data_segment.close()
+        self._meta_segment.close()
+
+
+class SharedDataStore(object):
+    """
+    基于共享内存行情的数据仓库，接口与本地回测的LocalDataStore一致
+    板块和基础信息等小数据仍从本地数据目录读取
+    """
+
+    def __init__(self, name, data_dir, periods=('1d',)):
+        local = LocalDataStore(data_dir)
+        self.data_dir = data_dir
+        self.sectors = local.sectors
+        self.instruments = local.instruments
+        self._local = local
+        self._views = {}
+        self._frames = {}
+        for period in periods:
+            try:
+                self._views[period] = SharedMarketView(name, period)
+            except FileNotFoundError:
+                print("共享行情不存在，周期{}改为读取本地文件".format(period))
+
+    def get_frame(self, code, period):
+        view = self._views.get(period)
+        if view is None:
+            return self._local.get_frame(code, period)
+        key = (period, code)
+        if key not in self._frames:
+            self._frames[key] = view.frame(code)
+        return self._frames[key]
+
+    def list_codes(self, period):
+        view = self._views.get(period)
+        return list(view.codes) if view is not None else self._local.list_codes(period)
+
+    def close(self):
+        self._frames = {}
+        for view in self._views.values():
+            view.close()
+
+
+def check_backtest(strategy_path, data_dir, name, periods=('1d',), start_time='', end_time='', params=None,
+                   **backtest_options):
+    """
+    同一策略分别用共享行情和本地文件各回测一次，核对汇总指标是否一致
+    :param name: 已发布的共享内存名称
+    :return: (是否一致, 共享行情汇总, 本地文件汇总)
+    """
+    store = SharedDataStore(name, data_dir, periods)
+    try:
+        shared = run_backtest(strategy_path, data_dir, start_time, end_time, params, quiet=True, store=store,
+                              **backtest_options)
+    finally:
+        store.close()
+    local = run_backtest(strategy_path, data_dir, start_time, end_time, params, quiet=True, **backtest_options)
+    same = set(shared) == set(local) and all(
+        np.isclose(shared[key], local[key], rtol=1e-12, atol=1e-12) for key in local)
+    return same, shared, local
+
+
+def main():
+    parser = argparse.ArgumentParser(description='发布共享内存行情')
+    parser.add_argument('data_dir', help='本地行情数据目录')
+    parser.add_argument('name', help='共享内存发布名称')
+    parser.add_argument('--periods', nargs='+', default=['1d'])
+    parser.add_argument('--check', metavar='STRATEGY', help='发布后核对该策略在共享行情与本地文件上的回测结果并退出')
+    parser.add_argument('--start', default='')
+    parser.add_argument('--end', default='')
+    args = parser.parse_args()
+
+    publisher = MarketDataPublisher(args.name)
+    try:
+        start = time.time()
+        shapes = publisher.publish_store(LocalDataStore(args.data_dir), args.periods)
+        for period, shape in shapes.items():
+            print("已发布 {} 周期{}: 字段{}个, 股票{}只, K线{}根".format(args.name, period, *shape))
+        if args.check:
+            same, shared, local = check_backtest(args.check, args.data_dir, args.name, args.periods,
+                                                 args.start, args.end)
+            print("共享行情回测: {}".format(shared))
+            print("本地文件回测: {}".format(local))
+            print("结果一致" if same else "结果不一致")
+            raise SystemExit(0 if same else 1)
+        print("发布耗时: {:.2f}秒，按Ctrl-C停止".format(time.time() - start))
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.close()
+
+
+if __name__ == '__main__':
+    main()
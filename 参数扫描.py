@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+参数扫描模块
+按参数网格在进程池中并行运行本地回测，汇总指标到一张结果表，支持中断后续跑
+
+用法:
+    python 参数扫描.py 策略文件.py 数据目录 参数网格.json 结果.csv [--workers 4] [--start 20240101] [--end 20241231]
+
+参数网格示例（大写参数写入策略模块常量，其余写入ContextInfo属性）:
+    {"stop_loss": [0.02, 0.03], "take_profit": [0.05, 0.08], "MAX_HOLDINGS": [5, 10]}
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+
+import pandas as pd
+
+from 本地回测 import LocalDataStore, SUMMARY_COLUMNS, run_backtest
+from 共享行情 import MarketDataPublisher, SharedDataStore
+
+PARAM_KEY_COLUMN = 'param_key'
+ERROR_COLUMN = 'error'
+
+
+def expand_grid(grid):
+    """
+    将参数网格展开为参数组合列表
+    :param grid: {参数名: [取值, ...]}
+    :return: [{参数名: 取值}, ...]
+    """
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def param_key(params):
+    """
+    参数组合的唯一标识，用于断点续跑时识别已完成的组合
+    """
+    return json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+
+# 工作进程内的共享行情仓库，同一进程的多次回测复用
+worker_store = None
+
+
+def init_sweep_worker(shared_name, data_dir, periods):
+    """
+    工作进程初始化：挂载共享内存行情
+    """
+    global worker_store
+    if shared_name:
+        worker_store = SharedDataStore(shared_name, data_dir, periods)
+
+
+def run_sweep_task(strategy_path, data_dir, params, start_time, end_time, backtest_options):
+    """
+    进程池中执行的单次回测任务
+    """
+    row = dict(params)
+    row[PARAM_KEY_COLUMN] = param_key(params)
+    try:
+        row.update(run_backtest(strategy_path, data_dir, start_time, end_time, params, quiet=True,
+                                store=worker_store, **backtest_options))
+        row[ERROR_COLUMN] = ''
+    except Exception as e:
+        row[ERROR_COLUMN] = str(e)
+    return row
+
+
+class ParameterSweep(object):
+    """
+    参数扫描器
+    每完成一个组合立即追加写入结果文件，重新运行时跳过结果文件中已有的组合
+    结果文件的列固定为参数、参数标识、全部汇总指标和错误信息；出现新列时重写整个文件，已有行的新列留空
+    shared_periods不为空时，行情只在主进程加载一次并通过共享内存发布给全部工作进程
+    """
+
+    def __init__(self, strategy_path, data_dir, grid, results_path, start_time='', end_time='',
+                 workers=None, retry_failed=False, shared_periods=('1d', '1w'), **backtest_options):
+        self.strategy_path = os.path.abspath(strategy_path)
+        self.data_dir = os.path.abspath(data_dir)
+        self.grid = grid
+        self.results_path = results_path
+        self.start_time = start_time
+        self.end_time = end_time
+        self.workers = workers or os.cpu_count() or 1
+        self.retry_failed = retry_failed
+        self.shared_periods = tuple(shared_periods or ())
+        self.backtest_options = backtest_options
+
+    def completed_keys(self):
+        """
+        读取结果文件中已完成的参数组合
+        """
+        if not os.path.exists(self.results_path):
+            return set()
+        done = pd.read_csv(self.results_path, dtype={PARAM_KEY_COLUMN: str})
+        if self.retry_failed and ERROR_COLUMN in done.columns:
+            done = done[done[ERROR_COLUMN].fillna('') == '']
+        return set(done[PARAM_KEY_COLUMN])
+
+    def pending(self):
+        """
+        尚未完成的参数组合
+        """
+        done = self.completed_keys()
+        return [params for params in expand_grid(self.grid) if param_key(params) not in done]
+
+    def columns(self):
+        """
+        结果文件的完整列：参数、参数标识、汇总指标、错误信息
+        """
+        return list(self.grid.keys()) + [PARAM_KEY_COLUMN] + list(SUMMARY_COLUMNS) + [ERROR_COLUMN]
+
+    def _append(self, row, columns):
+        """
+        追加一行结果，行中有结果文件没有的列时按新的列重写文件
+        :return: 写入后结果文件的列
+        """
+        added = [name for name in row if name not in columns]
+        if added and os.path.exists(self.results_path):
+            columns = columns + added
+            table = pd.read_csv(self.results_path, dtype={PARAM_KEY_COLUMN: str}).reindex(columns=columns)
+            table = pd.concat([table, pd.DataFrame([row]).reindex(columns=columns)], ignore_index=True)
+            temp_path = self.results_path + '.tmp'
+            table.to_csv(temp_path, index=False)
+            os.replace(temp_path, self.results_path)
+            return columns
+        columns = columns + added
+        write_header = not os.path.exists(self.results_path)
+        pd.DataFrame([row]).reindex(columns=columns).to_csv(
+            self.results_path, mode='a', header=write_header, index=False)
+        return columns
+
+    def run(self):
+        """
+        运行全部未完成的组合，返回完整结果表
+        """
+        todo = self.pending()
+        total = len(expand_grid(self.grid))
+        print("参数组合总数: {}, 已完成: {}, 待运行: {}".format(total, total - len(todo), len(todo)))
+
+        columns = self.columns()
+        if os.path.exists(self.results_path):
+            columns = list(pd.read_csv(self.results_path, nrows=0).columns)
+
+        if not todo:
+            return self.results()
+
+        publisher = None
+        shared_name = None
+        if self.shared_periods:
+            shared_name = 'sweep_{}'.format(os.getpid())
+            publisher = MarketDataPublisher(shared_name)
+            publisher.publish_store(LocalDataStore(self.data_dir), self.shared_periods)
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=init_sweep_worker,
+                    initargs=(shared_name, self.data_dir, self.shared_periods)) as executor:
+                futures = [executor.submit(run_sweep_task, self.strategy_path, self.data_dir, params,
+                                           self.start_time, self.end_time, self.backtest_options)
+                           for params in todo]
+                for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                    row = future.result()
+                    columns = self._append(row, columns)
+                    print("[{}/{}] {} {}".format(i, len(todo), row[PARAM_KEY_COLUMN], row.get(ERROR_COLUMN) or
+                                                  "收益: {:.2%}, 最大回撤: {:.2%}".format(row.get('total_return', 0), row.get('max_drawdown', 0))))
+        finally:
+            if publisher is not None:
+                publisher.close()
+
+        return self.results()
+
+    def results(self):
+        """
+        读取结果表，按夏普比率降序排列
+        """
+        if not os.path.exists(self.results_path):
+            return pd.DataFrame()
+        table = pd.read_csv(self.results_path)
+        if PARAM_KEY_COLUMN in table.columns:
+            table = table.drop_duplicates(PARAM_KEY_COLUMN, keep='last')
+        if 'sharpe' in table.columns:
+            table = table.sort_values('sharpe', ascending=False)
+        return table.reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='策略参数扫描')
+    parser.add_argument('strategy', help='策略文件路径')
+    parser.add_argument('data_dir', help='本地行情数据目录')
+    parser.add_argument('grid', help='参数网格JSON文件')
+    parser.add_argument('results', help='结果CSV文件，已存在时断点续跑')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--start', default='')
+    parser.add_argument('--end', default='')
+    parser.add_argument('--retry-failed', action='store_true', help='重新运行出错的组合')
+    args = parser.parse_args()
+
+    with open(args.grid, 'r', encoding='utf-8') as f:
+        grid = json.load(f)
+    sweep = ParameterSweep(args.strategy, args.data_dir, grid, args.results, args.start, args.end,
+                           workers=args.workers, retry_failed=args.retry_failed)
+    print(sweep.run().head(20).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""
+多策略宿主模块
+在一个平台实例(或一次本地回测)中同时运行多个策略脚本：每个策略加载为独立模块，
+使用独立的ContextInfo命名空间(策略写入的属性互不可见)，行情和基础信息请求统一经过共享数据层，
+同一K线内相同的请求只向平台请求一次，行情按股票去重后合并请求，结果对象在策略之间共享；
+下单函数按策略名称记录，平台下单接口passorder未指定策略名时填入该名称
+
+平台中的用法(宿主脚本):
+    from 多策略宿主 import StrategyHost
+    host = StrategyHost(globals())
+    host.add('kdj', r'路径/kdj金叉策略（code）.py')
+    host.add('20250923', r'路径/20250923策略（code）.py')
+
+    def init(ContextInfo):
+        host.init(ContextInfo)
+
+    def handlebar(ContextInfo):
+        host.handlebar(ContextInfo)
+
+    def stop(ContextInfo):
+        host.stop(ContextInfo)
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import os
+import threading
+import traceback
+
+from 本地回测 import (LocalBroker, LocalContext, LocalDataStore, apply_params, constant_params, load_strategy,
+                      summarize_equity, timetag_to_datetime)
+
+SCOPE_BAR = 'bar'           # 同一次handlebar内有效(实盘同一根K线的多次行情推送视为不同批次)
+SCOPE_DAY = 'day'           # 同一交易日内有效
+SCOPE_STATIC = 'static'     # 运行期间不变
+
+# 经共享数据层缓存的ContextInfo接口及缓存范围(get_market_data_ex和get_history_data单独处理)
+CACHED_CALLS = {
+    'get_stock_list_in_sector': SCOPE_DAY,
+    'get_stock_name': SCOPE_STATIC,
+    'get_open_date': SCOPE_STATIC,
+    'get_instrumentdetail': SCOPE_STATIC,
+    'get_float_caps': SCOPE_DAY,
+    'get_finance': SCOPE_DAY,
+}
+
+# 需要按策略记录的下单函数
+ORDER_FUNCTIONS = ('order_shares', 'order_lots', 'order_value', 'order_percent', 'order_target_value',
+                   'order_target_percent', 'passorder', 'algo_passorder', 'smart_algo_passorder', 'cancel')
+
+# 宿主脚本自身的入口函数，不注入到策略模块
+HOST_ENTRY_POINTS = ('init', 'handlebar', 'stop', 'after_init')
+
+# passorder的strategyName参数位置
+PASSORDER_STRATEGY_ARG = 7
+
+OrderRecord = collections.namedtuple('OrderRecord', ['strategy', 'bar_time', 'function', 'args', 'result'])
+
+
+class SharedDataLayer(object):
+    """
+    共享数据层：按缓存范围去重平台数据请求，并发的相同请求只有一个线程真正访问平台
+    返回的DataFrame等对象由多个策略共享，策略不应原地修改
+    :param context: 平台ContextInfo
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.sequence = 0
+        self._lock = threading.Lock()
+        self._caches = dict((scope, {}) for scope in (SCOPE_BAR, SCOPE_DAY, SCOPE_STATIC))
+        self._tokens = {}
+        self.requests = collections.Counter()           # {接口名: 策略请求次数}
+        self.upstream = collections.Counter()           # {接口名: 实际请求平台次数}
+        self.requested_codes = 0                        # get_market_data_ex策略请求的股票数合计
+        self.upstream_codes = 0                         # get_market_data_ex实际请求的股票数合计
+
+    def begin_bar(self):
+        """
+        开始新一批handlebar调用，SCOPE_BAR的缓存随之失效
+        """
+        with self._lock:
+            self.sequence += 1
+
+    def bar_time(self):
+        """
+        当前K线时间(YYYYMMDDHHMMSS)
+        """
+        return timetag_to_datetime(self.context.get_bar_timetag(self.context.barpos), '%Y%m%d%H%M%S')
+
+    def _token(self, scope):
+        if scope == SCOPE_BAR:
+            return self.sequence
+        if scope == SCOPE_DAY:
+            return self.bar_time()[:8]
+        return None
+
+    def _cache(self, scope):
+        """
+        取缓存范围对应的缓存，范围已切换(新K线/新交易日)时清空，需持有self._lock
+        """
+        token = self._token(scope)
+        if self._tokens.get(scope) != token:
+            self._caches[scope] = {}
+            self._tokens[scope] = token
+        return self._caches[scope]
+
+    def _resolve(self, cache, key, fetch):
+        """
+        缓存中有(或其他线程正在请求)时等待其结果，否则由当前线程请求；请求失败不缓存
+        """
+        with self._lock:
+            future = cache.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                cache[key] = future
+        if owner:
+            try:
+                future.set_result(fetch())
+            except BaseException as e:
+                with self._lock:
+                    if cache.get(key) is future:
+                        del cache[key]
+                future.set_exception(e)
+        return future.result()
+
+    def call(self, name, *args, **kwargs):
+        """
+        缓存调用ContextInfo上的基础信息接口
+        """
+        scope = CACHED_CALLS.get(name, SCOPE_BAR)
+        key = (name, repr(args), repr(sorted(kwargs.items())))
+        with self._lock:
+            self.requests[name] += 1
+            cache = self._cache(scope)
+
+        def fetch():
+            with self._lock:
+                self.upstream[name] += 1
+            return getattr(self.context, name)(*args, **kwargs)
+
+        return self._resolve(cache, key, fetch)
+
+    def get_market_data_ex(self, fields=[], stock_code=[], period='follow', start_time='', end_time='', count=-1,
+                           **kwargs):
+        """
+        与平台get_market_data_ex参数一致，按股票去重：
+        本批次已请求过(字段覆盖本次请求)的股票直接复用，其余股票合并为一次平台请求
+        """
+        codes = list(stock_code)
+        fields = list(fields or [])
+        if period == 'follow' and getattr(self.context, 'period', None):
+            period = self.context.period
+        window = (period, str(start_time), str(end_time), count, repr(sorted(kwargs.items())))
+        with self._lock:
+            self.requests['get_market_data_ex'] += 1
+            self.requested_codes += len(codes)
+            cache = self._cache(SCOPE_BAR)
+
+        entries = self._market_entries(cache, window, codes, fields, kwargs)
+        result = {}
+        for code in codes:
+            covered, frame = entries[code]
+            if frame is None:
+                continue
+            if fields and list(frame.columns) != fields:
+                frame = frame[[field for field in fields if field in frame.columns]]
+            result[code] = frame
+        return result
+
+    @staticmethod
+    def _covers(covered, fields):
+        # covered为None表示已请求全部字段
+        return covered is None or (fields and set(fields) <= covered)
+
+    def _market_entries(self, cache, window, codes, fields, kwargs):
+        """
+        :return: {股票: (已请求的字段集合, DataFrame或None)}
+        """
+        entries = {}
+        pending = list(dict.fromkeys(codes))
+        while pending:
+            mine, waiting, request_fields = [], [], set(fields)
+            with self._lock:
+                for code in pending:
+                    key = (code,) + window
+                    future = cache.get(key)
+                    if future is not None and not (future.done() and future.exception() is None
+                                                   and not self._covers(future.result()[0], fields)):
+                        waiting.append((code, future))
+                        continue
+                    if future is not None:
+                        # 已有结果但字段不足：连同已有字段一起重新请求
+                        request_fields |= future.result()[0]
+                    future = concurrent.futures.Future()
+                    cache[key] = future
+                    mine.append((code, future))
+            if mine:
+                self._fetch_market(cache, window, mine, [] if not fields else sorted(request_fields), kwargs)
+
+            pending = []
+            for code, future in mine + waiting:
+                covered, frame = future.result()
+                if self._covers(covered, fields):
+                    entries[code] = (covered, frame)
+                else:
+                    pending.append(code)
+        return entries
+
+    def _fetch_market(self, cache, window, mine, fields, kwargs):
+        period, start_time, end_time, count = window[:4]
+        codes = [code for code, _ in mine]
+        with self._lock:
+            self.upstream['get_market_data_ex'] += 1
+            self.upstream_codes += len(codes)
+        try:
+            data = self.context.get_market_data_ex(fields=fields, stock_code=codes, period=period,
+                                                   start_time=start_time, end_time=end_time, count=count,
+                                                   **kwargs) or {}
+        except BaseException as e:
+            with self._lock:
+                for code, future in mine:
+                    if cache.get((code,) + window) is future:
+                        del cache[(code,) + window]
+            for code, future in mine:
+                future.set_exception(e)
+            raise
+        covered = set(fields) if fields else None
+        for code, future in mine:
+            future.set_result((covered, data.get(code)))
+
+    def get_history_data(self, universe, length, period, field, *args):
+        """
+        平台get_history_data按股票池返回数据，宿主的平台股票池为各策略股票池的并集，
+        并集结果缓存一次，按策略自己的股票池筛选
+        """
+        data = self.call('get_history_data', length, period, field, *args)
+        return dict((code, data[code]) for code in universe if code in data)
+
+    def stats(self):
+        """
+        请求统计字典
+        """
+        with self._lock:
+            requests = sum(self.requests.values())
+            upstream = sum(self.upstream.values())
+            return {
+                'requests': requests,
+                'upstream': upstream,
+                'requested_codes': self.requested_codes,
+                'upstream_codes': self.upstream_codes,
+                'by_call': dict((name, (self.requests[name], self.upstream[name])) for name in self.requests),
+            }
+
+    def report(self):
+        """
+        请求统计文本
+        """
+        stats = self.stats()
+        saved = 1 - stats['upstream_codes'] / stats['requested_codes'] if stats['requested_codes'] else 0.0
+        return "共享数据: 策略请求{}次, 平台请求{}次; 行情股票数: 策略请求{}, 平台请求{}(减少{:.0%})".format(
+            stats['requests'], stats['upstream'], stats['requested_codes'], stats['upstream_codes'], saved)
+
+
+class StrategyContext(object):
+    """
+    单个策略的ContextInfo：策略写入的属性只保存在本对象中，未写入的属性和方法取自平台ContextInfo，
+    数据接口经过共享数据层，股票池按策略分别保存
+    """
+
+    def __init__(self, strategy_name, host, platform):
+        self.strategy_name = strategy_name
+        self._host = host
+        self._platform = platform
+        self._universe = []
+
+    def __getattr__(self, name):
+        # 只有本对象上不存在的属性才会到这里
+        if name.startswith('__') or name in ('_host', '_platform', '_universe'):
+            raise AttributeError(name)
+        if name in CACHED_CALLS:
+            getattr(self._platform, name)
+            return functools.partial(self._host.data.call, name)
+        return getattr(self._platform, name)
+
+    def set_universe(self, stocks):
+        self._universe = list(stocks)
+        self._host.update_universe()
+
+    def get_universe(self):
+        return list(self._universe)
+
+    def get_market_data_ex(self, *args, **kwargs):
+        return self._host.data.get_market_data_ex(*args, **kwargs)
+
+    def get_history_data(self, length, period, field, *args):
+        return self._host.data.get_history_data(self._universe, length, period, field, *args)
+
+
+class HostedStrategy(object):
+    """
+    宿主中的一个策略
+    """
+
+    def __init__(self, name, path, params=None, platform_globals=None):
+        self.name = name
+        self.path = path
+        self.params = params
+        self.platform_globals = platform_globals or {}
+        self.module = None
+        self.context = None
+        self.errors = 0
+
+
+class StrategyHost(object):
+    """
+    多策略宿主
+    :param platform_globals: 平台提供的全局函数(宿主脚本中传入globals())，注入到每个策略模块
+    :param isolate_errors: 为True时单个策略handlebar出错只记录日志，不影响其他策略
+    """
+
+    def __init__(self, platform_globals=None, logger=print, isolate_errors=True):
+        self.platform_globals = dict((name, value) for name, value in (platform_globals or {}).items()
+                                     if not name.startswith('_') and name not in HOST_ENTRY_POINTS)
+        self.logger = logger
+        self.isolate_errors = isolate_errors
+        self.strategies = []
+        self.platform = None
+        self.data = None
+        self.orders = []
+        self._orders_lock = threading.Lock()
+
+    def add(self, name, path, params=None, platform_globals=None):
+        """
+        登记策略(在init之前)
+        :param params: 策略参数，规则同本地回测的apply_params
+        :param platform_globals: 仅注入该策略的全局函数，覆盖宿主的同名函数(如本地回测中每个策略独立的模拟账户)
+        """
+        if any(strategy.name == name for strategy in self.strategies):
+            raise ValueError("策略名称重复: {}".format(name))
+        strategy = HostedStrategy(name, path, params, platform_globals)
+        self.strategies.append(strategy)
+        return strategy
+
+    def _attribute(self, strategy_name, function_name, func):
+        """
+        包装下单函数：参数中的策略ContextInfo换回平台ContextInfo，并按策略记录
+        """
+        def wrapper(*args, **kwargs):
+            args = tuple(self.platform if isinstance(arg, StrategyContext) else arg for arg in args)
+            kwargs = dict((key, self.platform if isinstance(value, StrategyContext) else value)
+                          for key, value in kwargs.items())
+            if function_name == 'passorder' and len(args) > PASSORDER_STRATEGY_ARG \
+                    and not args[PASSORDER_STRATEGY_ARG]:
+                args = args[:PASSORDER_STRATEGY_ARG] + (strategy_name,) + args[PASSORDER_STRATEGY_ARG + 1:]
+            result = func(*args, **kwargs)
+            record = OrderRecord(strategy_name, self.data.bar_time(), function_name,
+                                 tuple(arg for arg in args if arg is not self.platform), result)
+            with self._orders_lock:
+                self.orders.append(record)
+            return result
+        wrapper.__name__ = function_name
+        return wrapper
+
+    def _globals_for(self, strategy):
+        merged = dict(self.platform_globals)
+        merged.update(strategy.platform_globals)
+        for name in ORDER_FUNCTIONS:
+            if name in merged:
+                merged[name] = self._attribute(strategy.name, name, merged[name])
+        return merged
+
+    def update_universe(self):
+        """
+        平台股票池设为各策略股票池的并集(按策略登记顺序)
+        """
+        union = []
+        for strategy in self.strategies:
+            if strategy.context is not None:
+                union.extend(strategy.context._universe)
+        self.platform.set_universe(list(dict.fromkeys(union)))
+
+    def init(self, ContextInfo):
+        """
+        加载并初始化全部策略
+        """
+        self.platform = ContextInfo
+        self.data = SharedDataLayer(ContextInfo)
+        for strategy in self.strategies:
+            strategy.context = StrategyContext(strategy.name, self, ContextInfo)
+            strategy.module = load_strategy(strategy.path, self._globals_for(strategy),
+                                            module_name='strategy_{}'.format(strategy.name),
+                                            overrides=constant_params(strategy.params))
+            context_params = apply_params(strategy.module, strategy.context, strategy.params)
+            strategy.module.init(strategy.context)
+            for key, value in context_params.items():
+                setattr(strategy.context, key, value)
+            self.logger("策略{}初始化完成".format(strategy.name))
+
+    def handlebar(self, ContextInfo):
+        """
+        依次执行各策略的handlebar，共享同一批次的数据缓存
+        """
+        self.data.begin_bar()
+        for strategy in self.strategies:
+            try:
+                strategy.module.handlebar(strategy.context)
+            except Exception:
+                if not self.isolate_errors:
+                    raise
+                strategy.errors += 1
+                self.logger("策略{}执行出错:\n{}".format(strategy.name, traceback.format_exc()))
+
+    def stop(self, ContextInfo):
+        """
+        执行各策略的stop并停止其下单网关，输出共享数据和下单统计
+        """
+        for strategy in self.strategies:
+            if hasattr(strategy.module, 'stop'):
+                strategy.module.stop(strategy.context)
+            gateway = getattr(strategy.context, 'order_gateway', None)
+            if gateway is not None:
+                gateway.stop()
+        self.logger(self.report())
+
+    def orders_of(self, name):
+        """
+        某个策略的下单记录
+        """
+        with self._orders_lock:
+            return [record for record in self.orders if record.strategy == name]
+
+    def report(self):
+        """
+        共享数据和各策略下单统计文本
+        """
+        with self._orders_lock:
+            counts = collections.Counter(record.strategy for record in self.orders)
+        lines = [self.data.report() if self.data is not None else "共享数据: 未初始化"]
+        for strategy in self.strategies:
+            lines.append("策略{}: 下单{}次, 出错{}次".format(strategy.name, counts[strategy.name], strategy.errors))
+        return "\n".join(lines)
+
+
+def run_host_backtest(strategies, data_dir, start_time='', end_time='', stockcode='000300', market='SH',
+                      period='1d', capital=1000000, quiet=False, store=None):
+    """
+    在本地数据上用一个宿主同时回测多个策略，每个策略使用独立的模拟账户(与分别运行的平台实例对应)
+    :param strategies: [(名称, 策略文件路径)或(名称, 策略文件路径, 参数)]
+    :return: {'strategies': {名称: 回测汇总指标}, 'data': 共享数据层请求统计}
+    """
+    store = store or LocalDataStore(data_dir)
+    index_df = store.get_frame(stockcode + '.' + market, period)
+    if index_df is None:
+        raise ValueError("缺少基准行情数据: {}.{}".format(stockcode, market))
+    bar_times = [t for t in index_df.index if (not start_time or t >= str(start_time)) and (not end_time or t[:8] <= str(end_time))]
+
+    context = LocalContext(store, bar_times, stockcode, market, period, capital)
+    host = StrategyHost({'timetag_to_datetime': timetag_to_datetime})
+    brokers = {}
+    for spec in strategies:
+        name, path = spec[0], spec[1]
+        broker = LocalBroker(capital)
+        broker.context = context
+        brokers[name] = broker
+        host.add(name, path, spec[2] if len(spec) > 2 else None, {
+            'order_shares': broker.order_shares,
+            'get_trade_detail_data': broker.get_trade_detail_data,
+        })
+
+    equity = dict((name, []) for name in brokers)
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        host.init(context)
+        for pos in range(len(bar_times)):
+            context.barpos = pos
+            host.handlebar(context)
+            for name, broker in brokers.items():
+                equity[name].append(broker.total_asset())
+        host.stop(context)
+
+    summaries = {}
+    for name, broker in brokers.items():
+        summary = summarize_equity(equity[name], broker.trades)
+        summary['bars'] = len(bar_times)
+        summary['orders'] = len(host.orders_of(name))
+        summaries[name] = summary
+    return {'strategies': summaries, 'data': host.data.stats()}
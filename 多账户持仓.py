@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+多账户持仓模块
+同一策略运行在多个子账户时，用有界线程池并发查询各账户的持仓(POSITION)和资金(ACCOUNT)，
+刷新耗时取决于最慢的一次查询而不是账户数；提供单账户视图和全部账户的合计视图，并按账户计算买入标志
+"""
+
+import concurrent.futures
+import time
+
+# 持仓金额占总资产的比例低于该值时允许买入
+DEFAULT_MAX_STOCK_RATIO = 0.8
+
+
+def compute_enable_flag(total_amount, stock_amount, max_stock_ratio=DEFAULT_MAX_STOCK_RATIO):
+    """
+    买入标志：总资产为正且持仓金额占比低于max_stock_ratio
+    """
+    if total_amount <= 0:
+        return False
+    return stock_amount / total_amount < max_stock_ratio
+
+
+class AccountState(object):
+    """
+    单个账户(或合计)的持仓和资金
+    holdings格式: {股票代码: {'volume': 持仓股数, 'price': 成本价, 'available_volume': 可用股数, 'total_amount': 持仓金额}}
+    """
+
+    def __init__(self, account_id):
+        self.account_id = account_id
+        self.holdings = {}
+        self.total_amount = 0.0         # 总资产
+        self.available_amount = 0.0     # 可用资金
+        self.stock_amount = 0.0         # 持仓总金额
+        self.enable_flag = False
+        self.error = None               # 最近一次刷新的错误，成功时为None
+        self.refreshed_at = None
+        self.seconds = 0.0              # 最近一次刷新中该账户查询的耗时
+
+    def update_flag(self, max_stock_ratio=DEFAULT_MAX_STOCK_RATIO):
+        self.enable_flag = compute_enable_flag(self.total_amount, self.stock_amount, max_stock_ratio)
+        return self.enable_flag
+
+    def describe(self):
+        return "账户{}: 总资产{:.2f}, 可用{:.2f}, 持仓{:.2f}, 持仓{}只, 可买入: {}{}".format(
+            self.account_id, self.total_amount, self.available_amount, self.stock_amount, len(self.holdings),
+            self.enable_flag, ", 刷新失败: {}".format(self.error) if self.error else "")
+
+
+class MultiAccountPositions(object):
+    """
+    多账户持仓与资金服务
+    :param query: 平台查询函数query(账户, 'stock', 'position'/'account')，即get_trade_detail_data
+    :param account_ids: 账户列表
+    :param symbols: 证券代码表，用于持仓对象转换为代码
+    :param max_workers: 并发查询线程数上限
+    :param max_stock_ratio: 买入标志的持仓占比上限
+    """
+
+    def __init__(self, query, account_ids, symbols, max_workers=4, max_stock_ratio=DEFAULT_MAX_STOCK_RATIO,
+                 logger=print):
+        self.query = query
+        self.account_ids = list(account_ids)
+        self.symbols = symbols
+        self.max_workers = max(1, int(max_workers or 1))
+        self.max_stock_ratio = max_stock_ratio
+        self.logger = logger
+        self.states = dict((account_id, AccountState(account_id)) for account_id in self.account_ids)
+        self._executor = None
+        self.refresh_count = 0
+        self.last_seconds = 0.0
+
+    def _timed_query(self, account_id, kind):
+        start = time.time()
+        result = self.query(account_id, 'stock', kind)
+        return result, time.time() - start
+
+    def refresh(self):
+        """
+        并发刷新全部账户的持仓和资金，单个账户查询失败时保留其上次数据并记录错误
+        :return: 本次刷新耗时(秒)
+        """
+        start = time.time()
+        if self._executor is None and self.max_workers > 1:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        tasks = [(account_id, kind) for account_id in self.account_ids for kind in ('position', 'account')]
+        if self._executor is None:
+            outcomes = [self._run(account_id, kind) for account_id, kind in tasks]
+        else:
+            futures = [self._executor.submit(self._run, account_id, kind) for account_id, kind in tasks]
+            outcomes = [future.result() for future in futures]
+
+        # 持仓对象在主线程中转换，证券代码表无需加锁
+        results = dict(zip(tasks, outcomes))
+        for account_id in self.account_ids:
+            self._apply(self.states[account_id], results[(account_id, 'position')], results[(account_id, 'account')])
+        self.refresh_count += 1
+        self.last_seconds = time.time() - start
+        return self.last_seconds
+
+    def _run(self, account_id, kind):
+        try:
+            result, seconds = self._timed_query(account_id, kind)
+            return result, seconds, None
+        except Exception as e:
+            return None, 0.0, str(e)
+
+    def _apply(self, state, position_outcome, account_outcome):
+        positions, position_seconds, position_error = position_outcome
+        accounts, account_seconds, account_error = account_outcome
+        state.error = position_error or account_error
+        state.seconds = max(position_seconds, account_seconds)
+        if position_error is None:
+            holdings = {}
+            for position in positions or []:
+                holdings[self.symbols.position_code(position)] = {
+                    'volume': position.m_nVolume,
+                    'price': position.m_dOpenPrice,
+                    'available_volume': position.m_nCanUseVolume,
+                    'total_amount': position.m_dInstrumentValue,
+                }
+            state.holdings = holdings
+        if account_error is None and accounts:
+            account = accounts[0]
+            state.total_amount = account.m_dBalance
+            state.available_amount = account.m_dAvailable
+            state.stock_amount = account.m_dInstrumentValue
+        state.update_flag(self.max_stock_ratio)
+        if state.error is None:
+            state.refreshed_at = time.time()
+        else:
+            self.logger("账户{}刷新失败: {}".format(state.account_id, state.error))
+
+    def account(self, account_id):
+        """
+        单个账户视图
+        """
+        return self.states[account_id]
+
+    def enable_flags(self):
+        """
+        {账户: 买入标志}
+        """
+        return dict((account_id, state.enable_flag) for account_id, state in self.states.items())
+
+    def aggregate(self):
+        """
+        全部账户的合计视图：同一股票的股数和金额相加，成本价按股数加权
+        """
+        total = AccountState('合计')
+        for state in self.states.values():
+            total.total_amount += state.total_amount
+            total.available_amount += state.available_amount
+            total.stock_amount += state.stock_amount
+            for stock, info in state.holdings.items():
+                merged = total.holdings.setdefault(
+                    stock, {'volume': 0, 'price': 0.0, 'available_volume': 0, 'total_amount': 0.0})
+                cost = merged['price'] * merged['volume'] + info['price'] * info['volume']
+                merged['volume'] += info['volume']
+                merged['available_volume'] += info['available_volume']
+                merged['total_amount'] += info['total_amount']
+                merged['price'] = cost / merged['volume'] if merged['volume'] else 0.0
+        total.update_flag(self.max_stock_ratio)
+        return total
+
+    def report(self):
+        """
+        刷新统计文本
+        """
+        slowest = max(self.states.values(), key=lambda state: state.seconds) if self.states else None
+        return "多账户持仓: {}个账户, 刷新{}次, 最近一次耗时{:.3f}秒{}".format(
+            len(self.states), self.refresh_count, self.last_seconds,
+            ", 最慢账户{}({:.3f}秒)".format(slowest.account_id, slowest.seconds) if slowest else "")
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+惰性数据模块
+数据请求先返回惰性句柄，只有真正读取字段时才调用平台接口；
+同时统计每类请求的请求次数和实际读取次数，便于发现请求了却从未使用的数据
+"""
+
+import collections
+import threading
+import time
+
+
+class LazyDataTracker(object):
+    """
+    惰性数据请求统计
+    按请求标签累计: 请求次数、实际请求接口次数、接口耗时
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requested = collections.Counter()
+        self.fetched = collections.Counter()
+        self.fetch_seconds = collections.Counter()
+
+    def record_request(self, label):
+        with self._lock:
+            self.requested[label] += 1
+
+    def record_fetch(self, label, seconds):
+        with self._lock:
+            self.fetched[label] += 1
+            self.fetch_seconds[label] += seconds
+
+    def unread(self):
+        """
+        请求了但从未读取的数据: {标签: 未读取次数}
+        """
+        with self._lock:
+            return dict((label, count - self.fetched[label]) for label, count in self.requested.items()
+                        if count > self.fetched[label])
+
+    def report(self):
+        """
+        生成统计报告文本
+        """
+        lines = ["惰性数据请求统计:"]
+        with self._lock:
+            labels = sorted(self.requested.keys())
+            for label in labels:
+                requested = self.requested[label]
+                fetched = self.fetched[label]
+                lines.append("  {}: 请求{}次, 实际读取{}次, 未读取{}次, 接口耗时{:.2f}秒{}".format(
+                    label, requested, fetched, requested - fetched, self.fetch_seconds[label],
+                    " <- 从未读取" if fetched == 0 else ""))
+        if len(lines) == 1:
+            lines.append("  无")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self.requested.clear()
+            self.fetched.clear()
+            self.fetch_seconds.clear()
+
+
+class LazyHandle(object):
+    """
+    惰性数据句柄
+    首次访问内容(取值、in判断、遍历、长度等)时才执行请求函数，结果缓存后重复使用
+    """
+
+    def __init__(self, label, fetch, tracker=None):
+        self._label = label
+        self._fetch = fetch
+        self._tracker = tracker
+        self._value = None
+        self._loaded = False
+        if tracker is not None:
+            tracker.record_request(label)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def value(self):
+        """
+        获取真实数据，首次调用时请求接口
+        """
+        if not self._loaded:
+            start = time.time()
+            self._value = self._fetch()
+            self._loaded = True
+            self._fetch = None
+            if self._tracker is not None:
+                self._tracker.record_fetch(self._label, time.time() - start)
+        return self._value
+
+    def __getitem__(self, key):
+        return self.value()[key]
+
+    def __contains__(self, key):
+        return key in self.value()
+
+    def __iter__(self):
+        return iter(self.value())
+
+    def __len__(self):
+        return len(self.value())
+
+    def __bool__(self):
+        return bool(self.value())
+
+    def get(self, key, default=None):
+        return self.value().get(key, default)
+
+    def keys(self):
+        return self.value().keys()
+
+    def items(self):
+        return self.value().items()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.value(), name)
+
+    def __repr__(self):
+        return "LazyHandle({}, {})".format(self._label, "已读取" if self._loaded else "未读取")
+
+
+class LazyDataContext(object):
+    """
+    ContextInfo数据接口的惰性包装
+    get_market_data_ex返回LazyHandle，其余属性和方法直接转发给原ContextInfo
+    """
+
+    def __init__(self, context, tracker=None):
+        self._context = context
+        self.tracker = tracker or LazyDataTracker()
+
+    def lazy(self, label, fetch):
+        """
+        将任意取数函数包装为惰性句柄
+        """
+        return LazyHandle(label, fetch, self.tracker)
+
+    def get_market_data_ex(self, label=None, **kwargs):
+        """
+        惰性版get_market_data_ex，参数与平台接口一致（需使用关键字参数）
+        :param label: 统计标签，默认为"get_market_data_ex 周期"
+        """
+        if label is None:
+            label = "get_market_data_ex {}".format(kwargs.get('period', ''))
+        context = self._context
+        return LazyHandle(label, lambda: context.get_market_data_ex(**kwargs), self.tracker)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
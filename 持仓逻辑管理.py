@@ -4,6 +4,8 @@
 实现持仓管理、资金管理和买入判断逻辑
 """
 
+from 证券代码表 import SymbolTable
+
 def init_position_manager(ContextInfo):
     """
     初始化持仓与资金管理器
@@ -12,6 +14,10 @@ def init_position_manager(ContextInfo):
     # 格式: {股票代码: {'volume': 持仓股数, 'price': 成本价, 'total_amount': 持仓金额}}
     ContextInfo.holdings = {}
     
+    # 股票代码表：持仓对象的代码字符串只拼接一次
+    if getattr(ContextInfo, 'symbols', None) is None:
+        ContextInfo.symbols = SymbolTable()
+    
     # 资金信息
     ContextInfo.total_amount = 0       # 总金额
     ContextInfo.available_amount = 0   # 可用金额
@@ -36,7 +42,7 @@ def update_positions(ContextInfo, account_id):
         ContextInfo.holdings = {}
         
         for position in positions:
-            stock_code = position.m_strInstrumentID + '.' + position.m_strExchangeID
+            stock_code = ContextInfo.symbols.position_code(position)
             volume = position.m_nVolume
             price = position.m_dOpenPrice
             total_amount = position.m_dPositionCost
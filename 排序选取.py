@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+排序选取模块
+基于argpartition的O(n)部分选取和基于堆的流式TopK，用于板块和个股排名
+得分相同时按先后顺序（数组下标或加入顺序）靠前者优先
+"""
+
+import heapq
+import itertools
+
+import numpy as np
+
+
+def top_k_indices(scores, k, descending=True):
+    """
+    选出得分最高(或最低)的k个下标，按得分排序返回
+    :param scores: 得分数组，nan视为无效
+    :param k: 选取数量
+    :param descending: True为选最高分，False为选最低分
+    :return: 下标数组，得分相同时下标小的在前
+    """
+    scores = np.asarray(scores, dtype=float)
+    keys = scores if descending else -scores
+    valid = np.flatnonzero(~np.isnan(keys))
+    k = min(int(k), len(valid))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+
+    values = keys[valid]
+    if k < len(valid):
+        # 第k大的得分作为阈值：严格大于阈值的全部入选，等于阈值的按下标先后补足
+        threshold = values[np.argpartition(-values, k - 1)[k - 1]]
+        above = valid[values > threshold]
+        ties = valid[values == threshold][:k - len(above)]
+        chosen = np.concatenate([above, ties])
+    else:
+        chosen = valid
+
+    # 仅对选中的k个元素排序，得分降序、下标升序
+    order = np.lexsort((chosen, -keys[chosen]))
+    return chosen[order]
+
+
+def top_k_items(score_map, k, descending=True):
+    """
+    从{名称: 得分}字典中选出得分最高的k项
+    :return: [(名称, 得分), ...]，按得分降序，得分相同时按字典插入顺序
+    """
+    if not score_map or k <= 0:
+        return []
+    names = list(score_map.keys())
+    scores = np.fromiter((score_map[name] for name in names), dtype=float, count=len(names))
+    return [(names[i], score_map[names[i]]) for i in top_k_indices(scores, k, descending)]
+
+
+def top_fraction_items(score_map, fraction, min_count=0, descending=True):
+    """
+    从{名称: 得分}字典中选出得分排名前fraction比例的项
+    :param fraction: 选取比例，如0.8表示前80%
+    :param min_count: 最少选取数量
+    """
+    count = max(int(len(score_map) * fraction), min_count)
+    return top_k_items(score_map, count, descending)
+
+
+class StreamingTopK(object):
+    """
+    流式TopK选取器
+    候选逐个加入，始终只保留得分最高的k个，内存O(k)、单次加入O(log k)
+    得分相同时先加入者优先保留
+    """
+
+    def __init__(self, k):
+        self.k = int(k)
+        self._heap = []
+        self._seq = itertools.count()
+        self.seen_count = 0
+
+    def push(self, key, score, payload=None):
+        """
+        加入一个候选
+        :return: 该候选当前是否被保留
+        """
+        self.seen_count += 1
+        if self.k <= 0 or score is None or score != score:
+            return False
+        # 堆顶为当前保留集合中最弱的候选：得分最低、同分时最晚加入
+        entry = (score, -next(self._seq), key, payload)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def threshold(self):
+        """
+        当前入选所需的最低得分，未满k个时返回None
+        """
+        if len(self._heap) < self.k:
+            return None
+        return self._heap[0][0]
+
+    def __len__(self):
+        return len(self._heap)
+
+    def items(self):
+        """
+        返回保留的候选[(key, score, payload), ...]，按得分降序、同分按加入顺序
+        """
+        ordered = sorted(self._heap, key=lambda entry: (entry[0], entry[1]), reverse=True)
+        return [(entry[2], entry[0], entry[3]) for entry in ordered]
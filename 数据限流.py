@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+数据限流模块
+平台行情接口的统一访问层：令牌桶限制请求速率，信号量限制同时进行的请求数，
+临时性失败按指数退避重试，大股票列表自动分批请求；
+记录限流等待、重试和最终失败的股票，不再靠截断股票池和忽略异常来减轻接口压力
+"""
+
+import concurrent.futures
+import threading
+import time
+
+# 视为临时性失败、可以重试的异常类型(网络、超时、连接中断)，其余异常直接抛出
+TRANSIENT_ERRORS = (OSError, EOFError, concurrent.futures.TimeoutError)
+
+
+class DataRequestError(Exception):
+    """
+    数据请求重试后仍然失败
+    """
+
+    def __init__(self, message, codes=()):
+        Exception.__init__(self, message)
+        self.codes = list(codes)
+
+
+class TokenBucket(object):
+    """
+    令牌桶
+    :param rate: 每秒补充的令牌数(即持续请求速率)，None或0表示不限速
+    :param burst: 桶容量(允许的突发请求数)
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate or 0)
+        self.burst = max(1.0, float(burst or 1))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        取出令牌，令牌不足时等待
+        :return: 等待的秒数
+        """
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class RateLimitedDataClient(object):
+    """
+    限流重试的数据访问客户端
+    :param context: 平台ContextInfo
+    :param rate: 每秒最多请求数，None表示不限速
+    :param burst: 允许的突发请求数
+    :param max_concurrency: 同时进行的请求数上限，分批请求时也作为并发线程数
+    :param max_retries: 临时性失败的最大重试次数
+    :param backoff: 首次重试等待秒数，之后每次翻倍
+    :param max_backoff: 单次重试等待上限(秒)
+    :param chunk_size: get_market_data_ex每次请求的股票数量上限
+    :param transient_errors: 重试的异常类型
+    """
+
+    def __init__(self, context, rate=None, burst=1, max_concurrency=1, max_retries=3, backoff=0.5,
+                 max_backoff=8.0, chunk_size=500, transient_errors=TRANSIENT_ERRORS, logger=print):
+        self.context = context
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max(1, int(max_concurrency or 1))
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.chunk_size = chunk_size
+        self.transient_errors = tuple(transient_errors)
+        self.logger = logger
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.retry_count = 0
+        self.failure_count = 0
+        self.throttled_count = 0
+        self.throttled_seconds = 0.0
+        self.failed_codes = set()   # 重试后仍未取到数据的股票
+
+    def call(self, func, *args, **kwargs):
+        """
+        限流并重试地调用任意平台接口，只重试transient_errors中的异常
+        :raises DataRequestError: 重试max_retries次后仍失败
+        """
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire()
+            with self._slots:
+                with self._lock:
+                    self.request_count += 1
+                    if waited > 0:
+                        self.throttled_count += 1
+                        self.throttled_seconds += waited
+                try:
+                    return func(*args, **kwargs)
+                except self.transient_errors as e:
+                    error = e
+            if attempt >= self.max_retries:
+                with self._lock:
+                    self.failure_count += 1
+                raise DataRequestError("{}重试{}次后仍失败: {}".format(
+                    getattr(func, '__name__', '数据请求'), attempt, str(error)))
+            delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+            attempt += 1
+            with self._lock:
+                self.retry_count += 1
+            self.logger("数据请求失败，{:.1f}秒后第{}次重试: {}".format(delay, attempt, str(error)))
+            time.sleep(delay)
+
+    def get_market_data_ex(self, fields=[], stock_code=[], period='follow', start_time='', end_time='',
+                           count=-1, chunk_size=None, progress=None, strict=False, **kwargs):
+        """
+        与平台get_market_data_ex参数一致，股票列表超过chunk_size时分批请求后合并
+        :param progress: 进度回调progress(已完成股票数, 总股票数)
+        :param strict: 为True时任何一批最终失败即抛出DataRequestError，否则跳过该批并记入failed_codes
+        :return: {股票: DataFrame}
+        """
+        codes = list(stock_code)
+        size = chunk_size or self.chunk_size or len(codes) or 1
+        chunks = [codes[i:i + size] for i in range(0, len(codes), size)]
+
+        def fetch(chunk):
+            return self.call(self.context.get_market_data_ex, fields=fields, stock_code=chunk, period=period,
+                             start_time=start_time, end_time=end_time, count=count, **kwargs)
+
+        result = {}
+        done = [0]
+
+        def collect(chunk, data):
+            result.update(data or {})
+            done[0] += len(chunk)
+            if progress is not None:
+                progress(done[0], len(codes))
+
+        if len(chunks) <= 1 or self.max_concurrency == 1:
+            outcomes = (self._attempt(fetch, chunk) for chunk in chunks)
+            for chunk, (data, error) in zip(chunks, outcomes):
+                self._check(chunk, error, strict)
+                collect(chunk, data)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                futures = [executor.submit(self._attempt, fetch, chunk) for chunk in chunks]
+                # 按提交顺序合并，结果顺序与单线程一致
+                for chunk, future in zip(chunks, futures):
+                    data, error = future.result()
+                    self._check(chunk, error, strict)
+                    collect(chunk, data)
+        return result
+
+    @staticmethod
+    def _attempt(fetch, chunk):
+        try:
+            return fetch(chunk), None
+        except DataRequestError as e:
+            return None, e
+
+    def _check(self, chunk, error, strict):
+        if error is None:
+            with self._lock:
+                self.failed_codes.difference_update(chunk)
+            return
+        with self._lock:
+            self.failed_codes.update(chunk)
+        if strict:
+            raise DataRequestError(str(error), chunk)
+        self.logger("{}只股票数据请求失败已跳过: {}".format(len(chunk), str(error)))
+
+    def report(self):
+        """
+        请求统计文本
+        """
+        text = "数据请求: {}次, 限流等待{}次共{:.2f}秒, 重试{}次, 失败{}次".format(
+            self.request_count, self.throttled_count, self.throttled_seconds, self.retry_count, self.failure_count)
+        if self.failed_codes:
+            text += ", 未取到数据的股票{}只".format(len(self.failed_codes))
+        return text
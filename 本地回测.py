@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+本地回测模块
+使用本地存储的行情数据模拟ContextInfo和交易接口，在平台之外运行策略脚本
+
+本地数据目录结构:
+    {data_dir}/{period}/{股票代码}.csv   行情数据，time列格式为YYYYMMDD或YYYYMMDDHHMMSS
+    {data_dir}/sectors.json             {板块名称: [股票代码, ...]}
+    {data_dir}/instruments.json         {股票代码: {'name': 名称, 'open_date': 上市日期, 'float_caps': 流通股本}}，可选
+"""
+
+import ast
+import contextlib
+import datetime
+import json
+import math
+import os
+import sys
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_ACCOUNT = 'testS'
+
+
+def timetag_to_datetime(timetag, format):
+    """
+    时间戳(毫秒)转换为日期时间格式，与平台同名函数一致
+    """
+    return time.strftime(format, time.localtime(timetag / 1000))
+
+
+def time_str_to_timetag(time_str):
+    """
+    YYYYMMDD或YYYYMMDDHHMMSS格式的时间字符串转换为毫秒时间戳
+    """
+    time_str = str(time_str)
+    fmt = '%Y%m%d%H%M%S' if len(time_str) > 8 else '%Y%m%d'
+    return int(time.mktime(datetime.datetime.strptime(time_str, fmt).timetuple()) * 1000)
+
+
+def read_source(path):
+    """
+    读取策略源码，按编码声明解码，声明与实际编码不符时依次尝试utf-8和gbk
+    """
+    raw = open(path, 'rb').read()
+    for encoding in ('utf-8', 'gbk'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("无法识别策略文件编码: {}".format(path))
+
+
+PARAM_OVERRIDES_NAME = '__param_overrides__'
+
+
+def constant_params(params):
+    """
+    参数中写入策略模块常量的部分(大写参数名)
+    """
+    return dict((key, value) for key, value in (params or {}).items() if key.isupper())
+
+
+def override_constants(tree, overrides):
+    """
+    将模块顶层对overrides中常量的赋值替换为参数值，由这些常量推导的常量(如DAILY_BARS = WEEKLY_BARS * 5 + 10)
+    在模块执行时按参数值计算
+    :return: 被替换的常量名集合
+    """
+    replaced = set()
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target = node.target
+        else:
+            continue
+        if isinstance(target, ast.Name) and target.id in overrides:
+            value = ast.Subscript(value=ast.Name(id=PARAM_OVERRIDES_NAME, ctx=ast.Load()),
+                                  slice=ast.Constant(value=target.id), ctx=ast.Load())
+            node.value = ast.copy_location(value, node.value)
+            replaced.add(target.id)
+    ast.fix_missing_locations(tree)
+    return replaced
+
+
+def load_strategy(path, platform_globals=None, module_name=None, overrides=None):
+    """
+    加载策略脚本为独立模块，并注入平台提供的全局函数(order_shares、get_trade_detail_data等)
+    :param overrides: {常量名: 值}，在模块执行时代替顶层赋值，依赖它们的常量随之重新计算
+    """
+    source = read_source(path)
+    # 源码已解码为str，去掉编码声明避免compile时重复解码
+    lines = source.split('\n')
+    for i in range(min(2, len(lines))):
+        if 'coding' in lines[i] and lines[i].lstrip().startswith('#'):
+            lines[i] = '#'
+    module_name = module_name or 'strategy_{}'.format(abs(hash(os.path.abspath(path))))
+    module = types.ModuleType(module_name)
+    module.__file__ = path
+    module.__dict__.update(platform_globals or {})
+    strategy_dir = os.path.dirname(os.path.abspath(path))
+    if strategy_dir not in sys.path:
+        sys.path.insert(0, strategy_dir)
+    tree = ast.parse('\n'.join(lines), path)
+    if overrides:
+        override_constants(tree, overrides)
+        module.__dict__[PARAM_OVERRIDES_NAME] = dict(overrides)
+    exec(compile(tree, path, 'exec'), module.__dict__)
+    return module
+
+
+class LocalDataStore(object):
+    """
+    本地行情数据仓库，按周期和股票代码懒加载CSV并缓存
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self._frames = {}
+        self.sectors = self._load_json('sectors.json')
+        self.instruments = self._load_json('instruments.json')
+
+    def _load_json(self, name):
+        path = os.path.join(self.data_dir, name)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def get_frame(self, code, period):
+        """
+        获取单只股票的完整行情DataFrame，索引为时间字符串，不存在时返回None
+        """
+        key = (period, code)
+        if key not in self._frames:
+            path = os.path.join(self.data_dir, period, code + '.csv')
+            if os.path.exists(path):
+                df = pd.read_csv(path, dtype={'time': str})
+                df = df.set_index('time').sort_index()
+                self._frames[key] = df
+            else:
+                self._frames[key] = None
+        return self._frames[key]
+
+    def list_codes(self, period):
+        """
+        列出某周期下所有有数据的股票代码
+        """
+        folder = os.path.join(self.data_dir, period)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-4] for name in os.listdir(folder) if name.endswith('.csv'))
+
+
+class LocalBroker(object):
+    """
+    简化的模拟撮合账户：指定价格成交，未指定价格时按当前K线收盘价成交
+    """
+
+    def __init__(self, capital):
+        self.cash = float(capital)
+        self.positions = {}     # {股票代码: {'volume': 股数, 'cost': 成本价, 'open_date': 开仓时间戳}}
+        self.trades = []
+        self.context = None
+
+    def order_shares(self, *args):
+        """
+        兼容平台两种调用方式:
+        order_shares(代码, 股数, ContextInfo, 账户)
+        order_shares(代码, 股数, 下单类型, 价格, ContextInfo, 账户)
+        """
+        stock_code, shares = args[0], int(args[1])
+        price = args[3] if len(args) >= 6 else None
+        fill_price = price if price else self.context.current_price(stock_code)
+        if not fill_price or fill_price != fill_price or shares == 0:
+            return {'success': False, 'error': '无有效价格'}
+
+        position = self.positions.get(stock_code)
+        if shares < 0:
+            held = position['volume'] if position else 0
+            shares = -min(-shares, held)
+            if shares == 0:
+                return {'success': False, 'error': '无可卖持仓'}
+        else:
+            affordable = int(self.cash / fill_price / 100) * 100
+            shares = min(shares, affordable)
+            if shares <= 0:
+                return {'success': False, 'error': '资金不足'}
+
+        self.cash -= shares * fill_price
+        if position is None:
+            position = {'volume': 0, 'cost': 0.0, 'open_date': self.context.current_timetag()}
+            self.positions[stock_code] = position
+        if shares > 0:
+            position['cost'] = (position['cost'] * position['volume'] + shares * fill_price) / (position['volume'] + shares)
+        else:
+            self.trades.append((stock_code, fill_price / position['cost'] - 1 if position['cost'] else 0.0))
+        position['volume'] += shares
+        if position['volume'] == 0:
+            del self.positions[stock_code]
+        return {'success': True, 'volume': shares, 'price': fill_price}
+
+    def market_value(self):
+        value = 0.0
+        for code, position in self.positions.items():
+            price = self.context.current_price(code)
+            if price == price and price:
+                value += position['volume'] * price
+            else:
+                value += position['volume'] * position['cost']
+        return value
+
+    def total_asset(self):
+        return self.cash + self.market_value()
+
+    def get_trade_detail_data(self, account_id, datatype, kind):
+        """
+        模拟平台get_trade_detail_data，支持POSITION和ACCOUNT
+        """
+        kind = kind.upper()
+        if kind == 'POSITION':
+            result = []
+            for code, position in self.positions.items():
+                instrument, exchange = code.split('.')
+                price = self.context.current_price(code)
+                result.append(types.SimpleNamespace(
+                    m_strInstrumentID=instrument,
+                    m_strExchangeID=exchange,
+                    m_nVolume=position['volume'],
+                    m_nCanUseVolume=position['volume'],
+                    m_dOpenPrice=position['cost'],
+                    m_dPositionCost=position['cost'] * position['volume'],
+                    m_dInstrumentValue=position['volume'] * (price if price == price else position['cost']),
+                    m_nOpenDate=position['open_date'],
+                ))
+            return result
+        if kind == 'ACCOUNT':
+            return [types.SimpleNamespace(
+                m_strAccountID=account_id,
+                m_dBalance=self.total_asset(),
+                m_dAvailable=self.cash,
+                m_dInstrumentValue=self.market_value(),
+            )]
+        return []
+
+
+class LocalContext(object):
+    """
+    模拟平台ContextInfo，行情数据只返回当前K线及之前的数据
+    """
+
+    def __init__(self, store, bar_times, stockcode='000300', market='SH', period='1d', capital=1000000):
+        self.store = store
+        self.bar_times = list(bar_times)
+        self.stockcode = stockcode
+        self.market = market
+        self.period = period
+        self.capital = capital
+        self.barpos = 0
+        self.benchmark = stockcode + '.' + market
+        self.account_id = DEFAULT_ACCOUNT
+        self.accID = DEFAULT_ACCOUNT
+        self.do_back_test = True
+        self.paint_records = {}
+        self._universe = []
+
+    # 时间相关
+    def current_time_str(self):
+        return self.bar_times[self.barpos]
+
+    def current_timetag(self):
+        return time_str_to_timetag(self.current_time_str())
+
+    def get_bar_timetag(self, index):
+        return time_str_to_timetag(self.bar_times[index])
+
+    def current_price(self, code):
+        df = self.store.get_frame(code, self.period)
+        if df is None:
+            return float('nan')
+        end = df.index.searchsorted(self.current_time_str(), side='right')
+        if end == 0:
+            return float('nan')
+        return float(df['close'].iloc[end - 1])
+
+    # 股票池与基础信息
+    def set_universe(self, stocks):
+        self._universe = list(stocks)
+
+    def get_universe(self):
+        return list(self._universe)
+
+    def get_stock_list_in_sector(self, sector_name, *args):
+        return list(self.store.sectors.get(sector_name, []))
+
+    def get_stock_name(self, code):
+        return self.store.instruments.get(code, {}).get('name', '')
+
+    def get_open_date(self, code):
+        return int(self.store.instruments.get(code, {}).get('open_date', 0))
+
+    def get_float_caps(self, code):
+        return float(self.store.instruments.get(code, {}).get('float_caps', 0))
+
+    def paint(self, name, value, *args):
+        self.paint_records.setdefault(name, []).append((self.current_time_str(), value))
+
+    # 行情接口
+    def _slice(self, df, start_time='', end_time='', count=-1):
+        current = self.current_time_str()
+        end_key = min(current, str(end_time) + '999999') if end_time else current
+        end = df.index.searchsorted(end_key, side='right')
+        start = df.index.searchsorted(str(start_time), side='left') if start_time else 0
+        if count is not None and count > 0:
+            start = max(start, end - count)
+        return df.iloc[start:end]
+
+    def get_market_data_ex(self, fields=[], stock_code=[], period='follow', start_time='', end_time='', count=-1, **kwargs):
+        period = self.period if period == 'follow' else period
+        result = {}
+        for code in stock_code:
+            df = self.store.get_frame(code, period)
+            if df is None:
+                continue
+            sliced = self._slice(df, start_time, end_time, count)
+            if fields:
+                sliced = sliced[[field for field in fields if field in sliced.columns]]
+            result[code] = sliced
+        return result
+
+    def get_history_data(self, length, period, field, *args):
+        result = {}
+        for code in self._universe:
+            df = self.store.get_frame(code, period)
+            if df is None or field not in df.columns:
+                continue
+            result[code] = list(self._slice(df, count=length)[field].values)
+        return result
+
+
+def apply_params(module, context, params):
+    """
+    设置策略参数：大写参数名写入模块全局常量(需在init之前)，其余写入ContextInfo属性(在init之后)
+    模块顶层定义的常量应在load_strategy时通过overrides传入，依赖它们的常量才会按参数值计算；
+    这里再次写入，覆盖不在模块顶层赋值的常量
+    :return: 需要在init之后设置的ContextInfo属性
+    """
+    context_params = {}
+    for key, value in (params or {}).items():
+        if key.isupper() and hasattr(module, key):
+            setattr(module, key, value)
+        else:
+            context_params[key] = value
+    return context_params
+
+
+# run_backtest返回的汇总指标
+SUMMARY_COLUMNS = ('final_nav', 'total_return', 'annual_return', 'max_drawdown', 'sharpe', 'closed_trades',
+                   'win_rate', 'bars')
+
+
+def summarize_equity(equity, trades, periods_per_year=252):
+    """
+    由净值序列计算回测汇总指标
+    """
+    equity = np.asarray(equity, dtype=float)
+    if len(equity) == 0 or equity[0] <= 0:
+        return {}
+    nav = equity / equity[0]
+    returns = np.diff(nav) / nav[:-1] if len(nav) > 1 else np.array([])
+    drawdown = 1 - nav / np.maximum.accumulate(nav)
+    std = returns.std() if len(returns) > 1 else 0.0
+    years = max(len(nav) - 1, 1) / periods_per_year
+    wins = [ret for _, ret in trades]
+    return {
+        'final_nav': float(nav[-1]),
+        'total_return': float(nav[-1] - 1),
+        'annual_return': float(nav[-1] ** (1 / years) - 1) if nav[-1] > 0 else -1.0,
+        'max_drawdown': float(drawdown.max()),
+        'sharpe': float(returns.mean() / std * math.sqrt(periods_per_year)) if std > 0 else 0.0,
+        'closed_trades': len(trades),
+        'win_rate': float(np.mean([ret > 0 for ret in wins])) if wins else 0.0,
+    }
+
+
+def run_backtest(strategy_path, data_dir, start_time='', end_time='', params=None,
+                 stockcode='000300', market='SH', period='1d', capital=1000000, quiet=False, store=None):
+    """
+    在本地数据上运行一次完整回测
+    :param store: 行情数据仓库，为空时读取data_dir下的本地文件
+    :return: 回测汇总指标字典
+    """
+    store = store or LocalDataStore(data_dir)
+    index_df = store.get_frame(stockcode + '.' + market, period)
+    if index_df is None:
+        raise ValueError("缺少基准行情数据: {}.{}".format(stockcode, market))
+    bar_times = [t for t in index_df.index if (not start_time or t >= str(start_time)) and (not end_time or t[:8] <= str(end_time))]
+
+    broker = LocalBroker(capital)
+    context = LocalContext(store, bar_times, stockcode, market, period, capital)
+    broker.context = context
+    platform_globals = {
+        'order_shares': broker.order_shares,
+        'get_trade_detail_data': broker.get_trade_detail_data,
+        'timetag_to_datetime': timetag_to_datetime,
+    }
+
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        module = load_strategy(strategy_path, platform_globals, overrides=constant_params(params))
+        context_params = apply_params(module, context, params)
+        module.init(context)
+        for key, value in context_params.items():
+            setattr(context, key, value)
+
+        equity = []
+        for pos in range(len(bar_times)):
+            context.barpos = pos
+            module.handlebar(context)
+            equity.append(broker.total_asset())
+        if hasattr(module, 'stop'):
+            module.stop(context)
+        gateway = getattr(context, 'order_gateway', None)
+        if gateway is not None:
+            gateway.stop()
+
+    summary = summarize_equity(equity, broker.trades)
+    summary['bars'] = len(bar_times)
+    return summary
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+板块热度模块
+各板块成分股去重合并为一个股票集合，只请求一次行情；
+板块×股票的成分矩阵与个股涨跌幅、量比、成交额向量相乘，一次得到全部板块的汇总指标；
+各板块的滚动窗口汇总随每个新交易日增量更新，盘中用最新行情临时计算当日热度
+"""
+
+import numpy as np
+
+# 热度得分权重：0.4×平均涨跌幅 + 0.3×平均成交量变化 + 0.3×总成交额(亿元)
+PRICE_WEIGHT = 0.4
+VOLUME_WEIGHT = 0.3
+AMOUNT_WEIGHT = 0.3
+AMOUNT_UNIT = 1e8
+
+
+class SectorMembership(object):
+    """
+    板块成分矩阵
+    :param sector_stocks: {板块名称: 成分股列表}
+    codes为全部成分股去重后的并集(按首次出现顺序)，matrix[i, j]=1表示第j只股票属于第i个板块
+    """
+
+    def __init__(self, sector_stocks):
+        self.names = [name for name, stocks in sector_stocks.items() if stocks]
+        self.codes = []
+        self.code_index = {}
+        for name in self.names:
+            for code in sector_stocks[name]:
+                if code not in self.code_index:
+                    self.code_index[code] = len(self.codes)
+                    self.codes.append(code)
+        self.matrix = np.zeros((len(self.names), len(self.codes)))
+        for i, name in enumerate(self.names):
+            columns = [self.code_index[code] for code in sector_stocks[name]]
+            self.matrix[i, columns] = 1.0
+        self.total_members = int(self.matrix.sum())
+
+    def __len__(self):
+        return len(self.names)
+
+    def same_as(self, other):
+        """
+        成分是否与另一个成分矩阵完全相同
+        """
+        return (other is not None and self.names == other.names and self.codes == other.codes
+                and np.array_equal(self.matrix, other.matrix))
+
+    def expand(self, codes, matrix):
+        """
+        将按codes排列的(股票数, 时间数)矩阵展开为按成分并集排列，缺失股票为nan
+        """
+        matrix = np.asarray(matrix, dtype=float)
+        full = np.full((len(self.codes),) + matrix.shape[1:], np.nan)
+        rows = [self.code_index.get(code, -1) for code in codes]
+        keep = [i for i, row in enumerate(rows) if row >= 0]
+        full[[rows[i] for i in keep]] = matrix[keep]
+        return full
+
+    def aggregate(self, values):
+        """
+        按板块求和：values为(股票数,)向量，返回(板块数,)向量
+        """
+        return self.matrix.dot(values)
+
+
+def daily_stock_changes(prev_close, close, prev_volume, volume, amount):
+    """
+    个股单日指标，全部为(股票数,)向量
+    :return: (有效标志, 涨跌幅, 成交量变化, 成交额)，无效的个股对应值为0
+    收盘价缺失或昨收为0的个股无效；成交量缺失或昨量为0时成交量变化记0，成交额缺失记0
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = np.isfinite(prev_close) & np.isfinite(close) & (prev_close != 0)
+        price_change = np.where(valid, close / prev_close - 1, 0.0)
+        volume_ok = valid & np.isfinite(prev_volume) & np.isfinite(volume) & (prev_volume != 0)
+        volume_change = np.where(volume_ok, volume / prev_volume - 1, 0.0)
+        amount = np.where(valid & np.isfinite(amount), amount, 0.0)
+    return valid.astype(float), price_change, volume_change, amount
+
+
+def heat_score(avg_price_change, avg_volume_change, total_amount):
+    """
+    板块热度得分
+    """
+    return (PRICE_WEIGHT * avg_price_change +
+            VOLUME_WEIGHT * avg_volume_change +
+            AMOUNT_WEIGHT * (total_amount / AMOUNT_UNIT))
+
+
+def sector_stats(valid_count, sum_price_change, sum_volume_change, total_amount):
+    """
+    由板块汇总值计算平均值和热度得分，无有效样本的板块为nan
+    :return: {'valid_count', 'avg_price_change', 'avg_volume_change', 'total_amount', 'heat'}，均为(板块数,)向量
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_price_change = np.where(valid_count > 0, sum_price_change / valid_count, np.nan)
+        avg_volume_change = np.where(valid_count > 0, sum_volume_change / valid_count, np.nan)
+    return {
+        'valid_count': valid_count,
+        'avg_price_change': avg_price_change,
+        'avg_volume_change': avg_volume_change,
+        'total_amount': total_amount,
+        'heat': heat_score(avg_price_change, avg_volume_change, total_amount),
+    }
+
+
+def compute_sector_heat(membership, close, volume, amount):
+    """
+    由成分股最近两日的行情计算各板块热度
+    :param close/volume/amount: 按membership.codes排列的(股票数, 交易日数)矩阵，最后一列为当日
+    """
+    if close.shape[1] < 2:
+        zeros = np.zeros(len(membership))
+        return sector_stats(zeros, zeros, zeros, zeros)
+    valid, price_change, volume_change, day_amount = daily_stock_changes(
+        close[:, -2], close[:, -1], volume[:, -2], volume[:, -1], amount[:, -1])
+    return sector_stats(membership.aggregate(valid), membership.aggregate(price_change),
+                        membership.aggregate(volume_change), membership.aggregate(day_amount))
+
+
+class SectorHeatTracker(object):
+    """
+    板块滚动汇总
+    每个已完成交易日只做一次个股->板块的汇总并计入滚动窗口，窗口内各板块的涨跌幅、量比、成交额之和增量维护，
+    热度和窗口统计只需O(板块数)；当日未收盘时用最新行情做临时计算，不计入窗口
+    :param membership: SectorMembership成分矩阵
+    :param window: 滚动窗口交易日数
+    :param heat_days: 热度得分使用最近几个交易日的汇总，1表示只看最近一日
+    """
+
+    def __init__(self, membership, window=5, heat_days=1):
+        self.membership = membership
+        self.window = window
+        self.heat_days = heat_days
+        self.last_date = None
+        self._prev = None           # 最近一个已完成交易日的(收盘价, 成交量)
+        self._days = []             # [(交易日, 有效数, 涨跌幅和, 量比和, 成交额)]，按板块汇总，最多window个
+        sectors = len(membership)
+        self._sums = [np.zeros(sectors) for _ in range(4)]
+
+    def _sector_day(self, close, volume, amount, volume_scale=1.0):
+        prev_close, prev_volume = self._prev
+        valid, price_change, volume_change, day_amount = daily_stock_changes(
+            prev_close, close, prev_volume, volume * volume_scale, amount * volume_scale)
+        return tuple(self.membership.aggregate(values) for values in (valid, price_change, volume_change, day_amount))
+
+    def update_day(self, date, close, volume, amount):
+        """
+        计入一个已完成交易日，close/volume/amount为按成分并集排列的(股票数,)向量
+        :return: 是否计入（早于或等于已计入日期的数据忽略）
+        """
+        date = str(date)
+        if self.last_date is not None and date <= self.last_date:
+            return False
+        close, volume, amount = [np.asarray(x, dtype=float) for x in (close, volume, amount)]
+        if self._prev is not None:
+            day = self._sector_day(close, volume, amount)
+            if len(self._days) == self.window:
+                evicted = self._days.pop(0)
+                for total, value in zip(self._sums, evicted[1:]):
+                    total -= value
+            self._days.append((date,) + day)
+            for total, value in zip(self._sums, day):
+                total += value
+        self._prev = (close, volume)
+        self.last_date = date
+        return True
+
+    def update_history(self, dates, close, volume, amount, before=None):
+        """
+        依次计入多日行情矩阵(股票数, 交易日数)中尚未计入的交易日
+        :param before: 只计入早于该日期的交易日(当日未收盘时不计入)
+        :return: 计入的交易日数
+        """
+        count = 0
+        for t, date in enumerate(dates):
+            if before is not None and str(date) >= before:
+                break
+            count += self.update_day(date, close[:, t], volume[:, t], amount[:, t])
+        return count
+
+    @property
+    def ready(self):
+        return self._prev is not None
+
+    @property
+    def days(self):
+        """
+        滚动窗口内已计入的交易日
+        """
+        return [day[0] for day in self._days]
+
+    def _recent_sums(self, days):
+        recent = self._days[-days:] if days > 0 else []
+        sectors = len(self.membership)
+        return [sum((day[k] for day in recent), np.zeros(sectors)) for k in range(1, 5)]
+
+    def heat(self):
+        """
+        最近heat_days个已完成交易日的板块统计
+        """
+        return sector_stats(*self._recent_sums(self.heat_days))
+
+    def window_stats(self):
+        """
+        整个滚动窗口的板块统计（增量维护，O(板块数)）
+        """
+        return sector_stats(*self._sums)
+
+    def provisional(self, close, volume, amount, session_fraction=1.0):
+        """
+        当日盘中临时热度：以最新行情作为当日数据，与最近heat_days-1个已完成交易日合并，不计入窗口
+        :param session_fraction: 当日已交易时间占全天的比例，成交量和成交额按比例折算为全天
+        """
+        if self._prev is None:
+            return self.heat()
+        close, volume, amount = [np.asarray(x, dtype=float) for x in (close, volume, amount)]
+        scale = 1.0 / session_fraction if session_fraction > 0 else 1.0
+        today = self._sector_day(close, volume, amount, scale)
+        previous = self._recent_sums(self.heat_days - 1)
+        return sector_stats(*[a + b for a, b in zip(previous, today)])
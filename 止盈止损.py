@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+止盈止损模块
+全部持仓的买入价、持仓期最高价、建仓日期、持仓天数和最长持有天数存放在按股票编号索引的数组中，
+每根K线(或每笔行情)对全部持仓一次向量化判断回撤止盈、硬止损和超期无盈利清仓，返回离场列表及原因
+"""
+
+import datetime
+import random
+
+import numpy as np
+
+from 证券代码表 import SymbolArray
+
+EXIT_NONE = 0
+EXIT_DRAWDOWN = 1       # 浮动止盈：收益率达到止盈线后自最高价回撤超过阈值
+EXIT_HARD_STOP = 2      # 硬止损：亏损超过止损线
+EXIT_NO_PROFIT = 3      # 持仓超过最长持有天数且没有盈利
+
+# 离场原因(同时作为下单策略名称)
+EXIT_REASONS = {
+    EXIT_DRAWDOWN: 'drawdown_stop',
+    EXIT_HARD_STOP: 'hard_stop_loss',
+    EXIT_NO_PROFIT: 'no_profit_clear',
+}
+
+
+class ExitSignal(object):
+    """
+    离场信号
+    """
+
+    def __init__(self, stock, reason, price, return_rate, drawdown, hold_days, hold_limit):
+        self.stock = stock
+        self.reason = reason
+        self.price = price
+        self.return_rate = return_rate
+        self.drawdown = drawdown
+        self.hold_days = hold_days
+        self.hold_limit = hold_limit
+
+    @property
+    def name(self):
+        return EXIT_REASONS[self.reason]
+
+    def __repr__(self):
+        return "ExitSignal({}, {}, 收益率={:.2%})".format(self.stock, self.name, self.return_rate)
+
+
+class StopEngine(object):
+    """
+    向量化止盈止损
+    :param symbols: 证券代码表(SymbolTable)
+    :param hold_days_range: 最长持有天数在该区间内随机，每个持仓建仓时确定一次
+    """
+
+    def __init__(self, symbols, hold_days_range=(7, 10)):
+        self.symbols = symbols
+        self.hold_days_range = hold_days_range
+        self.active = SymbolArray(symbols, bool, False)
+        self.buy_price = SymbolArray(symbols, np.float64, 0.0)
+        self.highest = SymbolArray(symbols, np.float64, 0.0)
+        self.entry_day = SymbolArray(symbols, 'datetime64[D]', np.datetime64('NaT'))
+        self.hold_days = SymbolArray(symbols, np.int64, 0)
+        self.hold_limit = SymbolArray(symbols, np.int64, 0)
+
+    def __len__(self):
+        return len(self.active.nonzero_ids())
+
+    def __contains__(self, stock):
+        sid = self.symbols.id_of(stock)
+        return sid >= 0 and bool(self.active[sid])
+
+    def open(self, stock, buy_price, buy_date, highest_price=None, hold_limit=None):
+        """
+        登记持仓
+        :param buy_date: 建仓日期(datetime或YYYY-MM-DD)
+        """
+        sid = self.symbols.intern(stock)
+        self.active[sid] = True
+        self.buy_price[sid] = buy_price
+        self.highest[sid] = buy_price if highest_price is None else max(highest_price, buy_price)
+        self.entry_day[sid] = np.datetime64(str(buy_date)[:10], 'D')
+        self.hold_days[sid] = 0
+        self.hold_limit[sid] = hold_limit if hold_limit else random.randint(*self.hold_days_range)
+
+    def close(self, stock):
+        sid = self.symbols.id_of(stock)
+        if sid >= 0:
+            self.active[sid] = False
+
+    def sync(self, holdings, lookup):
+        """
+        与当前持仓同步：新持仓调用lookup(stock)获取(买入价, 建仓日期)后登记，已清仓的移除
+        :return: (新增列表, 移除列表)
+        """
+        held = set(holdings)
+        removed = [self.symbols.code(sid) for sid in self.active.nonzero_ids()
+                   if self.symbols.code(sid) not in held]
+        for stock in removed:
+            self.close(stock)
+        added = [stock for stock in holdings if stock not in self]
+        for stock in added:
+            buy_price, buy_date = lookup(stock)
+            self.open(stock, buy_price, buy_date)
+        return added, removed
+
+    def evaluate(self, stocks, price, high, trade_date, take_profit, drawdown_threshold, stop_loss):
+        """
+        对一组持仓一次判断全部离场规则
+        :param stocks: 股票代码列表
+        :param price/high: 与stocks对应的最新价和当期最高价数组，nan表示无行情
+        :param trade_date: 当前交易日(YYYY-MM-DD)，用于计算持仓天数(按工作日)
+        :param take_profit: 浮动止盈启动收益率
+        :param drawdown_threshold: 浮动止盈的回撤阈值
+        :param stop_loss: 硬止损亏损比例
+        :return: [ExitSignal]，每只股票至多一条，规则优先级为回撤止盈、硬止损、超期无盈利
+        """
+        sids = self.symbols.ids_of(stocks)
+        known = sids >= 0
+        sids = np.where(known, sids, 0)
+        active = known & self.active[sids]
+        price = np.asarray(price, dtype=float)
+        high = np.asarray(high, dtype=float)
+
+        # 最高价用当期最高价更新（无最高价时用最新价）
+        quoted = active & np.isfinite(price)
+        bar_high = np.where(np.isfinite(high), np.maximum(high, price), price)
+        highest = np.where(quoted, np.fmax(self.highest[sids], bar_high), self.highest[sids])
+        self.highest[sids[quoted]] = highest[quoted]
+
+        entry = self.entry_day[sids]
+        has_entry = active & ~np.isnat(entry)
+        hold_days = np.zeros(len(sids), dtype=np.int64)
+        hold_days[has_entry] = np.busday_count(entry[has_entry], np.datetime64(trade_date[:10], 'D'))
+        self.hold_days[sids[has_entry]] = hold_days[has_entry]
+
+        buy_price = self.buy_price[sids]
+        limit = self.hold_limit[sids]
+        valid = quoted & (buy_price > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return_rate = np.where(valid, price / buy_price - 1, 0.0)
+            drawdown = np.where(valid & (highest > 0), (highest - price) / highest, 0.0)
+
+        reason = np.full(len(sids), EXIT_NONE, dtype=np.int64)
+        no_profit = valid & (hold_days > limit) & (price <= buy_price)
+        reason[no_profit] = EXIT_NO_PROFIT
+        reason[valid & (return_rate <= -stop_loss)] = EXIT_HARD_STOP
+        reason[valid & (return_rate >= take_profit) & (drawdown >= drawdown_threshold)] = EXIT_DRAWDOWN
+
+        return [ExitSignal(stocks[i], int(reason[i]), float(price[i]), float(return_rate[i]), float(drawdown[i]),
+                           int(hold_days[i]), int(limit[i]))
+                for i in np.flatnonzero(reason != EXIT_NONE)]
+
+    def export_state(self):
+        """
+        导出为{股票: {'buy_price', 'buy_date', 'highest_price', 'hold_days', 'hold_limit'}}，用于写入快照
+        """
+        state = {}
+        for sid in self.active.nonzero_ids():
+            entry = self.entry_day[sid]
+            state[self.symbols.code(sid)] = {
+                'buy_price': float(self.buy_price[sid]),
+                'buy_date': None if np.isnat(entry) else datetime.datetime.strptime(str(entry), '%Y-%m-%d'),
+                'highest_price': float(self.highest[sid]),
+                'hold_days': int(self.hold_days[sid]),
+                'hold_limit': int(self.hold_limit[sid]),
+            }
+        return state
+
+    def load_state(self, state):
+        """
+        由export_state的结果恢复，缺少的字段按建仓时的默认值处理
+        """
+        self.active.reset()
+        for stock, info in state.items():
+            buy_date = info.get('buy_date') or datetime.datetime.now()
+            self.open(stock, info.get('buy_price', 0.0), buy_date, info.get('highest_price'), info.get('hold_limit'))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+涨跌停价格表模块
+按板块、ST状态和交易日，由昨收价批量计算全市场的涨跌停价格，每个交易日计算一次
+"""
+
+import numpy as np
+
+# 各板块涨跌幅限制
+MAIN_BOARD_LIMIT = 0.10     # 沪深主板
+ST_LIMIT = 0.10             # 主板ST/*ST，自ST_LIMIT_CHANGE_DATE起与主板一致
+LEGACY_ST_LIMIT = 0.05      # ST_LIMIT_CHANGE_DATE之前的主板ST/*ST
+ST_LIMIT_CHANGE_DATE = '20250707'  # 沪深主板风险警示股票涨跌幅限制由5%调整为10%的首个交易日
+GROWTH_BOARD_LIMIT = 0.20   # 创业板、科创板（含ST）
+BEIJING_LIMIT = 0.30        # 北交所
+
+# 板块代码前缀
+GROWTH_BOARD_PREFIXES = ('300', '301', '688', '689')
+BEIJING_SUFFIX = '.BJ'
+
+PRICE_TICK = 0.01           # 最小报价单位
+PRICE_EPS = 1e-6            # 浮点比较容差
+
+
+def is_st_name(names):
+    """
+    根据股票名称判断是否为ST/*ST股票
+    :param names: 股票名称列表
+    :return: bool数组
+    """
+    return np.array(['ST' in (name or '') for name in names], dtype=bool)
+
+
+def st_limit_ratio(trade_date=None):
+    """
+    主板ST/*ST股票在某交易日的涨跌幅限制
+    :param trade_date: 交易日，YYYYMMDD或YYYY-MM-DD开头的字符串，为空时按现行规则
+    """
+    if not trade_date:
+        return ST_LIMIT
+    date = str(trade_date).replace('-', '')[:8]
+    return LEGACY_ST_LIMIT if date < ST_LIMIT_CHANGE_DATE else ST_LIMIT
+
+
+def board_limit_ratio(codes, st_flags=None, trade_date=None):
+    """
+    根据股票代码前缀、ST标志和交易日计算每只股票的涨跌幅限制
+    :param codes: 股票代码列表，格式如'600000.SH'
+    :param st_flags: ST标志数组，可为空
+    :param trade_date: 交易日，决定主板ST股票的涨跌幅限制，为空时按现行规则
+    :return: 涨跌幅限制数组
+    """
+    codes = np.asarray(codes, dtype=str)
+    ratio = np.full(len(codes), MAIN_BOARD_LIMIT)
+    if len(codes) == 0:
+        return ratio
+
+    if st_flags is not None:
+        ratio[np.asarray(st_flags, dtype=bool)] = st_limit_ratio(trade_date)
+
+    growth = np.zeros(len(codes), dtype=bool)
+    for prefix in GROWTH_BOARD_PREFIXES:
+        growth |= np.char.startswith(codes, prefix)
+    ratio[growth] = GROWTH_BOARD_LIMIT
+
+    ratio[np.char.endswith(codes, BEIJING_SUFFIX)] = BEIJING_LIMIT
+    return ratio
+
+
+def round_to_tick(prices):
+    """
+    按最小报价单位四舍五入
+    """
+    return np.floor(np.asarray(prices, dtype=float) / PRICE_TICK + 0.5 + PRICE_EPS) * PRICE_TICK
+
+
+class LimitPriceTable(object):
+    """
+    单个交易日的涨跌停价格表
+    每只股票的涨停价/跌停价按昨收价、板块涨跌幅限制计算并四舍五入到分
+    """
+
+    def __init__(self, codes, prev_close, st_flags=None, trade_date=None):
+        self.trade_date = trade_date
+        self.codes = list(codes)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.prev_close = np.asarray(prev_close, dtype=float)
+        self.st_flags = np.zeros(len(self.codes), dtype=bool) if st_flags is None else np.asarray(st_flags, dtype=bool)
+        self.limit_ratio = board_limit_ratio(self.codes, self.st_flags, trade_date)
+
+        valid = np.isfinite(self.prev_close) & (self.prev_close > 0)
+        self.valid = valid
+        self.up_limit = np.where(valid, round_to_tick(self.prev_close * (1 + self.limit_ratio)), np.nan)
+        self.down_limit = np.where(valid, round_to_tick(self.prev_close * (1 - self.limit_ratio)), np.nan)
+
+    @classmethod
+    def build(cls, codes, prev_close, names=None, st_flags=None, trade_date=None):
+        """
+        构建涨跌停价格表，ST标志可直接给出或由股票名称推断
+        """
+        if st_flags is None and names is not None:
+            st_flags = is_st_name(names)
+        return cls(codes, prev_close, st_flags, trade_date)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def align(self, prices):
+        """
+        将{股票代码: 价格}对齐到本表的股票顺序，缺失记为nan
+        """
+        aligned = np.full(len(self.codes), np.nan)
+        for code, price in prices.items():
+            i = self.index.get(code)
+            if i is not None:
+                aligned[i] = price
+        return aligned
+
+    def is_limit_up(self, prices):
+        """
+        判断价格是否达到涨停价，prices需与本表股票顺序一致
+        """
+        prices = np.asarray(prices, dtype=float)
+        return self.valid & (prices >= self.up_limit - PRICE_EPS)
+
+    def is_limit_down(self, prices):
+        """
+        判断价格是否达到跌停价，prices需与本表股票顺序一致
+        """
+        prices = np.asarray(prices, dtype=float)
+        return self.valid & (prices <= self.down_limit + PRICE_EPS)
+
+    def limit_mask(self, prices):
+        """
+        涨停或跌停的股票掩码，用于一次性剔除无法正常成交的股票
+        """
+        return self.is_limit_up(prices) | self.is_limit_down(prices)
+
+    def limit_prices(self, code):
+        """
+        查询单只股票的(涨停价, 跌停价)
+        """
+        i = self.index.get(code)
+        if i is None:
+            return None, None
+        return self.up_limit[i], self.down_limit[i]
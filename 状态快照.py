@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+状态快照模块
+将策略状态(持仓信息、做T信息、板块热度等)和指标缓存写入带版本号的磁盘快照，重启时在init中恢复
+小数据写入manifest.json，大数组写为.npy文件并以内存映射方式读取；
+每次保存生成新一代文件，最后原子替换manifest.json，写入中途崩溃不会破坏上一份快照
+"""
+
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+SNAPSHOT_FORMAT = 'strategy-snapshot'
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+
+def encode_value(value):
+    """
+    json.dumps的default函数：处理datetime和numpy标量
+    """
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError("无法写入快照的数据类型: {}".format(type(value).__name__))
+
+
+def decode_value(obj):
+    """
+    json.loads的object_hook：还原datetime
+    """
+    if len(obj) == 1 and '__datetime__' in obj:
+        text = obj['__datetime__']
+        return datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f' if '.' in text else '%Y-%m-%dT%H:%M:%S')
+    return obj
+
+
+class SnapshotError(Exception):
+    """
+    快照不存在或与当前版本不兼容
+    """
+    pass
+
+
+class StateSnapshot(object):
+    """
+    策略状态快照
+    :param directory: 快照目录
+    :param name: 策略名称，加载时校验
+    :param schema_version: 策略状态结构版本，策略状态字段变化时递增，旧快照将被忽略
+    """
+
+    def __init__(self, directory, name, schema_version=1):
+        self.directory = directory
+        self.name = name
+        self.schema_version = schema_version
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+
+    def _read_manifest(self):
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f, object_hook=decode_value)
+
+    def save(self, state, arrays=None):
+        """
+        保存快照
+        :param state: 可JSON序列化的状态字典(支持datetime和numpy标量)
+        :param arrays: {名称: numpy数组}，写为.npy文件
+        :return: 快照代数
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        generation = 1
+        if os.path.exists(self.manifest_path):
+            try:
+                generation = int(self._read_manifest().get('generation', 0)) + 1
+            except (ValueError, OSError):
+                pass
+
+        array_meta = {}
+        for array_name, array in (arrays or {}).items():
+            array = np.ascontiguousarray(array)
+            file_name = '{}.{}.npy'.format(array_name, generation)
+            np.save(os.path.join(self.directory, file_name), array)
+            array_meta[array_name] = {'file': file_name, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+        manifest = {
+            'format': SNAPSHOT_FORMAT,
+            'format_version': SNAPSHOT_FORMAT_VERSION,
+            'name': self.name,
+            'schema_version': self.schema_version,
+            'generation': generation,
+            'saved_at': time.time(),
+            'state': state,
+            'arrays': array_meta,
+        }
+        temp_path = '{}.{}.tmp'.format(self.manifest_path, os.getpid())
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, default=encode_value)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+        self._remove_old_generations(generation)
+        return generation
+
+    def _remove_old_generations(self, generation):
+        suffix = '.{}.npy'.format(generation)
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.npy') and not file_name.endswith(suffix):
+                try:
+                    os.remove(os.path.join(self.directory, file_name))
+                except OSError:
+                    pass
+
+    def load(self, required_keys=(), mmap=True):
+        """
+        加载快照并校验版本
+        :param required_keys: 状态中必须包含的字段
+        :param mmap: 数组是否以只读内存映射方式加载
+        :return: (状态字典, {名称: 数组}, 保存时间)
+        :raises SnapshotError: 快照不存在、已损坏或版本不兼容
+        """
+        if not os.path.exists(self.manifest_path):
+            raise SnapshotError("快照不存在: {}".format(self.manifest_path))
+        try:
+            manifest = self._read_manifest()
+        except (ValueError, OSError) as e:
+            raise SnapshotError("快照清单无法读取: {}".format(str(e)))
+
+        if manifest.get('format') != SNAPSHOT_FORMAT or manifest.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+            raise SnapshotError("快照格式版本不兼容: {} v{}".format(manifest.get('format'), manifest.get('format_version')))
+        if manifest.get('name') != self.name:
+            raise SnapshotError("快照属于其他策略: {}".format(manifest.get('name')))
+        if manifest.get('schema_version') != self.schema_version:
+            raise SnapshotError("策略状态版本不一致: 快照v{}, 当前v{}".format(manifest.get('schema_version'), self.schema_version))
+        state = manifest.get('state') or {}
+        missing = [key for key in required_keys if key not in state]
+        if missing:
+            raise SnapshotError("快照缺少状态字段: {}".format(missing))
+
+        arrays = {}
+        for array_name, meta in manifest.get('arrays', {}).items():
+            path = os.path.join(self.directory, meta['file'])
+            try:
+                array = np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+            except (ValueError, OSError) as e:
+                raise SnapshotError("快照数组{}无法读取: {}".format(array_name, str(e)))
+            if array.dtype.str != meta['dtype'] or list(array.shape) != meta['shape']:
+                raise SnapshotError("快照数组{}与清单不一致".format(array_name))
+            arrays[array_name] = array
+        return state, arrays, manifest.get('saved_at')
+
+    def clear(self):
+        """
+        删除快照
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for file_name in os.listdir(self.directory):
+            if file_name == MANIFEST_NAME or file_name.endswith('.npy'):
+                os.remove(os.path.join(self.directory, file_name))
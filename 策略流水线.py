@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+策略流水线模块
+策略的各处理环节声明为阶段节点：输入数据、上游阶段和重算频率(每个tick/每根K线/每个交易日)，
+调度器每次只运行输入发生变化或上游重新计算过的阶段，互不依赖的阶段可并发执行，未运行阶段沿用上次的输出
+"""
+
+import concurrent.futures
+import time
+
+FREQUENCY_TICK = 'tick'     # 每次调用都可运行
+FREQUENCY_BAR = 'bar'       # 每根K线最多运行一次
+FREQUENCY_DAY = 'day'       # 每个交易日最多运行一次
+FREQUENCIES = (FREQUENCY_TICK, FREQUENCY_BAR, FREQUENCY_DAY)
+
+
+class Stage(object):
+    """
+    流水线阶段
+    :param name: 阶段名称
+    :param func: 阶段函数，调用方式为func(ContextInfo)，返回值作为阶段输出
+    :param inputs: 依赖的输入数据名称，输入指纹变化时重新运行
+    :param after: 上游阶段名称，上游本轮运行过则本阶段也重新运行，且一定在上游之后运行
+    :param frequency: 重算频率上限，'tick'/'bar'/'day'
+    :param condition: 自定义触发条件condition(ContextInfo)，设置后由它决定是否运行，不再比较输入和上游
+    :param concurrent: 是否允许与其他互不依赖的阶段并发运行
+    """
+
+    def __init__(self, name, func, inputs=(), after=(), frequency=FREQUENCY_BAR, condition=None, concurrent=False):
+        if frequency not in FREQUENCIES:
+            raise ValueError("未知的重算频率: {}".format(frequency))
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.after = tuple(after)
+        self.frequency = frequency
+        self.condition = condition
+        self.concurrent = concurrent
+
+        self.output = None
+        self.has_run = False
+        self.last_bar = None
+        self.last_day = None
+        self.last_fingerprints = None
+        self.run_count = 0
+        self.skip_count = 0
+        self.error_count = 0
+        self.seconds = 0.0
+
+
+class StagePipeline(object):
+    """
+    阶段调度器
+    阶段按添加顺序执行（添加时上游必须已存在，因此添加顺序即为合法的拓扑顺序），
+    连续的可并发阶段之间若无依赖则放入线程池一起运行
+    """
+
+    def __init__(self, max_workers=1, logger=print):
+        self.max_workers = max(1, int(max_workers or 1))
+        self.logger = logger
+        self._inputs = {}
+        self._stages = []
+        self._stage_map = {}
+        self._executor = None
+
+    def add_input(self, name, fingerprint):
+        """
+        登记输入数据
+        :param fingerprint: fingerprint(ContextInfo)，返回可比较的值，值不变表示数据未变化
+        """
+        self._inputs[name] = fingerprint
+
+    def add_stage(self, name, func, inputs=(), after=(), frequency=FREQUENCY_BAR, condition=None, concurrent=False):
+        """
+        添加阶段，返回Stage对象
+        """
+        if name in self._stage_map:
+            raise ValueError("阶段重复: {}".format(name))
+        for input_name in inputs:
+            if input_name not in self._inputs:
+                raise ValueError("阶段{}的输入未登记: {}".format(name, input_name))
+        for upstream in after:
+            if upstream not in self._stage_map:
+                raise ValueError("阶段{}的上游阶段需先添加: {}".format(name, upstream))
+        stage = Stage(name, func, inputs, after, frequency, condition, concurrent)
+        self._stages.append(stage)
+        self._stage_map[name] = stage
+        return stage
+
+    def stage(self, name):
+        return self._stage_map[name]
+
+    def output(self, name):
+        """
+        阶段最近一次运行的输出
+        """
+        return self._stage_map[name].output
+
+    def _fingerprints(self, stage, context, cache):
+        values = []
+        for name in stage.inputs:
+            if name not in cache:
+                cache[name] = self._inputs[name](context)
+            values.append(cache[name])
+        return tuple(values)
+
+    def _should_run(self, stage, context, bar_key, day_key, ran, cache):
+        """
+        判断阶段本轮是否需要运行，需要时返回本轮输入指纹，否则返回None
+        """
+        if stage.frequency == FREQUENCY_BAR and stage.has_run and stage.last_bar == bar_key:
+            return None
+        if stage.frequency == FREQUENCY_DAY and stage.has_run and stage.last_day == day_key:
+            return None
+        fingerprints = self._fingerprints(stage, context, cache)
+        if stage.condition is not None:
+            return fingerprints if stage.condition(context) else None
+        if not stage.has_run or not (stage.inputs or stage.after):
+            return fingerprints
+        if fingerprints != stage.last_fingerprints or any(upstream in ran for upstream in stage.after):
+            return fingerprints
+        return None
+
+    def _execute(self, stage, context):
+        start = time.time()
+        try:
+            return True, stage.func(context)
+        except Exception as e:
+            self.logger("阶段{}运行异常: {}".format(stage.name, str(e)))
+            return False, None
+        finally:
+            stage.seconds += time.time() - start
+
+    def _finish(self, stage, ok, output, bar_key, day_key, fingerprints, ran):
+        if not ok:
+            # 失败的阶段不更新状态，下一轮重新运行
+            stage.error_count += 1
+            return
+        stage.output = output
+        stage.has_run = True
+        stage.last_bar = bar_key
+        stage.last_day = day_key
+        stage.last_fingerprints = fingerprints
+        stage.run_count += 1
+        ran.add(stage.name)
+
+    def _run_batch(self, batch, context, bar_key, day_key, ran):
+        if len(batch) == 1 or self.max_workers == 1:
+            for stage, fingerprints in batch:
+                ok, output = self._execute(stage, context)
+                self._finish(stage, ok, output, bar_key, day_key, fingerprints, ran)
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = [(stage, fingerprints, self._executor.submit(self._execute, stage, context))
+                   for stage, fingerprints in batch]
+        for stage, fingerprints, future in futures:
+            ok, output = future.result()
+            self._finish(stage, ok, output, bar_key, day_key, fingerprints, ran)
+
+    def run(self, context, bar_key, day_key):
+        """
+        运行一轮调度
+        :param bar_key: 当前K线标识(如K线时间戳)，用于'bar'频率
+        :param day_key: 当前交易日标识，用于'day'频率
+        :return: 本轮运行过的阶段名称列表
+        """
+        ran = set()
+        cache = {}
+        batch = []
+        batch_names = set()
+        for stage in self._stages:
+            # 依赖于待运行批次中的阶段时，先把批次跑完再判断
+            if batch and (not stage.concurrent or batch_names.intersection(stage.after)):
+                self._run_batch(batch, context, bar_key, day_key, ran)
+                batch = []
+                batch_names = set()
+
+            fingerprints = self._should_run(stage, context, bar_key, day_key, ran, cache)
+            if fingerprints is None:
+                stage.skip_count += 1
+                continue
+            if stage.concurrent:
+                batch.append((stage, fingerprints))
+                batch_names.add(stage.name)
+            else:
+                self._run_batch([(stage, fingerprints)], context, bar_key, day_key, ran)
+        if batch:
+            self._run_batch(batch, context, bar_key, day_key, ran)
+        return [stage.name for stage in self._stages if stage.name in ran]
+
+    def invalidate(self, name=None):
+        """
+        使某个阶段或全部阶段下一轮强制重新运行
+        """
+        stages = self._stages if name is None else [self._stage_map[name]]
+        for stage in stages:
+            stage.has_run = False
+
+    def report(self):
+        """
+        各阶段运行统计文本
+        """
+        lines = ["流水线阶段统计:"]
+        for stage in self._stages:
+            lines.append("  {}({}): 运行{}次, 跳过{}次, 异常{}次, 耗时{:.2f}秒".format(
+                stage.name, stage.frequency, stage.run_count, stage.skip_count, stage.error_count, stage.seconds))
+        return "\n".join(lines)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
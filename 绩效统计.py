@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+绩效统计模块
+每根K线以O(1)更新净值、最大回撤、滚动波动率、夏普比率、换手率、胜率和相对基准的超额收益，
+不保留逐K线的数据；净值曲线逐条追加写入紧凑的二进制文件(每根K线24字节)，实盘重启时由文件恢复累计状态
+成交按平台成交回报(DEAL)记录，同一成交编号只计入一次；持仓成本、成交额和平仓笔数写入净值文件旁的状态文件，
+重启后胜率和换手率接着统计
+
+净值文件格式: 8字节文件头 + 若干条记录，每条记录为小端(int64毫秒时间戳, float64总资产, float64基准价格)，
+基准价格缺失时为nan，可用read_equity_curve读取为numpy结构化数组
+"""
+
+import collections
+import json
+import math
+import os
+import struct
+import threading
+
+import numpy as np
+
+from K线合成 import PERIOD_MINUTES
+
+EQUITY_FILE_HEADER = b'EQCURVE1'
+EQUITY_RECORD = struct.Struct('<qdd')
+EQUITY_DTYPE = np.dtype([('time', '<i8'), ('equity', '<f8'), ('benchmark', '<f8')])
+
+# 成交回报的买卖标志(m_nOffsetFlag)
+DEAL_BUY = 48
+DEAL_SELL = 49
+
+
+def periods_per_year_of(period):
+    """
+    K线周期对应的每年K线数，按每年252个交易日、每日240分钟计算
+    """
+    return 252.0 * PERIOD_MINUTES['1d'] / PERIOD_MINUTES.get(period, PERIOD_MINUTES['1d'])
+
+
+def deal_code(deal):
+    """
+    平台成交对象的股票代码
+    """
+    return deal.m_strInstrumentID + '.' + deal.m_strExchangeID
+
+
+def read_equity_curve(path):
+    """
+    读取净值文件
+    :return: 结构化数组，字段为time(毫秒时间戳)、equity(总资产)、benchmark(基准价格)
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(EQUITY_FILE_HEADER)) != EQUITY_FILE_HEADER:
+            raise ValueError("不是净值文件: {}".format(path))
+        raw = f.read()
+    usable = len(raw) - len(raw) % EQUITY_RECORD.size
+    return np.frombuffer(raw[:usable], dtype=EQUITY_DTYPE)
+
+
+class RunningMoments(object):
+    """
+    Welford算法累计均值和方差
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        # 总体标准差，与本地回测summarize_equity一致
+        return math.sqrt(self.m2 / self.count) if self.count > 1 else 0.0
+
+
+class RollingMoments(object):
+    """
+    固定窗口的滑动均值和方差
+    """
+
+    def __init__(self, window):
+        self.values = collections.deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def add(self, value):
+        if len(self.values) == self.values.maxlen:
+            dropped = self.values[0]
+            self.total -= dropped
+            self.total_sq -= dropped * dropped
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+
+    @property
+    def std(self):
+        n = len(self.values)
+        if n < 2:
+            return 0.0
+        mean = self.total / n
+        return math.sqrt(max(self.total_sq / n - mean * mean, 0.0))
+
+
+class PerformanceTracker(object):
+    """
+    流式绩效统计
+    同一根K线多次update(实盘逐笔行情)只保留最后一次的数值，下一根K线到来(或flush/close)时计入统计
+    :param path: 净值文件路径，None表示不写文件
+    :param periods_per_year: 每年K线数，用于年化
+    :param window: 滚动波动率的K线数
+    :param resume: 为True时读取已有净值文件和状态文件恢复累计状态并继续追加，否则覆盖
+    """
+
+    def __init__(self, path=None, periods_per_year=252, window=20, resume=False, logger=print):
+        self.path = path
+        self.periods_per_year = periods_per_year
+        self.window = window
+        self.logger = logger
+        self._lock = threading.Lock()
+
+        # 净值
+        self.bars = 0
+        self.first_time = None
+        self.last_time = None
+        self.initial_equity = None
+        self.last_equity = None
+        self.equity_sum = 0.0
+        self.peak_nav = 1.0
+        self.max_drawdown = 0.0
+        self.max_drawdown_time = None
+        self.returns = RunningMoments()
+        self.rolling = RollingMoments(window)
+
+        # 基准
+        self.initial_benchmark = None
+        self.last_benchmark = None
+        self.excess_returns = RunningMoments()
+
+        # 成交
+        self.positions = {}         # {股票: [持仓股数, 成本价]}，用于计算每笔卖出的盈亏
+        self.traded_value = 0.0
+        self.closed_trades = 0
+        self.winning_trades = 0
+        self.deal_date = None
+        self.deal_keys = set()      # 当日已计入的成交编号
+
+        self._pending = None
+        self._file = None
+        if path:
+            self._open(resume)
+
+    @property
+    def state_path(self):
+        return self.path + '.state'
+
+    def _open(self, resume):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if resume:
+            self._load_state()
+        if resume and os.path.exists(self.path) and os.path.getsize(self.path) >= len(EQUITY_FILE_HEADER):
+            records = read_equity_curve(self.path)
+            for record in records:
+                self._commit(int(record['time']), float(record['equity']), float(record['benchmark']))
+            self._file = open(self.path, 'r+b')
+            # 截掉异常退出时写了一半的记录，保证后续追加对齐
+            self._file.truncate(len(EQUITY_FILE_HEADER) + len(records) * EQUITY_RECORD.size)
+            self._file.seek(0, os.SEEK_END)
+            if len(records):
+                self.logger("由净值文件恢复{}根K线的绩效统计: {}".format(len(records), self.path))
+        else:
+            self._file = open(self.path, 'wb')
+            self._file.write(EQUITY_FILE_HEADER)
+            self._file.flush()
+            self._save_state()
+
+    def _load_state(self):
+        """
+        读取状态文件中的持仓成本、成交额、平仓笔数和当日已计入的成交编号
+        """
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            self.logger("绩效状态文件读取失败，胜率和换手率重新统计: {}".format(str(e)))
+            return
+        self.positions = dict((stock, list(position)) for stock, position in state.get('positions', {}).items())
+        self.traded_value = float(state.get('traded_value', 0.0))
+        self.closed_trades = int(state.get('closed_trades', 0))
+        self.winning_trades = int(state.get('winning_trades', 0))
+        self.deal_date = state.get('deal_date')
+        self.deal_keys = set(state.get('deal_keys', []))
+
+    def _save_state(self):
+        """
+        状态文件先写临时文件再替换，异常退出时不会留下写了一半的状态
+        """
+        if not self.path:
+            return
+        state = {
+            'positions': self.positions,
+            'traded_value': self.traded_value,
+            'closed_trades': self.closed_trades,
+            'winning_trades': self.winning_trades,
+            'deal_date': self.deal_date,
+            'deal_keys': sorted(self.deal_keys),
+        }
+        temp_path = self.state_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.state_path)
+        except (IOError, OSError) as e:
+            self.logger("绩效状态文件写入失败: {}".format(str(e)))
+
+    def update(self, bar_time, equity, benchmark=None):
+        """
+        更新当前K线的总资产和基准价格
+        :param bar_time: K线毫秒时间戳，早于已计入的K线时忽略(恢复后重复的K线)
+        """
+        if equity is None or not equity > 0:
+            return
+        benchmark = float('nan') if benchmark is None else float(benchmark)
+        with self._lock:
+            if self.last_time is not None and bar_time <= self.last_time:
+                return
+            if self._pending is not None and self._pending[0] != bar_time:
+                self._commit(*self._pending, write=True)
+            self._pending = (int(bar_time), float(equity), benchmark)
+
+    def _commit(self, bar_time, equity, benchmark, write=False):
+        """
+        计入一根K线
+        """
+        if self.initial_equity is None:
+            self.initial_equity = equity
+            self.first_time = bar_time
+        else:
+            ret = equity / self.last_equity - 1
+            self.returns.add(ret)
+            self.rolling.add(ret)
+            if benchmark > 0 and self.last_benchmark:
+                self.excess_returns.add(ret - (benchmark / self.last_benchmark - 1))
+        if benchmark > 0:
+            if self.initial_benchmark is None:
+                self.initial_benchmark = benchmark
+            self.last_benchmark = benchmark
+        else:
+            self.last_benchmark = None
+
+        nav = equity / self.initial_equity
+        self.peak_nav = max(self.peak_nav, nav)
+        drawdown = 1 - nav / self.peak_nav
+        if drawdown > self.max_drawdown:
+            self.max_drawdown = drawdown
+            self.max_drawdown_time = bar_time
+
+        self.bars += 1
+        self.equity_sum += equity
+        self.last_equity = equity
+        self.last_time = bar_time
+        if write and self._file is not None:
+            self._file.write(EQUITY_RECORD.pack(bar_time, equity, benchmark))
+            self._file.flush()
+            self._save_state()
+
+    def record_deals(self, deals, code_of=deal_code):
+        """
+        记录平台成交回报(get_trade_detail_data(账户, 'stock', 'deal'))中尚未计入的成交
+        平台下单接口只返回委托结果，成交数量和价格以成交回报为准；成交编号按交易日去重，换日时清空
+        :param code_of: 成交对象转换为股票代码的函数
+        :return: 本次新计入的成交笔数
+        """
+        count = 0
+        for deal in deals or []:
+            date = str(deal.m_strTradeDate)
+            key = '{}|{}'.format(deal.m_strTradeID, deal.m_strOrderSysID)
+            with self._lock:
+                if date != self.deal_date:
+                    if self.deal_date is not None and date < self.deal_date:
+                        continue
+                    self.deal_date = date
+                    self.deal_keys = set()
+                if key in self.deal_keys:
+                    continue
+                self.deal_keys.add(key)
+            shares = deal.m_nVolume if deal.m_nOffsetFlag == DEAL_BUY else -deal.m_nVolume
+            self.record_fill(code_of(deal), shares, deal.m_dPrice)
+            count += 1
+        return count
+
+    def record_fill(self, stock, shares, price):
+        """
+        记录一笔成交：买入更新持仓成本，卖出按持仓成本计为一笔平仓交易
+        :param shares: 成交股数，卖出为负
+        """
+        if not shares or not price or price != price:
+            return
+        with self._lock:
+            self.traded_value += abs(shares) * price
+            position = self.positions.setdefault(stock, [0, 0.0])
+            volume, cost = position
+            if shares > 0:
+                position[0] = volume + shares
+                position[1] = (volume * cost + shares * price) / position[0]
+                return
+            sold = min(-shares, volume)
+            if sold <= 0:
+                # 不知道成本的持仓(如策略启动前已持有)不计入胜率
+                return
+            self.closed_trades += 1
+            if price > cost:
+                self.winning_trades += 1
+            position[0] = volume - sold
+            if position[0] == 0:
+                del self.positions[stock]
+
+    def flush(self):
+        """
+        将当前K线计入统计
+        """
+        with self._lock:
+            if self._pending is not None:
+                self._commit(*self._pending, write=True)
+                self._pending = None
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            with self._lock:
+                self._save_state()
+            self._file.close()
+            self._file = None
+
+    def metrics(self):
+        """
+        已计入K线的绩效指标
+        """
+        with self._lock:
+            if self.initial_equity is None:
+                return {}
+            nav = self.last_equity / self.initial_equity
+            years = max(self.bars - 1, 1) / self.periods_per_year
+            annualize = math.sqrt(self.periods_per_year)
+            std = self.returns.std
+            average_equity = self.equity_sum / self.bars
+            result = {
+                'bars': self.bars,
+                'final_nav': nav,
+                'total_return': nav - 1,
+                'annual_return': nav ** (1 / years) - 1 if nav > 0 else -1.0,
+                'max_drawdown': self.max_drawdown,
+                'volatility': std * annualize,
+                'rolling_volatility': self.rolling.std * annualize,
+                'sharpe': self.returns.mean / std * annualize if std > 0 else 0.0,
+                'turnover': self.traded_value / average_equity if average_equity > 0 else 0.0,
+                'closed_trades': self.closed_trades,
+                'win_rate': self.winning_trades / self.closed_trades if self.closed_trades else 0.0,
+            }
+            if self.initial_benchmark and self.last_benchmark:
+                benchmark_return = self.last_benchmark / self.initial_benchmark - 1
+                excess_std = self.excess_returns.std
+                result['benchmark_return'] = benchmark_return
+                result['excess_return'] = nav - 1 - benchmark_return
+                result['information_ratio'] = (self.excess_returns.mean / excess_std * annualize
+                                               if excess_std > 0 else 0.0)
+            return result
+
+    def report(self):
+        """
+        绩效统计文本
+        """
+        metrics = self.metrics()
+        if not metrics:
+            return "绩效统计: 暂无数据"
+        text = ("绩效统计: {}根K线, 净值{:.4f}, 年化收益{:.2%}, 最大回撤{:.2%}, 年化波动{:.2%}(近{}根{:.2%}), "
+                "夏普{:.2f}, 换手率{:.2f}, 平仓{}笔, 胜率{:.2%}").format(
+            metrics['bars'], metrics['final_nav'], metrics['annual_return'], metrics['max_drawdown'],
+            metrics['volatility'], self.window, metrics['rolling_volatility'], metrics['sharpe'],
+            metrics['turnover'], metrics['closed_trades'], metrics['win_rate'])
+        if 'excess_return' in metrics:
+            text += ", 基准收益{:.2%}, 超额收益{:.2%}, 信息比率{:.2f}".format(
+                metrics['benchmark_return'], metrics['excess_return'], metrics['information_ratio'])
+        return text
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+证券代码表模块
+会话内把股票代码字符串一次性映射为连续的整数编号，股票池规模的状态存放在按编号索引的numpy数组中，
+只在与平台接口交互(取数、下单、持仓查询)时才转换为代码字符串
+"""
+
+import numpy as np
+
+
+class SymbolTable(object):
+    """
+    股票代码 <-> 整数编号映射表
+    编号从0开始连续分配，会话内不回收，同一代码始终对应同一编号
+    """
+
+    def __init__(self, codes=()):
+        self._ids = {}
+        self._codes = []
+        self._position_keys = {}    # {(证券代码, 市场): 编号}，持仓对象转换时免去字符串拼接
+        self.intern_many(codes)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __contains__(self, code):
+        return code in self._ids
+
+    @property
+    def size(self):
+        return len(self._codes)
+
+    def intern(self, code):
+        """
+        获取代码的编号，新代码分配新编号
+        """
+        sid = self._ids.get(code)
+        if sid is None:
+            sid = len(self._codes)
+            self._ids[code] = sid
+            self._codes.append(code)
+        return sid
+
+    def intern_many(self, codes):
+        """
+        批量获取编号，返回int64数组
+        """
+        return np.fromiter((self.intern(code) for code in codes), dtype=np.int64)
+
+    def id_of(self, code, default=-1):
+        """
+        查询代码编号，不分配新编号
+        """
+        return self._ids.get(code, default)
+
+    def ids_of(self, codes, default=-1):
+        """
+        批量查询编号，未登记的代码为default
+        """
+        ids = self._ids
+        return np.fromiter((ids.get(code, default) for code in codes), dtype=np.int64)
+
+    def code(self, sid):
+        return self._codes[sid]
+
+    def codes(self, ids):
+        """
+        编号数组转换为代码列表
+        """
+        codes = self._codes
+        return [codes[sid] for sid in ids]
+
+    def position_id(self, obj):
+        """
+        平台持仓/成交对象(m_strInstrumentID, m_strExchangeID)的编号
+        """
+        key = (obj.m_strInstrumentID, obj.m_strExchangeID)
+        sid = self._position_keys.get(key)
+        if sid is None:
+            sid = self.intern(obj.m_strInstrumentID + "." + obj.m_strExchangeID)
+            self._position_keys[key] = sid
+        return sid
+
+    def position_code(self, obj):
+        """
+        平台持仓/成交对象的代码字符串，同一代码返回同一个字符串对象
+        """
+        return self._codes[self.position_id(obj)]
+
+
+class SymbolArray(object):
+    """
+    按股票编号索引的数组，编号超出当前长度时自动扩容并以fill填充
+    """
+
+    def __init__(self, table, dtype=np.float64, fill=0):
+        self.table = table
+        self.dtype = np.dtype(dtype)
+        self.fill = fill
+        self.values = np.full(max(len(table), 16), fill, dtype=self.dtype)
+
+    def _ensure(self, size):
+        if size > len(self.values):
+            grown = np.full(max(size, len(self.values) * 2), self.fill, dtype=self.dtype)
+            grown[:len(self.values)] = self.values
+            self.values = grown
+
+    def __getitem__(self, ids):
+        self._ensure(len(self.table))
+        return self.values[ids]
+
+    def __setitem__(self, ids, value):
+        self._ensure(len(self.table))
+        self.values[ids] = value
+
+    def reset(self, fill=None):
+        """
+        全部恢复为填充值
+        """
+        self.values[:] = self.fill if fill is None else fill
+
+    def nonzero_ids(self):
+        """
+        值不为填充值的编号
+        """
+        return np.flatnonzero(self.values[:len(self.table)] != self.fill)
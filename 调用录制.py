@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+调用录制模块
+录制模式下把ContextInfo数据接口(行情、板块成分、持仓查询等)每次调用的参数和结果写入本地录制文件，
+回放模式下相同的调用直接从录制文件返回，不访问平台，并报告录制中缺失的调用；
+调用按(K线位置, 接口名, 参数, 同参数调用序号)标识，结果内容相同的只保存一份，文件以gzip压缩
+"""
+
+import collections
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import threading
+import types
+
+CASSETTE_FORMAT = 'call-cassette'
+CASSETTE_FORMAT_VERSION = 1
+
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+MODES = (MODE_RECORD, MODE_REPLAY)
+
+
+class CassetteMissError(Exception):
+    """
+    回放时录制文件中没有该调用
+    """
+    pass
+
+
+def to_plain(value):
+    """
+    平台返回的对象(如持仓、成交对象)转换为只含m_开头属性的SimpleNamespace，以便写入录制文件
+    """
+    if isinstance(value, list):
+        return [to_plain(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(to_plain(item) for item in value)
+    if isinstance(value, dict):
+        return dict((key, to_plain(item)) for key, item in value.items())
+    if isinstance(value, (str, bytes, int, float, type(None))) or type(value).__module__.split('.')[0] in ('numpy', 'pandas'):
+        return value
+    fields = [name for name in dir(value) if name.startswith('m_')]
+    if fields:
+        return types.SimpleNamespace(**dict((name, getattr(value, name)) for name in fields))
+    return value
+
+
+class CallCassette(object):
+    """
+    调用录制文件
+    :param path: 录制文件路径
+    :param mode: 'record'或'replay'
+    :param clock: 返回当前K线位置的函数，作为调用标识的一部分(同一参数在不同K线的结果可能不同)
+    :param passthrough: 回放缺失时是否调用真实接口(并补录)，否则抛出CassetteMissError
+    """
+
+    def __init__(self, path, mode, clock=None, passthrough=False, logger=print):
+        if mode not in MODES:
+            raise ValueError("未知的录制模式: {}".format(mode))
+        self.path = path
+        self.mode = mode
+        self.clock = clock
+        self.passthrough = passthrough
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._calls = {}            # {调用标识: 结果编号}
+        self._results = []          # 序列化后的(异常, 结果)
+        self._digests = {}          # {结果摘要: 结果编号}
+        self._occurrences = collections.Counter()
+        self.hits = 0
+        self.recorded = 0
+        self.missing = collections.Counter()    # {(接口名, 参数): 缺失次数}
+        if mode == MODE_REPLAY:
+            self.load()
+
+    def load(self):
+        """
+        读取录制文件
+        """
+        if not os.path.exists(self.path):
+            raise CassetteMissError("录制文件不存在: {}".format(self.path))
+        with gzip.open(self.path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('format') != CASSETTE_FORMAT or data.get('format_version') != CASSETTE_FORMAT_VERSION:
+            raise CassetteMissError("录制文件格式不兼容: {}".format(self.path))
+        self._calls = data['calls']
+        self._results = data['results']
+        self._digests = dict((hashlib.sha1(blob).hexdigest(), i) for i, blob in enumerate(self._results))
+
+    def save(self):
+        """
+        写入录制文件（先写临时文件再原子替换）
+        :return: 录制的调用数
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._lock:
+            data = {
+                'format': CASSETTE_FORMAT,
+                'format_version': CASSETTE_FORMAT_VERSION,
+                'calls': dict(self._calls),
+                'results': list(self._results),
+            }
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with gzip.open(temp_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+        return len(data['calls'])
+
+    def _signature(self, name, args, kwargs):
+        return json.dumps([name, list(args), kwargs], sort_keys=True, ensure_ascii=False, default=str)
+
+    def _next_key(self, signature):
+        position = self.clock() if self.clock is not None else None
+        with self._lock:
+            base = (position, signature)
+            occurrence = self._occurrences[base]
+            self._occurrences[base] += 1
+        return '{}|{}|{}'.format(position, occurrence, signature)
+
+    def _store(self, key, outcome):
+        blob = pickle.dumps(outcome, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha1(blob).hexdigest()
+        with self._lock:
+            index = self._digests.get(digest)
+            if index is None:
+                index = len(self._results)
+                self._results.append(blob)
+                self._digests[digest] = index
+            self._calls[key] = index
+            self.recorded += 1
+
+    def call(self, name, func, *args, **kwargs):
+        """
+        按当前模式执行一次调用
+        """
+        signature = self._signature(name, args, kwargs)
+        key = self._next_key(signature)
+        if self.mode == MODE_REPLAY:
+            with self._lock:
+                index = self._calls.get(key)
+            if index is not None:
+                with self._lock:
+                    self.hits += 1
+                error, result = pickle.loads(self._results[index])
+                if error is not None:
+                    raise error
+                return result
+            with self._lock:
+                self.missing[signature] += 1
+            if not self.passthrough or func is None:
+                raise CassetteMissError("录制中没有该调用: {}".format(signature))
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            # 接口异常同样录制，回放时原样抛出
+            self._store(key, (e, None))
+            raise
+        self._store(key, (None, to_plain(result)))
+        return result
+
+    def wrap(self, name, func):
+        """
+        包装单个函数，如平台全局函数get_trade_detail_data
+        """
+        def wrapper(*args, **kwargs):
+            return self.call(name, func, *args, **kwargs)
+        wrapper.__name__ = name
+        return wrapper
+
+    def install(self, context, names):
+        """
+        用录制/回放版本替换context上的数据接口方法
+        """
+        for name in names:
+            setattr(context, name, self.wrap(name, getattr(context, name, None)))
+
+    def report(self):
+        """
+        录制/回放统计文本，回放时列出缺失的调用
+        """
+        if self.mode == MODE_RECORD:
+            return "调用录制: 录制{}次调用, 不同结果{}个, 文件: {}".format(self.recorded, len(self._results), self.path)
+        text = "调用回放: 命中{}次, 缺失{}次".format(self.hits, sum(self.missing.values()))
+        if self.missing:
+            text += ", 缺失的调用: " + "; ".join(
+                "{} x{}".format(signature, count) for signature, count in self.missing.most_common(10))
+        return text
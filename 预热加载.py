@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+预热加载模块
+在init中启动后台线程预先加载历史行情和基础数据，handlebar在数据就绪时直接使用，未就绪时自行加载；
+记录各预热任务的进度、耗时和异常
+"""
+
+import threading
+import time
+
+
+class BackgroundWarmup(object):
+    """
+    后台预热任务
+    任务按添加顺序在一个后台线程中依次执行，任务函数调用方式为func(progress)，
+    progress(done, total)用于报告任务内部进度，返回值作为任务结果
+    """
+
+    def __init__(self, logger=print):
+        self.logger = logger
+        self._tasks = []
+        self._results = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+        self.errors = {}
+        self.durations = {}
+        self.progress = {}      # {任务名称: (已完成, 总数)}
+        self.start_time = None
+        self.end_time = None
+
+    def add(self, name, func):
+        """
+        添加预热任务，需在start之前调用
+        """
+        if self._thread is not None:
+            raise RuntimeError("预热已启动，不能再添加任务")
+        self._tasks.append((name, func))
+
+    def start(self):
+        """
+        启动后台预热线程
+        """
+        if self._thread is not None:
+            return
+        self.start_time = time.time()
+        self._thread = threading.Thread(target=self._run, name='background-warmup')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        for name, func in self._tasks:
+            task_start = time.time()
+
+            def report(done, total, name=name):
+                with self._lock:
+                    self.progress[name] = (done, total)
+                self.logger("预热进度 {}: {}/{}".format(name, done, total))
+
+            try:
+                result = func(report)
+                with self._lock:
+                    self._results[name] = result
+            except Exception as e:
+                with self._lock:
+                    self.errors[name] = str(e)
+                self.logger("预热任务{}失败: {}".format(name, str(e)))
+            self.durations[name] = time.time() - task_start
+            self.logger("预热任务{}结束，耗时{:.2f}秒".format(name, self.durations[name]))
+        self.end_time = time.time()
+        self._done.set()
+        self.logger(self.status())
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    @property
+    def ready(self):
+        """
+        全部预热任务是否已结束(含失败的任务)
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        等待预热结束，返回是否已结束
+        """
+        if self._thread is None:
+            return False
+        return self._done.wait(timeout)
+
+    def is_done(self, name):
+        """
+        某个任务是否已成功完成
+        """
+        with self._lock:
+            return name in self._results
+
+    def result(self, name, default=None):
+        """
+        某个任务的结果，未完成或失败时返回default
+        """
+        with self._lock:
+            return self._results.get(name, default)
+
+    def status(self):
+        """
+        预热状态文本
+        """
+        finished = len(self.durations)
+        if self.start_time is None:
+            return "预热未启动"
+        elapsed = (self.end_time or time.time()) - self.start_time
+        state = "已完成" if self.ready else "进行中"
+        text = "预热{}: 任务{}/{}, 耗时{:.2f}秒".format(state, finished, len(self._tasks), elapsed)
+        if self.errors:
+            text += ", 失败任务: {}".format(", ".join(sorted(self.errors)))
+        return text
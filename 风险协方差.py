@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+风险协方差模块
+对持仓股票和基准指数维护指数加权(EWMA)收益率协方差矩阵，每根K线按最新价格增量更新(n只股票O(n²))，
+不随历史长度增长；由协方差矩阵计算组合波动率、与基准的相关性/贝塔以及各持仓的边际风险贡献，
+用于按风险贡献有针对性地减仓
+"""
+
+import numpy as np
+
+# RiskMetrics日度衰减系数
+DEFAULT_DECAY = 0.94
+
+
+class EWMACovariance(object):
+    """
+    EWMA协方差(零均值)
+    cov = decay * cov + (1 - decay) * r·rᵀ，只更新本次两只股票都有收益率的元素
+    :param decay: 衰减系数
+    :param min_periods: 股票至少有多少个收益率观测后才参与风险计算
+    """
+
+    def __init__(self, decay=DEFAULT_DECAY, min_periods=20):
+        self.decay = decay
+        self.min_periods = min_periods
+        self.codes = []
+        self.index = {}
+        self.cov = np.zeros((0, 0))
+        self.last_price = np.zeros(0)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.last_key = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def _resize(self, codes):
+        """
+        按新的股票列表重排状态，保留已有股票的协方差，新增股票为空
+        """
+        old = [self.index.get(code, -1) for code in codes]
+        keep = np.array([i for i in old if i >= 0], dtype=np.int64)
+        position = np.array([k for k, i in enumerate(old) if i >= 0], dtype=np.int64)
+        size = len(codes)
+        cov = np.zeros((size, size))
+        last_price = np.full(size, np.nan)
+        count = np.zeros(size, dtype=np.int64)
+        if len(keep):
+            cov[np.ix_(position, position)] = self.cov[np.ix_(keep, keep)]
+            last_price[position] = self.last_price[keep]
+            count[position] = self.count[keep]
+        self.codes = list(codes)
+        self.index = dict((code, i) for i, code in enumerate(self.codes))
+        self.cov, self.last_price, self.count = cov, last_price, count
+
+    def set_codes(self, codes):
+        """
+        设置跟踪的股票集合：移除不在codes中的股票，新增股票等待seed或update
+        :return: 新增的股票列表
+        """
+        added = [code for code in codes if code not in self.index]
+        if added or len(codes) != len(self.codes):
+            self._resize(list(codes))
+        return added
+
+    def seed(self, codes, closes):
+        """
+        用历史收盘价初始化新增股票的协方差（只在股票加入时调用一次）
+        已有观测的股票之间保持当前状态，涉及未观测股票的元素用这段历史的EWMA结果填充
+        :param codes: closes各行对应的股票
+        :param closes: (股票数, 时间数)收盘价矩阵，最后一列之后的价格由update继续计入
+        """
+        rows = [self.index[code] for code in codes]
+        closes = np.asarray(closes, dtype=float)
+        if closes.shape[1] < 2:
+            return
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = closes[:, 1:] / closes[:, :-1] - 1
+        valid = np.isfinite(returns)
+        returns = np.where(valid, returns, 0.0)
+        size = len(codes)
+        cov = np.zeros((size, size))
+        for t in range(returns.shape[1]):
+            r = returns[:, t]
+            mask = np.outer(valid[:, t], valid[:, t])
+            cov = np.where(mask, self.decay * cov + (1 - self.decay) * np.outer(r, r), cov)
+        fresh = self.count[rows] == 0
+        replace = fresh[:, None] | fresh[None, :]
+        block = np.ix_(rows, rows)
+        self.cov[block] = np.where(replace, cov, self.cov[block])
+        rows = np.asarray(rows)
+        self.count[rows[fresh]] = valid[fresh].sum(axis=1)
+        last_column = closes.shape[1] - 1 - np.argmax(np.isfinite(closes)[:, ::-1], axis=1)
+        self.last_price[rows[fresh]] = closes[np.arange(size), last_column][fresh]
+
+    def update(self, prices, key=None):
+        """
+        计入一期价格
+        :param prices: {股票: 最新价}，缺失的股票本期不更新
+        :param key: 期标识(如K线时间)，与上次相同时忽略
+        :return: 是否更新
+        """
+        if key is not None and key == self.last_key:
+            return False
+        self.last_key = key
+        price = np.array([prices.get(code, np.nan) for code in self.codes], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = price / self.last_price - 1
+        valid = np.isfinite(returns)
+        returns = np.where(valid, returns, 0.0)
+        mask = np.outer(valid, valid)
+        self.cov = np.where(mask, self.decay * self.cov + (1 - self.decay) * np.outer(returns, returns), self.cov)
+        self.count[valid] += 1
+        priced = np.isfinite(price) & (price > 0)
+        self.last_price[priced] = price[priced]
+        return True
+
+    def ready(self, code):
+        i = self.index.get(code)
+        return i is not None and self.count[i] >= self.min_periods
+
+    def metrics(self, weights, benchmark, periods_per_year=252):
+        """
+        组合风险指标
+        :param weights: {股票: 权重}，只使用观测数已足够的股票
+        :param benchmark: 基准指数代码
+        :return: 指标字典，基准或持仓观测不足时返回None
+            codes/weights: 参与计算的股票及权重
+            volatility: 组合年化波动率
+            asset_volatility/correlation/beta: 各股票年化波动率、与基准的相关系数和贝塔
+            portfolio_correlation/portfolio_beta: 组合与基准的相关系数和贝塔
+            marginal: 边际风险贡献 ∂σ/∂w
+            contribution/contribution_pct: 风险贡献 w·∂σ/∂w 及其占组合波动率的比例
+        """
+        if not self.ready(benchmark):
+            return None
+        codes = [code for code in weights if code != benchmark and self.ready(code)]
+        if not codes:
+            return None
+        ix = np.array([self.index[code] for code in codes])
+        b = self.index[benchmark]
+        w = np.array([weights[code] for code in codes], dtype=float)
+        sigma = self.cov[np.ix_(ix, ix)] * periods_per_year
+        cov_b = self.cov[ix, b] * periods_per_year
+        var_b = self.cov[b, b] * periods_per_year
+        variance = np.maximum(np.diag(sigma), 0)
+
+        sigma_w = sigma.dot(w)
+        portfolio_variance = max(float(w.dot(sigma_w)), 0.0)
+        volatility = np.sqrt(portfolio_variance)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            marginal = sigma_w / volatility if volatility > 0 else np.zeros(len(w))
+            contribution = w * marginal
+            contribution_pct = contribution / volatility if volatility > 0 else np.zeros(len(w))
+            correlation = cov_b / np.sqrt(variance * var_b)
+            beta = cov_b / var_b
+            portfolio_cov_b = float(w.dot(cov_b))
+            portfolio_correlation = portfolio_cov_b / np.sqrt(portfolio_variance * var_b) if volatility > 0 else np.nan
+        return {
+            'codes': codes,
+            'weights': w,
+            'volatility': volatility,
+            'asset_volatility': np.sqrt(variance),
+            'correlation': correlation,
+            'beta': beta,
+            'portfolio_correlation': portfolio_correlation,
+            'portfolio_beta': portfolio_cov_b / var_b if var_b > 0 else np.nan,
+            'marginal': marginal,
+            'contribution': contribution,
+            'contribution_pct': contribution_pct,
+        }
+
+
+def targeted_reduction_ratios(metrics, base_ratio, max_ratio=1.0):
+    """
+    按风险贡献分配减仓比例：风险贡献占比高于持仓权重的股票多减，低于的少减，
+    减仓总市值与统一按base_ratio减仓相同；比例被截断到[0, max_ratio]的部分分摊到其余股票，
+    无法分摊时退回统一比例
+    :return: {股票: 减仓比例}
+    """
+    weights = metrics['weights']
+    total = weights.sum()
+    if total <= 0 or not np.all(np.isfinite(metrics['contribution_pct'])):
+        return dict((code, base_ratio) for code in metrics['codes'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.where(weights > 0, base_ratio * metrics['contribution_pct'] / (weights / total), base_ratio)
+    target = base_ratio * total
+    for _ in range(len(ratios) + 1):
+        ratios = np.clip(ratios, 0.0, max_ratio)
+        gap = target - weights.dot(ratios)
+        if abs(gap) <= 1e-12 * max(total, 1.0):
+            return dict(zip(metrics['codes'], ratios.tolist()))
+        # 减仓不足时由未达上限的股票补足，减仓过多时由未减到0的股票少减
+        free = (weights > 0) & ((ratios < max_ratio) if gap > 0 else (ratios > 0))
+        if not free.any():
+            break
+        ratios = ratios + np.where(free, gap / weights[free].sum(), 0.0)
+    flat = min(max(base_ratio, 0.0), max_ratio)
+    return dict((code, flat) for code in metrics['codes'])